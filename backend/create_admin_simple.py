@@ -9,7 +9,7 @@ import sys
 from pathlib import Path
 import hashlib
 import secrets
-from datetime import datetime
+from datetime import datetime, timezone
 
 # Добавляем родительскую директорию в путь
 current_dir = Path(__file__).parent
@@ -128,8 +128,8 @@ def create_default_admin():
                 "password_hash": get_password_hash(ADMIN_PASSWORD),
                 "last_login": None
             },
-            "created_at": datetime.utcnow().isoformat() + "Z",
-            "updated_at": datetime.utcnow().isoformat() + "Z",
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc),
             "deleted_at": None
         }
         
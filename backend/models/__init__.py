@@ -35,6 +35,7 @@ from .api_models import (
     TokenResponse,
     ExerciseCreate,
     ExerciseUpdate,
+    ExerciseLibraryItem,
     TemplateItemCreate,
     WorkoutCreate,
     WorkoutUpdate,
@@ -93,6 +94,7 @@ __all__ = [
     "TokenResponse",
     "ExerciseCreate",
     "ExerciseUpdate",
+    "ExerciseLibraryItem",
     "TemplateItemCreate",
     "WorkoutCreate",
     "WorkoutUpdate",
@@ -10,6 +10,8 @@ class PaginationParams(BaseModel):
     page_size: int = Field(default=20, ge=1, le=100)
     sort_by: Optional[str] = None
     sort_order: Optional[str] = Field(default="desc", pattern="^(asc|desc)$")
+    # next_cursor из предыдущего ответа; если задан, page не используется
+    cursor: Optional[str] = Field(default=None, max_length=512)
 
 
 class PaginatedResponse(BaseModel):
@@ -19,6 +21,7 @@ class PaginatedResponse(BaseModel):
     page: int
     page_size: int
     total_pages: int
+    next_cursor: Optional[str] = None
 
 
 class UserCreate(BaseModel):
@@ -42,6 +45,8 @@ class UserResponse(BaseModel):
     first_name: Optional[str] = None
     last_name: Optional[str] = None
     avatar_url: Optional[str] = None
+    # Размер в px → URL квадратной версии аватарки
+    avatar_variants: Optional[Dict[str, str]] = None
     iron_points: int = 0
     endurance_points: int = 0
     created_at: datetime
@@ -74,6 +79,17 @@ class ExerciseUpdate(BaseModel):
     default_tracking: Optional[Dict[str, Any]] = None
 
 
+class ExerciseLibraryItem(BaseModel):
+    """Упражнение из общей библиотеки: глобальное или пользовательское"""
+    id: str
+    source: str = Field(pattern="^(global|user)$")
+    name: str
+    muscle_groups: List[str] = Field(default_factory=list)
+    equipment: Optional[str] = None
+    movement_pattern: Optional[str] = None
+    default_tracking: Dict[str, Any] = Field(default_factory=dict)
+
+
 class TemplateItemCreate(BaseModel):
     """Модель для создания элемента шаблона"""
     exercise_id: str
@@ -235,6 +251,8 @@ class FriendResponse(BaseModel):
     display_name: str
     iron_points: int
     endurance_points: int
+    # Миниатюра 64 px для списков
+    avatar_thumb_url: Optional[str] = None
 
 
 class NotificationResponse(BaseModel):
@@ -20,25 +20,14 @@ class BaseDocument(BaseModel):
     deleted_at: Optional[datetime] = None
     
     def to_mongo(self, exclude_none: bool = True) -> Dict[str, Any]:
-        """Конвертирует модель в словарь для MongoDB"""
-        data = self.model_dump(by_alias=True, exclude_none=exclude_none)
-        # Конвертируем datetime в строки для MongoDB
-        for key, value in data.items():
-            if isinstance(value, datetime):
-                data[key] = value.isoformat()
-        return data
+        """Конвертирует модель в словарь для MongoDB (datetime хранятся как BSON date)"""
+        return self.model_dump(by_alias=True, exclude_none=exclude_none)
     
     @classmethod
     def from_mongo(cls, data: Dict[str, Any]) -> "BaseDocument":
         """Создает модель из данных MongoDB"""
         if data is None:
             return None
-        
-        # Конвертируем строки обратно в datetime
-        for key in ['created_at', 'updated_at', 'deleted_at']:
-            if key in data and isinstance(data[key], str):
-                data[key] = datetime.fromisoformat(data[key].replace('Z', '+00:00'))
-        
         return cls(**data)
 
 
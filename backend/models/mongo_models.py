@@ -15,13 +15,18 @@ class User(BaseDocument):
     endurance_points: int = 0
     friend_ids: List[str] = Field(default_factory=list)
     avatar_url: Optional[str] = None
+    avatar_variants: Optional[Dict[str, str]] = None
     auth: Optional[Dict[str, Any]] = None
+    # Растёт при изменении профиля; сверяется с claim "ver" в access токене
+    session_version: int = 0
     
     class Config:
         collection_name = "users"
         indexes = [
             {"key": [("email", 1)], "unique": True},
-            {"key": [("created_at", -1)]}
+            {"key": [("created_at", -1)]},
+            # Лидерборд: активные пользователи по Iron Points
+            {"key": [("deleted_at", 1), ("iron_points", -1)]},
         ]
 
 
@@ -75,7 +80,10 @@ class ExerciseUser(BaseDocument, OwnerMixin):
         indexes = [
             {"key": [("owner_id", 1), ("updated_at", -1)]},
             {"key": [("owner_id", 1), ("deleted_at", 1)]},
-            {"key": [("name", 1)]}
+            {"key": [("name", 1)]},
+            # Other sort_by values of the paginated list
+            {"key": [("owner_id", 1), ("created_at", -1)]},
+            {"key": [("owner_id", 1), ("name", 1)]}
         ]
 
 
@@ -112,7 +120,10 @@ class Workout(BaseDocument, OwnerMixin):
         indexes = [
             {"key": [("owner_id", 1), ("updated_at", -1)]},
             {"key": [("share_code", 1)], "sparse": True},
-            {"key": [("visibility", 1)]}
+            {"key": [("visibility", 1)]},
+            # Other sort_by values of the paginated list
+            {"key": [("owner_id", 1), ("created_at", -1)]},
+            {"key": [("owner_id", 1), ("title", 1)]}
         ]
 
 
@@ -183,6 +194,44 @@ class Notification(BaseDocument, OwnerMixin):
         ]
 
 
+
+class RefreshTokenFamily(BaseModel):
+    """Семейство refresh токенов одного входа (ротация и отзыв)"""
+    id: str = Field(alias="_id")
+    user_id: str
+    current_jti: str
+    created_at: datetime
+    rotated_at: Optional[datetime] = None
+    expires_at: datetime
+    revoked_at: Optional[datetime] = None
+    revoked_reason: Optional[str] = None  # logout / reuse / account_deleted
+
+    class Config:
+        collection_name = "refresh_token_families"
+        indexes = [
+            {"key": [("expires_at", 1)], "expireAfterSeconds": 0},
+            {"key": [("user_id", 1)]},
+        ]
+
+
+class PointsEvent(BaseModel):
+    """Начисление очков (журнал points_ledger), _id = "{user_id}:{idempotency_key}" """
+    id: str = Field(alias="_id")
+    user_id: str
+    idempotency_key: str
+    workout_log_id: Optional[str] = None
+    iron_points: int = 0
+    endurance_points: int = 0
+    # False until the totals on the user document include this event
+    applied: bool = True
+    created_at: datetime
+
+    class Config:
+        collection_name = "points_ledger"
+        indexes = [
+            {"key": [("user_id", 1), ("created_at", -1)]},
+        ]
+
 # Импортируем uuid здесь, чтобы избежать циклического импорта
 import uuid
 from datetime import timezone
\ No newline at end of file
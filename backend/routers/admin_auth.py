@@ -3,7 +3,6 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict, Any
 import jwt
-from passlib.context import CryptContext
 import os
 import sys
 from pathlib import Path
@@ -18,13 +17,19 @@ if str(parent_dir) not in sys.path:
 
 try:
     from backend.models.mongo_models import Admin
+    from backend.services import password_pool
+    from backend.services.rate_limit import by_body_field, by_ip, rate_limit
 except ImportError:
     # If backend.models doesn't work, try direct import
     try:
         from models.mongo_models import Admin
+        from services import password_pool
+        from services.rate_limit import by_body_field, by_ip, rate_limit
     except ImportError:
         # Last resort: try relative import
         from ..models.mongo_models import Admin
+        from ..services import password_pool
+        from ..services.rate_limit import by_body_field, by_ip, rate_limit
 
 router = APIRouter(prefix="/admin/auth", tags=["admin authentication"])
 
@@ -34,7 +39,6 @@ ADMIN_ALGORITHM = "HS256"
 ADMIN_ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 8  # 8 часов для админки
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/admin/auth/login")
 
 # Models
@@ -70,14 +74,6 @@ class AdminTokenResponse(BaseModel):
     expires_in: int
     admin: AdminResponse
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверяет пароль"""
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password: str) -> str:
-    """Хеширует пароль"""
-    return pwd_context.hash(password)
-
 def create_admin_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Создает JWT токен для администратора"""
     to_encode = data.copy()
@@ -173,7 +169,7 @@ async def register_admin(
         role=admin_data.role,
         permissions=admin_data.permissions,
         auth={
-            "password_hash": get_password_hash(admin_data.password),
+            "password_hash": await password_pool.pool.hash(admin_data.password),
             "last_login": datetime.now(timezone.utc)
         }
     )
@@ -192,7 +188,14 @@ async def register_admin(
         updated_at=admin.updated_at
     )
 
-@router.post("/login", response_model=AdminTokenResponse)
+@router.post(
+    "/login",
+    response_model=AdminTokenResponse,
+    dependencies=[
+        Depends(rate_limit("admin_login_ip", by_ip)),
+        Depends(rate_limit("admin_login_account", by_body_field("username"))),
+    ],
+)
 async def login_admin(
     admin_data: AdminLogin,
     db: AsyncIOMotorDatabase = Depends(get_db)
@@ -208,7 +211,7 @@ async def login_admin(
         )
     
     # Проверяем пароль
-    if not verify_password(admin_data.password, admin["auth"]["password_hash"]):
+    if not await password_pool.pool.verify(admin_data.password, admin["auth"]["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
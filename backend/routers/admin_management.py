@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict, Any
 import os
@@ -17,15 +17,21 @@ if str(parent_dir) not in sys.path:
 try:
     from backend.models.mongo_models import Admin
     from backend.routers.admin_auth import get_current_admin
+    from backend.services import api_keys, password_pool
+    from backend.services.pagination import keyset_filter, keyset_page, keyset_sort
 except ImportError:
     # If backend.models doesn't work, try direct import
     try:
         from models.mongo_models import Admin
         from routers.admin_auth import get_current_admin
+        from services import api_keys, password_pool
+        from services.pagination import keyset_filter, keyset_page, keyset_sort
     except ImportError:
         # Last resort: try relative import
         from ..models.mongo_models import Admin
         from .admin_auth import get_current_admin
+        from ..services import api_keys, password_pool
+        from ..services.pagination import keyset_filter, keyset_page, keyset_sort
 
 router = APIRouter(prefix="/admin", tags=["admin management"])
 
@@ -62,6 +68,7 @@ class PaginatedUsersResponse(BaseModel):
     page_size: int = 50
     total_users: int
     is_last_page: bool
+    next_cursor: Optional[str] = None
 
 class UsersCountResponse(BaseModel):
     """Модель ответа с количеством пользователей"""
@@ -117,12 +124,7 @@ async def get_all_admins(
         # Извлекаем last_login из auth поля
         last_login = None
         if admin.get("auth") and isinstance(admin["auth"], dict):
-            last_login_str = admin["auth"].get("last_login")
-            if last_login_str:
-                try:
-                    last_login = datetime.fromisoformat(last_login_str.replace('Z', '+00:00'))
-                except (ValueError, AttributeError):
-                    pass
+            last_login = admin["auth"].get("last_login")
         
         admin_responses.append(AdminUserResponse(
             id=str(admin["_id"]),
@@ -186,8 +188,7 @@ async def update_admin(
         update_fields["full_name"] = update_data.full_name
     
     if update_data.password is not None:
-        from .admin_auth import get_password_hash
-        update_fields["auth.password_hash"] = get_password_hash(update_data.password)
+        update_fields["auth.password_hash"] = await password_pool.pool.hash(update_data.password)
     
     if update_data.role is not None:
         update_fields["role"] = update_data.role
@@ -263,6 +264,7 @@ async def delete_admin(
 @router.get("/users/{page}", response_model=PaginatedUsersResponse)
 async def get_users_page(
     page: int,
+    cursor: Optional[str] = Query(None, max_length=512),
     current_admin: dict = Depends(get_current_admin),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
@@ -271,6 +273,8 @@ async def get_users_page(
     
     Args:
         page: Номер страницы (начинается с 1)
+        cursor: next_cursor предыдущей страницы; если задан, страница
+            продолжается с него без skip, а page только возвращается в ответе
     
     Returns:
         Список пользователей (50 на страницу) с флагом is_last_page
@@ -282,14 +286,16 @@ async def get_users_page(
         )
     
     page_size = 50
-    skip = (page - 1) * page_size
+    skip = 0 if cursor else (page - 1) * page_size
     
     # Получаем общее количество пользователей
     total_users = await db.users.count_documents({})
     
-    # Получаем пользователей для текущей страницы
-    cursor = db.users.find({}).sort("created_at", -1).skip(skip).limit(page_size)
-    users = await cursor.to_list(length=page_size)
+    # Получаем пользователей для текущей страницы (+1, чтобы узнать, есть ли следующая)
+    users = await db.users.find(keyset_filter({}, "created_at", -1, cursor)).sort(
+        keyset_sort("created_at", -1)
+    ).skip(skip).limit(page_size + 1).to_list(length=page_size + 1)
+    users, next_cursor = keyset_page(users, page_size, "created_at", -1)
     
     # Преобразуем пользователей в модель ответа
     user_responses = []
@@ -297,12 +303,7 @@ async def get_users_page(
         # Извлекаем last_login из auth поля
         last_login = None
         if user.get("auth") and isinstance(user["auth"], dict):
-            last_login_str = user["auth"].get("last_login")
-            if last_login_str:
-                try:
-                    last_login = datetime.fromisoformat(last_login_str.replace('Z', '+00:00'))
-                except (ValueError, AttributeError):
-                    pass
+            last_login = user["auth"].get("last_login")
         
         user_responses.append(AdminUserResponse(
             id=str(user["_id"]),
@@ -315,15 +316,13 @@ async def get_users_page(
             last_login=last_login
         ))
     
-    # Проверяем, является ли эта страница последней
-    is_last_page = (skip + len(user_responses)) >= total_users
-    
     return PaginatedUsersResponse(
         users=user_responses,
         page=page,
         page_size=page_size,
         total_users=total_users,
-        is_last_page=is_last_page
+        is_last_page=next_cursor is None,
+        next_cursor=next_cursor
     )
 
 @router.get("/users/count", response_model=UsersCountResponse)
@@ -392,4 +391,20 @@ async def get_admin_stats(
         waitlist_last_24h=waitlist_last_24h,
         server_status="healthy",
         timestamp=datetime.now(timezone.utc)
-    )
\ No newline at end of file
+    )
+
+
+@router.get("/stats/password-pool")
+async def get_password_pool_stats(
+    current_admin: dict = Depends(get_current_admin),
+):
+    """Загрузка пула хеширования паролей (очередь, отказы, среднее время)"""
+    return password_pool.pool.stats()
+
+
+@router.get("/stats/api-keys")
+async def get_api_key_stats(
+    current_admin: dict = Depends(get_current_admin),
+):
+    """Запросы по клиентам (API-ключам) и отклонённые запросы с момента запуска процесса"""
+    return api_keys.stats.snapshot()
@@ -1,9 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, Header, HTTPException, status, UploadFile, File
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 import jwt
-from passlib.context import CryptContext
+import logging
 import os
 import sys
 import shutil
@@ -20,26 +20,44 @@ if str(parent_dir) not in sys.path:
 try:
     from backend.models import UserCreate, UserLogin, UserResponse, TokenResponse
     from backend.models.mongo_models import User
+    from backend.services import avatars, password_pool, points_ledger, principal_cache, refresh_tokens
+    from backend.services.rate_limit import by_body_field, by_ip, rate_limit
 except ImportError:
     # If backend.models doesn't work, try direct import
     try:
         from models import UserCreate, UserLogin, UserResponse, TokenResponse
         from models.mongo_models import User
+        from services import avatars, password_pool, points_ledger, principal_cache, refresh_tokens
+        from services.rate_limit import by_body_field, by_ip, rate_limit
     except ImportError:
         # Last resort: try relative import
         from ..models import UserCreate, UserLogin, UserResponse, TokenResponse
         from ..models.mongo_models import User
+        from ..services import avatars, password_pool, points_ledger, principal_cache, refresh_tokens
+        from ..services.rate_limit import by_body_field, by_ip, rate_limit
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
+logger = logging.getLogger(__name__)
 
 # Конфигурация
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+# Stateless mode: email, display_name, permissions and the session version are
+# embedded in the access token, so endpoints that only need the user id never
+# query MongoDB. The "ver" claim is checked against the principal cache, where
+# a profile change or account deletion leaves the new version (or a tombstone)
+# for the access token lifetime — so the cache must be shared by all workers.
+SESSION_CLAIMS_IN_TOKEN = os.getenv("SESSION_CLAIMS_IN_TOKEN", "false").strip().lower() in ("1", "true", "yes")
+if SESSION_CLAIMS_IN_TOKEN and not principal_cache.is_shared():
+    logger.error(
+        "SESSION_CLAIMS_IN_TOKEN requires PRINCIPAL_CACHE_BACKEND=redis with Redis configured; "
+        "session claims are disabled"
+    )
+    SESSION_CLAIMS_IN_TOKEN = False
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 # New models for additional endpoints
@@ -62,21 +80,37 @@ class PointsRequest(BaseModel):
     """Модель для начисления очков"""
     iron_points: int = 0
     endurance_points: int = 0
+    # За какую тренировку начислены очки; повтор с тем же логом не начисляет второй раз
+    workout_log_id: Optional[str] = None
+    # Явный ключ идемпотентности (иначе — заголовок Idempotency-Key или workout_log_id)
+    idempotency_key: Optional[str] = None
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверяет пароль"""
-    return pwd_context.verify(plain_password, hashed_password)
+def session_claims(user: dict) -> dict:
+    """Claims of the stateless mode, from a users document"""
+    return {
+        "email": user["email"],
+        "display_name": user.get("display_name", ""),
+        "permissions": user.get("permissions", []),
+        "ver": user.get("session_version", 0),
+    }
 
 
-def get_password_hash(password: str) -> str:
-    """Хеширует пароль"""
-    return pwd_context.hash(password)
+def _principal(user: dict) -> dict:
+    return {
+        "id": str(user["_id"]),
+        "email": user["email"],
+        "display_name": user.get("display_name", ""),
+        "permissions": user.get("permissions", []),
+        "ver": user.get("session_version", 0),
+    }
 
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
-    """Создает JWT токен"""
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, user: Optional[dict] = None) -> str:
+    """Создает JWT токен (в режиме SESSION_CLAIMS_IN_TOKEN — с данными пользователя)"""
     to_encode = data.copy()
+    if SESSION_CLAIMS_IN_TOKEN and user is not None:
+        to_encode.update(session_claims(user))
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
@@ -88,7 +122,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 
 
 def create_refresh_token(data: dict) -> str:
-    """Создает refresh токен"""
+    """Создает refresh токен (data содержит sub, fam — семейство, jti — id токена)"""
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     to_encode.update({"exp": expire, "type": "refresh"})
@@ -113,41 +147,89 @@ async def get_db():
         )
     return _db_connection
 
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+
+def decode_access_token(token: str) -> dict:
+    """Проверяет подпись и тип access токена, возвращает payload"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        raise credentials_exception
+    if payload.get("sub") is None or payload.get("type") != "access":
+        raise credentials_exception
+    return payload
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Получает текущего пользователя из токена"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+    payload = decode_access_token(token)
+    user_id: str = payload["sub"]
     
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        token_type: str = payload.get("type")
-        
-        if user_id is None or token_type != "access":
+    principal = await principal_cache.cache.get(user_id)
+    if principal is not None:
+        if principal.get("deleted"):
             raise credentials_exception
-    except jwt.PyJWTError:
-        raise credentials_exception
-    
+        # A token issued after the cached entry carries the newer claims
+        if not (SESSION_CLAIMS_IN_TOKEN and payload.get("ver", -1) > principal.get("ver", 0)):
+            return principal
+
+    # Stateless mode: the token itself carries the principal
+    if SESSION_CLAIMS_IN_TOKEN and "ver" in payload:
+        return {
+            "id": user_id,
+            "email": payload["email"],
+            "display_name": payload.get("display_name", ""),
+            "permissions": payload.get("permissions", []),
+            "ver": payload["ver"],
+        }
+
     # Получаем пользователя из базы данных
-    user = await db.users.find_one({"_id": user_id})
+    user = await db.users.find_one(
+        {"_id": user_id},
+        {"email": 1, "display_name": 1, "permissions": 1, "session_version": 1},
+    )
     if not user:
         raise credentials_exception
     
-    return {
-        "id": str(user["_id"]),
-        "email": user["email"],
-        "display_name": user.get("display_name", ""),
-        "permissions": user.get("permissions", [])
-    }
+    principal = _principal(user)
+    # With claims the entry must outlive tokens issued before a later change
+    ttl_s = ACCESS_TOKEN_EXPIRE_MINUTES * 60 if SESSION_CLAIMS_IN_TOKEN else None
+    await principal_cache.cache.set(user_id, principal, ttl_s=ttl_s)
+    return principal
+
+
+async def get_current_user_id(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+) -> str:
+    """
+    Id текущего пользователя — для эндпоинтов, которым нужен только id.
+    С SESSION_CLAIMS_IN_TOKEN не обращается к базе, только к общему кешу
+    (токены удалённого аккаунта отклоняются).
+    """
+    payload = decode_access_token(token)
+    if SESSION_CLAIMS_IN_TOKEN and "ver" in payload:
+        principal = await principal_cache.cache.get(payload["sub"])
+        if principal is not None and principal.get("deleted"):
+            raise credentials_exception
+        return payload["sub"]
+    # Tokens without claims: same checks as get_current_user (the user exists)
+    return (await get_current_user(token, db))["id"]
 
 
-@router.post("/register", response_model=UserResponse)
+@router.post(
+    "/register",
+    response_model=UserResponse,
+    dependencies=[Depends(rate_limit("auth_register_ip", by_ip))],
+)
 async def register(user_data: UserCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
     """Регистрация нового пользователя"""
     # Проверяем, существует ли пользователь с таким email
@@ -163,7 +245,7 @@ async def register(user_data: UserCreate, db: AsyncIOMotorDatabase = Depends(get
         email=user_data.email,
         display_name=user_data.display_name,
         auth={
-            "password_hash": get_password_hash(user_data.password),
+            "password_hash": await password_pool.pool.hash(user_data.password),
             "last_login": datetime.now(timezone.utc)
         }
     )
@@ -182,7 +264,14 @@ async def register(user_data: UserCreate, db: AsyncIOMotorDatabase = Depends(get
     )
 
 
-@router.post("/login", response_model=TokenResponse)
+@router.post(
+    "/login",
+    response_model=TokenResponse,
+    dependencies=[
+        Depends(rate_limit("auth_login_ip", by_ip)),
+        Depends(rate_limit("auth_login_account", by_body_field("email"))),
+    ],
+)
 async def login(
     user_data: UserLogin,
     db: AsyncIOMotorDatabase = Depends(get_db)
@@ -198,7 +287,7 @@ async def login(
         )
     
     # Проверяем пароль
-    if not verify_password(user_data.password, user["auth"]["password_hash"]):
+    if not await password_pool.pool.verify(user_data.password, user["auth"]["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -215,9 +304,13 @@ async def login(
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": str(user["_id"])},
-        expires_delta=access_token_expires
+        expires_delta=access_token_expires,
+        user=user,
     )
-    refresh_token = create_refresh_token(data={"sub": str(user["_id"])})
+    family_id, jti = await refresh_tokens.start_family(
+        db, str(user["_id"]), timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+    refresh_token = create_refresh_token(data={"sub": str(user["_id"]), "fam": family_id, "jti": jti})
     
     return TokenResponse(
         access_token=access_token,
@@ -232,44 +325,84 @@ async def refresh_token(
     request: RefreshTokenRequest,
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    """Обновление access токена (использует JSON body вместо query parameter)"""
+    """
+    Обновление access токена (использует JSON body вместо query parameter).
+    Refresh токен одноразовый: в ответе приходит новый, старый больше не действует.
+    """
+    invalid_token = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token"
+    )
     try:
         payload = jwt.decode(request.refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        token_type: str = payload.get("type")
-        
-        if user_id is None or token_type != "refresh":
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid refresh token"
-            )
-        
-        # Проверяем, существует ли пользователь
-        user = await db.users.find_one({"_id": user_id})
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="User not found"
-            )
-        
-        # Создаем новый access токен
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(
-            data={"sub": user_id},
-            expires_delta=access_token_expires
+    except jwt.PyJWTError:
+        raise invalid_token
+
+    user_id: str = payload.get("sub")
+    family_id: str = payload.get("fam")
+    jti: str = payload.get("jti")
+    # Tokens issued before rotation existed have no family — log in again
+    if user_id is None or payload.get("type") != "refresh" or not family_id or not jti:
+        raise invalid_token
+
+    # Revoked families (logout, account deletion, reuse) are refused here
+    try:
+        rotated = await refresh_tokens.rotate(
+            db, family_id, jti, timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+        )
+    except refresh_tokens.RefreshTokenReused:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh token was already used; please log in again"
+        )
+    if rotated is None or rotated[0] != user_id:
+        raise invalid_token
+
+    user = None
+    if SESSION_CLAIMS_IN_TOKEN:
+        # Fresh claims (and session version) for the new access token
+        user = await db.users.find_one(
+            {"_id": user_id},
+            {"email": 1, "display_name": 1, "permissions": 1, "session_version": 1},
         )
-        
-        return TokenResponse(
-            access_token=access_token,
-            token_type="bearer",
-            expires_in=ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        if user is None:
+            raise invalid_token
+    
+    # Создаем новый access токен
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user_id},
+        expires_delta=access_token_expires,
+        user=user,
+    )
+    
+    return TokenResponse(
+        access_token=access_token,
+        token_type="bearer",
+        expires_in=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        refresh_token=create_refresh_token(data={"sub": user_id, "fam": family_id, "jti": rotated[1]})
+    )
+
+
+@router.post("/logout")
+async def logout(
+    request: RefreshTokenRequest,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Выход: refresh токен этого устройства (и всё его семейство) отзывается"""
+    try:
+        payload = jwt.decode(
+            request.refresh_token, SECRET_KEY, algorithms=[ALGORITHM],
+            options={"verify_exp": False},
         )
-        
     except jwt.PyJWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid refresh token"
         )
+    if payload.get("type") == "refresh" and payload.get("fam"):
+        await refresh_tokens.revoke_family(db, payload["fam"], "logout")
+    return {"success": True}
 
 
 @router.get("/me", response_model=UserResponse)
@@ -292,6 +425,7 @@ async def get_current_user_info(
         first_name=user.get("first_name"),
         last_name=user.get("last_name"),
         avatar_url=user.get("avatar_url"),
+        avatar_variants=user.get("avatar_variants"),
         iron_points=user.get("iron_points", 0),
         endurance_points=user.get("endurance_points", 0),
         created_at=user.get("created_at", datetime.now(timezone.utc)),
@@ -302,28 +436,31 @@ async def get_current_user_info(
 @router.post("/me/points")
 async def add_points(
     points: PointsRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user: dict = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    """Начислить очки пользователю (IP / EP) после завершения тренировки"""
+    """
+    Начислить очки пользователю (IP / EP) после завершения тренировки.
+    Повтор запроса с тем же ключом возвращает текущие итоги с duplicate: true.
+    """
     if points.iron_points == 0 and points.endurance_points == 0:
         return {"iron_points": 0, "endurance_points": 0}
 
-    inc = {}
-    if points.iron_points:
-        inc["iron_points"] = points.iron_points
-    if points.endurance_points:
-        inc["endurance_points"] = points.endurance_points
-
-    await db.users.update_one(
-        {"_id": current_user["id"]},
-        {"$inc": inc},
-    )
-    user = await db.users.find_one({"_id": current_user["id"]})
-    return {
-        "iron_points": user.get("iron_points", 0),
-        "endurance_points": user.get("endurance_points", 0),
-    }
+    try:
+        return await points_ledger.award(
+            db,
+            current_user["id"],
+            points.iron_points,
+            points.endurance_points,
+            workout_log_id=points.workout_log_id,
+            idempotency_key=points.idempotency_key or idempotency_key,
+        )
+    except points_ledger.UserNotFound:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
 
 
 @router.put("/update", response_model=UserResponse)
@@ -345,7 +482,7 @@ async def update_user(
         update_fields["last_name"] = update_data.last_name
 
     if update_data.password is not None:
-        update_fields["auth.password_hash"] = get_password_hash(update_data.password)
+        update_fields["auth.password_hash"] = await password_pool.pool.hash(update_data.password)
     
     if not update_fields:
         raise HTTPException(
@@ -356,11 +493,16 @@ async def update_user(
     # Добавляем updated_at
     update_fields["updated_at"] = datetime.now(timezone.utc)
     
-    # Обновляем пользователя в базе данных
+    # Обновляем пользователя в базе данных; новая версия сессии делает
+    # claims ранее выданных access токенов устаревшими
     await db.users.update_one(
         {"_id": current_user["id"]},
-        {"$set": update_fields}
+        {"$set": update_fields, "$inc": {"session_version": 1}}
     )
+    await principal_cache.cache.invalidate(current_user["id"])
+    if update_data.password is not None:
+        # Смена пароля завершает все сессии: украденный refresh token перестаёт работать
+        await refresh_tokens.revoke_user(db, current_user["id"], "password_changed")
     
     # Получаем обновленного пользователя
     updated_user = await db.users.find_one({"_id": current_user["id"]})
@@ -369,6 +511,11 @@ async def update_user(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found after update"
         )
+    if SESSION_CLAIMS_IN_TOKEN:
+        # Outlives the old tokens, so their claims are not served again
+        await principal_cache.cache.set(
+            current_user["id"], _principal(updated_user), ttl_s=ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        )
     
     return UserResponse(
         id=str(updated_user["_id"]),
@@ -398,6 +545,15 @@ async def delete_user(
     
     # Удаляем пользователя из базы данных
     result = await db.users.delete_one({"_id": current_user["id"]})
+    if SESSION_CLAIMS_IN_TOKEN:
+        # Tombstone: access tokens with claims would otherwise stay valid
+        await principal_cache.cache.set(
+            current_user["id"], {"id": current_user["id"], "deleted": True},
+            ttl_s=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        )
+    else:
+        await principal_cache.cache.invalidate(current_user["id"])
+    await refresh_tokens.revoke_user(db, current_user["id"], "account_deleted")
     
     if result.deleted_count == 0:
         raise HTTPException(
@@ -412,9 +568,7 @@ async def delete_user(
     }
 
 
-UPLOADS_DIR = Path("/app/uploads/avatars")
 ALLOWED_TYPES = {"image/jpeg", "image/png", "image/webp"}
-MAX_SIZE_BYTES = 5 * 1024 * 1024  # 5 MB
 
 
 @router.post("/me/avatar")
@@ -423,27 +577,30 @@ async def upload_avatar(
     current_user: dict = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    """Загрузка аватарки пользователя"""
+    """
+    Загрузка аватарки пользователя. Сохраняются квадратные WebP-версии
+    (avatar_variants: 64 / 256 / 512 px) с неизменяемыми URL.
+    """
     if file.content_type not in ALLOWED_TYPES:
         raise HTTPException(status_code=400, detail="Only JPEG, PNG and WebP images are allowed")
 
-    content = await file.read()
-    if len(content) > MAX_SIZE_BYTES:
-        raise HTTPException(status_code=400, detail="File size must not exceed 5 MB")
-
-    UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
-
-    ext = "jpg" if file.content_type == "image/jpeg" else file.content_type.split("/")[-1]
-    filename = f"{current_user['id']}.{ext}"
-    filepath = UPLOADS_DIR / filename
-
-    with open(filepath, "wb") as f:
-        f.write(content)
+    user = await db.users.find_one({"_id": current_user["id"]}, {"avatar_url": 1})
+    try:
+        variants = await avatars.process_upload(
+            file, current_user["id"], previous_url=(user or {}).get("avatar_url")
+        )
+    except avatars.AvatarError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    avatar_url = f"/uploads/avatars/{filename}"
+    avatar_url = variants[str(avatars.DEFAULT_SIZE)]
     await db.users.update_one(
         {"_id": current_user["id"]},
-        {"$set": {"avatar_url": avatar_url, "updated_at": datetime.now(timezone.utc).isoformat()}},
+        {"$set": {
+            "avatar_url": avatar_url,
+            "avatar_variants": variants,
+            "updated_at": datetime.now(timezone.utc),
+        }},
     )
+    await principal_cache.cache.invalidate(current_user["id"])
 
-    return {"avatar_url": avatar_url}
\ No newline at end of file
+    return {"avatar_url": avatar_url, "avatar_variants": variants}
\ No newline at end of file
@@ -40,14 +40,6 @@ def set_db_connection(database):
     db = database
 
 
-def _parse_dt(val):
-    if val is None:
-        return datetime.now(timezone.utc)
-    if isinstance(val, datetime):
-        return val
-    return datetime.fromisoformat(str(val).replace("Z", "+00:00"))
-
-
 def _challenge_to_response(doc: dict) -> ChallengeResponse:
     return ChallengeResponse(
         id=str(doc["_id"]),
@@ -59,7 +51,7 @@ def _challenge_to_response(doc: dict) -> ChallengeResponse:
         duration_days=doc.get("duration_days", 7),
         min_participants=doc.get("min_participants", 1),
         is_active=doc.get("is_active", True),
-        created_at=_parse_dt(doc.get("created_at")),
+        created_at=doc.get("created_at") or datetime.now(timezone.utc),
     )
 
 
@@ -69,6 +61,7 @@ def _user_to_friend(doc: dict) -> FriendResponse:
         display_name=doc.get("display_name", ""),
         iron_points=doc.get("iron_points", 0),
         endurance_points=doc.get("endurance_points", 0),
+        avatar_thumb_url=(doc.get("avatar_variants") or {}).get("64"),
     )
 
 
@@ -79,7 +72,7 @@ def _notif_to_response(doc: dict) -> NotificationResponse:
         from_user_id=doc.get("from_user_id", ""),
         from_user_name=doc.get("from_user_name", ""),
         read=doc.get("read", False),
-        created_at=_parse_dt(doc.get("created_at")),
+        created_at=doc.get("created_at") or datetime.now(timezone.utc),
         data=doc.get("data", {}),
     )
 
@@ -145,7 +138,7 @@ async def get_suggestions(
 
     docs = await db.users.find(
         {"_id": {"$nin": excluded}, "deleted_at": None},
-        {"_id": 1, "display_name": 1, "iron_points": 1, "endurance_points": 1},
+        {"_id": 1, "display_name": 1, "iron_points": 1, "endurance_points": 1, "avatar_variants": 1},
     ).to_list(length=50)
 
     sample = random.sample(docs, min(5, len(docs)))
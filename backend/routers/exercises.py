@@ -1,6 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from bisect import bisect_right
 from typing import List, Optional
 from datetime import datetime, timezone
+from pymongo import ReturnDocument
+import re
 import sys
 from pathlib import Path
 
@@ -14,36 +17,50 @@ try:
     from backend.models import (
         ExerciseCreate,
         ExerciseUpdate,
+        ExerciseLibraryItem,
         PaginationParams,
         PaginatedResponse
     )
     from backend.models.mongo_models import ExerciseGlobal, ExerciseUser
-    from backend.routers.auth import get_current_user
+    from backend.routers.auth import get_current_user_id
+    from backend.services import etags
+    from backend.services.exercise_catalog import catalog, sort_key
+    from backend.services.pagination import allowed_sort_field, decode_cursor, encode_cursor, keyset_filter, keyset_page, keyset_sort
 except ImportError:
     # If backend.models doesn't work, try direct import
     try:
         from models import (
             ExerciseCreate,
             ExerciseUpdate,
+            ExerciseLibraryItem,
             PaginationParams,
             PaginatedResponse
         )
         from models.mongo_models import ExerciseGlobal, ExerciseUser
-        from routers.auth import get_current_user
+        from routers.auth import get_current_user_id
+        from services import etags
+        from services.exercise_catalog import catalog, sort_key
+        from services.pagination import allowed_sort_field, decode_cursor, encode_cursor, keyset_filter, keyset_page, keyset_sort
     except ImportError:
         # Last resort: try relative import
         from ..models import (
             ExerciseCreate,
             ExerciseUpdate,
+            ExerciseLibraryItem,
             PaginationParams,
             PaginatedResponse
         )
         from ..models.mongo_models import ExerciseGlobal, ExerciseUser
-        from ..routers.auth import get_current_user
+        from ..routers.auth import get_current_user_id
+        from ..services import etags
+        from ..services.exercise_catalog import catalog, sort_key
+        from ..services.pagination import allowed_sort_field, decode_cursor, encode_cursor, keyset_filter, keyset_page, keyset_sort
 
 router = APIRouter(prefix="/exercises", tags=["exercises"])
 
 db = None
+# sort_by of the paginated list: never null, each with an owner_id index
+SORT_FIELDS = ("updated_at", "created_at", "name")
 
 def set_db_connection(database):
     global db
@@ -52,114 +69,170 @@ def set_db_connection(database):
 
 @router.get("/global", response_model=List[ExerciseGlobal])
 async def get_global_exercises(
-    search: Optional[str] = Query(None, description="Search by name"),
+    request: Request,
+    response: Response,
+    search: Optional[str] = Query(None, max_length=100, description="Search by name, muscle group or equipment (prefix, typo-tolerant)"),
     muscle_group: Optional[str] = Query(None, description="Filter by muscle group"),
     equipment: Optional[str] = Query(None, description="Filter by equipment"),
     limit: int = Query(50, ge=1, le=100),
-    skip: int = Query(0, ge=0)
+    skip: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, max_length=512, description="X-Next-Cursor of the previous page"),
 ):
-    """Получение глобальных упражнений"""
-    filters = {}
-    if search:
-        filters["name"] = {"$regex": search, "$options": "i"}
-    if muscle_group:
-        filters["muscle_groups"] = muscle_group
-    if equipment:
-        filters["equipment"] = equipment
-    
-    exercises = await db.exercises_global.find(
-        filters,
-    ).skip(skip).limit(limit).to_list(length=limit)
-    
-    return [ExerciseGlobal.from_mongo(ex) for ex in exercises]
+    """Получение глобальных упражнений (из каталога в памяти, без запросов к базе).
+    С search — по релевантности, иначе по названию; курсор следующей страницы
+    (без search) возвращается в заголовке X-Next-Cursor. Поддерживает If-None-Match (304)"""
+    await catalog.ensure_loaded(db)
+    # Same catalog and same query → same response
+    etag = etags.weak_etag(catalog.stamp, sorted(request.query_params.multi_items()))
+    if etags.matches(request, etag):
+        return etags.not_modified(etag, etags.PUBLIC)
+    response.headers.update(etags.headers(etag, etags.PUBLIC))
+
+    ranked = bool(search and search.strip())
+    exercises = [
+        ex for ex in (catalog.search(search) if ranked else catalog.all())
+        if (not muscle_group or muscle_group in ex.muscle_groups)
+        and (not equipment or ex.equipment == equipment)
+    ]
+    if ranked:
+        # Relevance order has no stable key to continue from
+        return exercises[skip:skip + limit]
+
+    if cursor:
+        name, last_id = decode_cursor(cursor, "name", 1)
+        skip = bisect_right(exercises, (name, last_id), key=sort_key)
+    page = exercises[skip:skip + limit]
+    if skip + limit < len(exercises):
+        last = sort_key(page[-1])
+        response.headers["X-Next-Cursor"] = encode_cursor("name", 1, last[0], last[1])
+    return page
 
 
 @router.get("/global/{exercise_id}", response_model=ExerciseGlobal)
 async def get_global_exercise(exercise_id: str):
     """Получение конкретного глобального упражнения"""
-    exercise = await db.exercises_global.find_one({"_id": exercise_id})
+    await catalog.ensure_loaded(db)
+    exercise = catalog.get_model(exercise_id)
     if not exercise:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Exercise not found"
         )
-    return ExerciseGlobal.from_mongo(exercise)
+    return exercise
+
+
+# ─── User exercise library ────────────────────────────────────────────────────
+
+USER_EXERCISE_FIELDS = ("name", "muscle_groups", "equipment", "movement_pattern", "default_tracking")
+
+
+def _name_filter(search: str) -> dict:
+    # Escaped: user input never reaches the regex engine as a pattern
+    return {"$regex": re.escape(search.strip()), "$options": "i"}
+
+
+def _library_item(exercise, source: str) -> ExerciseLibraryItem:
+    return ExerciseLibraryItem(source=source, **exercise.model_dump(include={"id", *USER_EXERCISE_FIELDS}))
+
+
+async def _ensure_name_free(user_id: str, name: str, exclude_id: Optional[str] = None) -> None:
+    existing = await db.exercises_user.find_one(
+        {"owner_id": user_id, "deleted_at": None, "name": name},
+        {"_id": 1}
+    )
+    if existing and existing["_id"] != exclude_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Exercise with this name already exists"
+        )
 
 
 @router.get("/user", response_model=PaginatedResponse)
 async def get_user_exercises(
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
     pagination: PaginationParams = Depends(),
-    search: Optional[str] = None,
+    search: Optional[str] = Query(None, max_length=100),
     include_deleted: bool = False
 ):
     """Получение пользовательских упражнений с пагинацией"""
-    user_id = current_user["id"]
     
-    # filters = {"owner_id": user_id}
-    # if not include_deleted:
-    #     filters["deleted_at"] = None
+    filters = {"owner_id": user_id}
+    if not include_deleted:
+        filters["deleted_at"] = None
     
-    # if search:
-    #     filters["name"] = {"$regex": search, "$options": "i"}
+    if search and search.strip():
+        filters["name"] = _name_filter(search)
     
-    # total = await db.exercises_user.count_documents(filters)
+    total = await db.exercises_user.count_documents(filters)
     
-    # sort_field = pagination.sort_by or "updated_at"
-    # sort_order = -1 if pagination.sort_order == "desc" else 1
+    sort_field = allowed_sort_field(pagination.sort_by, SORT_FIELDS, "updated_at")
+    sort_order = -1 if pagination.sort_order == "desc" else 1
     
-    # exercises = await db.exercises_user.find(
-    #     filters,
-    #     {"_id": 0}
-    # ).sort(sort_field, sort_order).skip(
-    #     (pagination.page - 1) * pagination.page_size
-    # ).limit(pagination.page_size).to_list(length=pagination.page_size)
+    query = keyset_filter(filters, sort_field, sort_order, pagination.cursor)
+    skip = 0 if pagination.cursor else (pagination.page - 1) * pagination.page_size
+    exercises = await db.exercises_user.find(query).sort(keyset_sort(sort_field, sort_order)).skip(skip).limit(
+        pagination.page_size + 1
+    ).to_list(length=pagination.page_size + 1)
+    exercises, next_cursor = keyset_page(exercises, pagination.page_size, sort_field, sort_order)
     
-    # items = [ExerciseUser.from_mongo(ex) for ex in exercises]
-    
-    # Заглушка
-    items = [
-        ExerciseUser(
-            id="1",
-            owner_id=user_id,
-            name="Custom Push-up",
-            muscle_groups=["chest", "triceps"],
-            equipment="bodyweight",
-            movement_pattern="push",
-            default_tracking={"primary_metric": "reps"},
-            created_at=datetime.now(timezone.utc),
-            updated_at=datetime.now(timezone.utc)
-        )
-    ]
+    items = [ExerciseUser.from_mongo(ex) for ex in exercises]
     
     return PaginatedResponse(
         items=items,
-        total=1,
+        total=total,
         page=pagination.page,
         page_size=pagination.page_size,
-        total_pages=1
+        total_pages=(total + pagination.page_size - 1) // pagination.page_size,
+        next_cursor=next_cursor
     )
 
 
+@router.get("/library", response_model=List[ExerciseLibraryItem])
+async def get_exercise_library(
+    user_id: str = Depends(get_current_user_id),
+    search: Optional[str] = Query(None, max_length=100),
+    muscle_group: Optional[str] = Query(None),
+    equipment: Optional[str] = Query(None),
+    limit: int = Query(200, ge=1, le=1000)
+):
+    """
+    Общая библиотека для выбора упражнения: глобальные (из каталога в памяти)
+    и пользовательские (один запрос по индексу owner_id + deleted_at).
+    Без search — по названию; с search — сначала свои упражнения, затем глобальные по релевантности
+    """
+    await catalog.ensure_loaded(db)
+    ranked = bool(search and search.strip())
+
+    filters = {"owner_id": user_id, "deleted_at": None}
+    if ranked:
+        filters["name"] = _name_filter(search)
+    if muscle_group:
+        filters["muscle_groups"] = muscle_group
+    if equipment:
+        filters["equipment"] = equipment
+    own = await db.exercises_user.find(filters).sort("name", 1).to_list(length=limit)
+
+    items = [_library_item(ExerciseUser.from_mongo(ex), "user") for ex in own]
+    items.extend(
+        _library_item(ex, "global")
+        for ex in (catalog.search(search) if ranked else catalog.all())
+        if (not muscle_group or muscle_group in ex.muscle_groups)
+        and (not equipment or ex.equipment == equipment)
+    )
+    if not ranked:
+        items.sort(key=lambda item: (item.name.lower(), item.id))
+    return items[:limit]
+
+
 @router.post("/user", response_model=ExerciseUser, status_code=status.HTTP_201_CREATED)
 async def create_user_exercise(
     exercise_data: ExerciseCreate,
-    current_user: dict = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """Создание пользовательского упражнения"""
-    user_id = current_user["id"]
     
     # Проверяем, нет ли уже упражнения с таким именем у пользователя
-    # existing = await db.exercises_user.find_one({
-    #     "owner_id": user_id,
-    #     "name": exercise_data.name,
-    #     "deleted_at": None
-    # })
-    # if existing:
-    #     raise HTTPException(
-    #         status_code=status.HTTP_400_BAD_REQUEST,
-    #         detail="Exercise with this name already exists"
-    #     )
+    await _ensure_name_free(user_id, exercise_data.name)
     
     exercise = ExerciseUser(
         owner_id=user_id,
@@ -170,8 +243,7 @@ async def create_user_exercise(
         default_tracking=exercise_data.default_tracking
     )
     
-    # Сохраняем в базу данных
-    # await db.exercises_user.insert_one(exercise.to_mongo())
+    await db.exercises_user.insert_one(exercise.to_mongo())
     
     return exercise
 
@@ -180,82 +252,55 @@ async def create_user_exercise(
 async def update_user_exercise(
     exercise_id: str,
     exercise_data: ExerciseUpdate,
-    current_user: dict = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """Обновление пользовательского упражнения"""
-    user_id = current_user["id"]
-    
-    # Находим упражнение
-    # exercise = await db.exercises_user.find_one({
-    #     "_id": exercise_id,
-    #     "owner_id": user_id,
-    #     "deleted_at": None
-    # })
-    # if not exercise:
-    #     raise HTTPException(
-    #         status_code=status.HTTP_404_NOT_FOUND,
-    #         detail="Exercise not found"
-    #     )
     
-    # Обновляем поля
     update_data = exercise_data.model_dump(exclude_unset=True)
+    if update_data.get("name"):
+        await _ensure_name_free(user_id, update_data["name"], exclude_id=exercise_id)
     update_data["updated_at"] = datetime.now(timezone.utc)
     
-    # await db.exercises_user.update_one(
-    #     {"_id": exercise_id},
-    #     {"$set": update_data}
-    # )
-    
-    # Получаем обновленное упражнение
-    # updated_exercise = await db.exercises_user.find_one({"_id": exercise_id}, {"_id": 0})
-    
-    # Заглушка
-    updated_exercise = ExerciseUser(
-        id=exercise_id,
-        owner_id=user_id,
-        name=exercise_data.name or "Updated Exercise",
-        muscle_groups=exercise_data.muscle_groups or ["chest"],
-        equipment=exercise_data.equipment,
-        movement_pattern=exercise_data.movement_pattern,
-        default_tracking=exercise_data.default_tracking or {},
-        created_at=datetime.now(timezone.utc),
-        updated_at=datetime.now(timezone.utc)
+    updated_exercise = await db.exercises_user.find_one_and_update(
+        {"_id": exercise_id, "owner_id": user_id, "deleted_at": None},
+        {"$set": update_data},
+        return_document=ReturnDocument.AFTER
     )
+    if not updated_exercise:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Exercise not found"
+        )
     
-    return updated_exercise
+    return ExerciseUser.from_mongo(updated_exercise)
 
 
 @router.delete("/user/{exercise_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user_exercise(
     exercise_id: str,
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
     permanent: bool = Query(False, description="Permanent deletion")
 ):
-    """Удаление пользовательского упражнения"""
-    user_id = current_user["id"]
-    
-    # Находим упражнение
-    # exercise = await db.exercises_user.find_one({
-    #     "_id": exercise_id,
-    #     "owner_id": user_id
-    # })
-    # if not exercise:
-    #     raise HTTPException(
-    #         status_code=status.HTTP_404_NOT_FOUND,
-    #         detail="Exercise not found"
-    #     )
+    """Удаление пользовательского упражнения (по умолчанию мягкое, восстанавливается через /restore)"""
     
     if permanent:
         # Полное удаление
-        # await db.exercises_user.delete_one({"_id": exercise_id})
-        pass
+        result = await db.exercises_user.delete_one({"_id": exercise_id, "owner_id": user_id})
+        found = result.deleted_count > 0
     else:
         # Мягкое удаление
-        # await db.exercises_user.update_one(
-        #     {"_id": exercise_id},
-        #     {"$set": {"deleted_at": datetime.now(timezone.utc)}}
-        # )
-        pass
+        now = datetime.now(timezone.utc)
+        result = await db.exercises_user.update_one(
+            {"_id": exercise_id, "owner_id": user_id, "deleted_at": None},
+            {"$set": {"deleted_at": now, "updated_at": now}}
+        )
+        found = result.matched_count > 0
+    
+    if not found:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Exercise not found"
+        )
     
     return None
 
@@ -263,44 +308,31 @@ async def delete_user_exercise(
 @router.post("/user/{exercise_id}/restore", response_model=ExerciseUser)
 async def restore_user_exercise(
     exercise_id: str,
-    current_user: dict = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """Восстановление удаленного упражнения"""
-    user_id = current_user["id"]
     
-    # Находим удаленное упражнение
-    # exercise = await db.exercises_user.find_one({
-    #     "_id": exercise_id,
-    #     "owner_id": user_id,
-    #     "deleted_at": {"$ne": None}
-    # })
-    # if not exercise:
-    #     raise HTTPException(
-    #         status_code=status.HTTP_404_NOT_FOUND,
-    #         detail="Exercise not found or not deleted"
-    #     )
-    
-    # Восстанавливаем
-    # await db.exercises_user.update_one(
-    #     {"_id": exercise_id},
-    #     {"$set": {"deleted_at": None}}
-    # )
-    
-    # Получаем восстановленное упражнение
-    # restored_exercise = await db.exercises_user.find_one({"_id": exercise_id}, {"_id": 0})
+    exercise = await db.exercises_user.find_one(
+        {"_id": exercise_id, "owner_id": user_id, "deleted_at": {"$ne": None}},
+        {"name": 1}
+    )
+    if not exercise:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Exercise not found or not deleted"
+        )
+    # Пока упражнение было удалено, могло появиться новое с тем же именем
+    await _ensure_name_free(user_id, exercise["name"])
     
-    # Заглушка
-    restored_exercise = ExerciseUser(
-        id=exercise_id,
-        owner_id=user_id,
-        name="Restored Exercise",
-        muscle_groups=["chest"],
-        equipment="barbell",
-        movement_pattern="push",
-        default_tracking={},
-        created_at=datetime.now(timezone.utc),
-        updated_at=datetime.now(timezone.utc),
-        deleted_at=None
+    restored_exercise = await db.exercises_user.find_one_and_update(
+        {"_id": exercise_id, "owner_id": user_id, "deleted_at": {"$ne": None}},
+        {"$set": {"deleted_at": None, "updated_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER
     )
+    if not restored_exercise:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Exercise not found or not deleted"
+        )
     
-    return restored_exercise
\ No newline at end of file
+    return ExerciseUser.from_mongo(restored_exercise)
@@ -1,32 +1,80 @@
+import hashlib
+import logging
 import os
 import re
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel
-from typing import Optional
-from datetime import datetime, timezone
+import uuid
+import zlib
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from pydantic import BaseModel, Field
+from typing import Optional, Tuple
+from datetime import datetime, timedelta, timezone
 import sys
 from pathlib import Path
 
+import aiofiles
+import aiofiles.os
+import numpy as np
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
+
 current_dir = Path(__file__).parent
 parent_dir = current_dir.parent.parent
 if str(parent_dir) not in sys.path:
     sys.path.insert(0, str(parent_dir))
 
 try:
-    from backend.routers.auth import get_current_user
+    from backend.models.postgres_models import IMURecord
+    from backend.routers.auth import get_current_user_id
+    from backend.services.exercise_catalog import catalog, tracking_type
+    from backend.services import imu_analysis, imu_format, imu_jobs, imu_preview, imu_retention
 except ImportError:
     try:
-        from routers.auth import get_current_user
+        from models.postgres_models import IMURecord
+        from routers.auth import get_current_user_id
+        from services.exercise_catalog import catalog, tracking_type
+        from services import imu_analysis, imu_format, imu_jobs, imu_preview, imu_retention
     except ImportError:
-        from ..routers.auth import get_current_user
+        from ..models.postgres_models import IMURecord
+        from ..routers.auth import get_current_user_id
+        from ..services.exercise_catalog import catalog, tracking_type
+        from ..services import imu_analysis, imu_format, imu_jobs, imu_preview, imu_retention
 
 router = APIRouter(prefix="/imu", tags=["imu"])
+logger = logging.getLogger(__name__)
 
 db = None
 UPLOAD_DIR = Path("/app/uploads/imu_logs")
+# Partially uploaded logs live here until the upload is completed
+INCOMING_DIR = UPLOAD_DIR / "_incoming"
+# Raw logs are stored once per content: blobs/ab/<sha256>.txt
+BLOB_DIR = UPLOAD_DIR / "blobs"
+
+# Upper bound for a single chunk body — keeps memory per request bounded
+MAX_CHUNK_BYTES = 1024 * 1024  # 1 MB
+# Largest log accepted. Ingest + analysis peak at ~3.5x the text size per job
+# process, and several run side by side in the backend container (512 MB)
+MAX_LOG_BYTES = 32 * 1024 * 1024  # 32 MB, ~1.5 h at 100 Hz
+# Largest slice returned by the samples endpoints (~20 min at 100 Hz)
+MAX_SAMPLE_ROWS = 120_000
+# Background job that turns an uploaded text log into a recording + metrics
+PROCESS_LOG_JOB = "imu_process_log"
+REHYDRATE_LOG_JOB = "imu_rehydrate_log"
+UPLOAD_SESSION_TTL = timedelta(hours=24)
+# A chunk writer holds the upload for at most this long (dropped connections)
+CHUNK_LOCK_TTL = timedelta(seconds=60)
 
 # Only allow simple filenames — no path traversal
 _SAFE_FILENAME = re.compile(r'^[\w\-\.]+\.txt$')
+_CRC32_HEX = re.compile(r'^[0-9a-fA-F]{8}$')
+_SHA256_HEX = re.compile(r'^[0-9a-fA-F]{64}$')
+
+# Processing results shared by every log with the same content
+_SHARED_RESULT_FIELDS = (
+    "status", "job_id", "samples", "recording_size_bytes",
+    "metrics_summary", "ingest_error", "processed_at",
+    "storage_tier", "archive_path", "archived_at", "rehydrated_at",
+    "rehydrate_job_id",
+)
 
 
 def set_db_connection(database):
@@ -37,49 +85,984 @@ def set_db_connection(database):
 class IMULogUpload(BaseModel):
     filename: str
     content: str
+    session_id: Optional[str] = None
+
+
+class IMUUploadInit(BaseModel):
+    """Начало загрузки лога по частям"""
+    filename: str
+    size_bytes: Optional[int] = Field(default=None, ge=0, le=MAX_LOG_BYTES)
+    # CRC32 всего файла (тот же алгоритм, что в прошивке / WorkoutSyncService)
+    crc32: Optional[str] = None
+    # SHA-256 всего файла: если такой лог уже есть, загружать его не нужно
+    sha256: Optional[str] = None
+    session_id: Optional[str] = None
+
+
+class IMUUploadComplete(BaseModel):
+    """Завершение загрузки лога по частям"""
+    crc32: str
+
+
+class IMUSetLink(BaseModel):
+    """Привязка подхода из лога к SessionSet"""
+    set_id: str
+    exercise_id: Optional[str] = None
+
+
+def _validate_filename(filename: str) -> None:
+    if not _SAFE_FILENAME.match(filename):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid filename. Must be a .txt file with no path components.",
+        )
+
+
+def _validate_crc32(value: str) -> str:
+    if not _CRC32_HEX.match(value):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="crc32 must be 8 hex characters",
+        )
+    return value.lower()
+
+
+def _validate_sha256(value: str) -> str:
+    if not _SHA256_HEX.match(value):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="sha256 must be 64 hex characters",
+        )
+    return value.lower()
+
+
+def _crc32_hex(value: int) -> str:
+    return f"{value & 0xffffffff:08x}"
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Mongo returns naive datetimes unless the client is tz-aware
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _upload_state(doc: dict) -> dict:
+    return {
+        "upload_id": doc["_id"],
+        "filename": doc["filename"],
+        "offset": doc["offset"],
+        "size_bytes": doc.get("size_bytes"),
+        "status": doc["status"],
+        "max_chunk_bytes": MAX_CHUNK_BYTES,
+    }
+
+
+def _blob_path(sha256: str) -> Path:
+    return BLOB_DIR / sha256[:2] / f"{sha256}.txt"
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def _blob_exists(sha256: str) -> bool:
+    blob = await db.imu_blobs.find_one({"_id": sha256}, {"cloud_path": 1})
+    if blob is None:
+        return False
+    # Archived blobs are known content too — they can be rehydrated; so are
+    # recordings whose text log was already pruned
+    path = _blob_path(sha256)
+    return (
+        bool(blob.get("cloud_path"))
+        or await aiofiles.os.path.exists(path)
+        or await aiofiles.os.path.exists(imu_format.recording_path_for(path))
+    )
+
+
+async def _store_blob(data: bytes, sha256: str) -> None:
+    """Writes a blob unless it already exists (identical content, so races are harmless)"""
+    path = _blob_path(sha256)
+    if await _blob_exists(sha256):
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    async with aiofiles.open(tmp_path, "wb") as f:
+        await f.write(data)
+    await aiofiles.os.replace(tmp_path, path)
+
+
+def _duplicate_response(log: dict) -> dict:
+    return {
+        "success": True,
+        "duplicate": True,
+        "log_id": log["_id"],
+        "job_id": log.get("job_id"),
+        "status": log["status"],
+        "filename": log["filename"],
+        "size_bytes": log["size_bytes"],
+    }
+
+
+async def _copy_results(log: dict, source: dict) -> None:
+    """Gives a log the processing results of an earlier log with the same content"""
+    update = {field: source.get(field) for field in _SHARED_RESULT_FIELDS}
+    if source.get("record"):
+        update["record"] = {**source["record"], "session_id": log.get("session_id") or log["_id"]}
+    log.update(update)
+    await db.imu_logs.update_one({"_id": log["_id"]}, {"$set": update})
+
+
+async def _record_log(
+    user_id: str,
+    filename: str,
+    sha256: str,
+    size_bytes: int,
+    session_id: Optional[str] = None,
+) -> Tuple[dict, bool]:
+    """
+    Store metadata in DB so logs are queryable.
+    Returns (log, duplicate): a re-sent log of the same user is returned as is;
+    content already known from another upload reuses its processing results.
+    """
+    existing = await db.imu_logs.find_one({"owner_id": user_id, "sha256": sha256})
+    if existing:
+        await _recover_processing(existing)
+        return existing, True
+
+    now = datetime.now(timezone.utc)
+    blob = await db.imu_blobs.find_one_and_update(
+        {"_id": sha256},
+        {
+            "$setOnInsert": {"path": str(_blob_path(sha256)), "size_bytes": size_bytes, "created_at": now},
+            "$inc": {"ref_count": 1},
+        },
+        upsert=True,
+    )
+    doc = {
+        "_id": str(uuid.uuid4()),
+        "owner_id": user_id,
+        "session_id": session_id,
+        "filename": filename,
+        "size_bytes": size_bytes,
+        "sha256": sha256,
+        "path": str(_blob_path(sha256)),
+        "status": "queued",
+        "job_id": None,
+        "uploaded_at": now,
+    }
+    try:
+        await db.imu_logs.insert_one(doc)
+    except DuplicateKeyError:
+        # The same user sent the same content concurrently (unique owner_id + sha256)
+        await db.imu_blobs.update_one({"_id": sha256}, {"$inc": {"ref_count": -1}})
+        existing = await db.imu_logs.find_one({"owner_id": user_id, "sha256": sha256})
+        return existing, True
+
+    source = None
+    if blob is not None:
+        source = await db.imu_logs.find_one(
+            {"sha256": sha256, "_id": {"$ne": doc["_id"]}},
+            sort=[("uploaded_at", 1)],
+        )
+    if source is None:
+        doc["job_id"] = await _queue_processing(doc)
+    else:
+        # The running job updates every log with this content; copying again
+        # after insert covers a job that finished in between
+        await _copy_results(doc, source)
+        if doc["status"] in ("queued", "processing"):
+            source = await db.imu_logs.find_one({"_id": source["_id"]})
+            await _copy_results(doc, source)
+        await _recover_processing(doc)
+    return doc, False
+
+
+async def _queue_processing(log: dict) -> str:
+    """Queues ingest + analysis of a stored log; the upload request returns right away"""
+    job = await imu_jobs.enqueue(db, PROCESS_LOG_JOB, {"log_id": log["_id"]})
+    await db.imu_logs.update_one({"_id": log["_id"]}, {"$set": {"job_id": job["_id"]}})
+    return job["_id"]
+
+
+async def _processing_abandoned(log: dict) -> bool:
+    """True when no job will ever finish this log: it failed, or its job did"""
+    if log.get("status") == "failed":
+        return True
+    if log.get("status") not in ("queued", "processing"):
+        return False
+    if not log.get("job_id"):
+        # Between insert and enqueue for a moment; only a stale one is lost
+        return _as_utc(log["uploaded_at"]) < datetime.now(timezone.utc) - imu_jobs.JOB_LEASE
+    job = await db[imu_jobs.JOBS_COLLECTION].find_one({"_id": log["job_id"]}, {"status": 1})
+    return job is None or job["status"] == "failed"
+
+
+async def _recover_processing(log: dict) -> None:
+    """A re-upload of content whose processing failed or was lost queues it again"""
+    if not log.get("sha256") or not await _processing_abandoned(log):
+        return
+    # Only one concurrent re-upload wins the claim and queues the job
+    claimed = await db.imu_logs.update_many(
+        {"sha256": log["sha256"], "status": log["status"], "job_id": log.get("job_id")},
+        {"$set": {"status": "queued", "job_id": None, "ingest_error": None}},
+    )
+    if not claimed.modified_count:
+        return
+    job = await imu_jobs.enqueue(db, PROCESS_LOG_JOB, {"log_id": log["_id"]})
+    await db.imu_logs.update_many(
+        {"sha256": log["sha256"], "status": "queued", "job_id": None},
+        {"$set": {"job_id": job["_id"]}},
+    )
+    log.update({"status": "queued", "job_id": job["_id"], "ingest_error": None})
+
+
+async def _process_failed(payload: dict, error: str) -> None:
+    """A job that failed for good must not leave its logs "processing" forever"""
+    log = await db.imu_logs.find_one({"_id": payload["log_id"]}, {"sha256": 1})
+    if not log:
+        return
+    same_content = {"sha256": log["sha256"]} if log.get("sha256") else {"_id": log["_id"]}
+    await db.imu_logs.update_many(
+        # Logs a newer job already finished keep their result
+        {**same_content, "status": {"$in": ["queued", "processing"]}},
+        {"$set": {"status": "failed", "ingest_error": error}},
+    )
+
+
+@imu_jobs.register(PROCESS_LOG_JOB, on_failure=_process_failed)
+async def _process_log_job(payload: dict) -> Optional[dict]:
+    """
+    Parses the stored text log into the columnar format, runs rep/set analysis
+    and attaches the resulting IMURecord and metrics_summary to the imu_logs
+    document. Runs in the background worker; CPU work goes to the process pool.
+    """
+    log = await db.imu_logs.find_one({"_id": payload["log_id"]})
+    if not log:
+        raise imu_jobs.PermanentJobError(f"IMU log {payload['log_id']} not found")
+
+    # Every log with the same content shares the result
+    same_content = {"sha256": log["sha256"]} if log.get("sha256") else {"_id": log["_id"]}
+    raw_path = Path(log["path"])
+    target = imu_format.recording_path_for(raw_path)
+    await db.imu_logs.update_many(same_content, {"$set": {"status": "processing"}})
+    try:
+        info, metrics_summary = await imu_jobs.run_cpu(imu_analysis.process_log, raw_path, target)
+    except imu_format.IMUFormatError as e:
+        logger.warning("IMU ingest failed for %s: %s", raw_path, e)
+        await db.imu_logs.update_many(
+            same_content,
+            {"$set": {"status": "failed", "ingest_error": str(e)}},
+        )
+        raise imu_jobs.PermanentJobError(str(e)) from e
+
+    previews = await imu_jobs.run_cpu(imu_preview.build_previews, target)
+    await _store_previews(_recording_id(log), previews)
+
+    record = IMURecord(
+        session_id=log["_id"],
+        sample_rate_hz=info["sample_rate_hz"],
+        duration_ms=info["duration_ms"],
+        format=info["format"],
+        checksum=info["checksum"],
+        local_path=info["local_path"],
+    ).model_dump()
+    async for other in db.imu_logs.find(same_content, {"session_id": 1}):
+        await db.imu_logs.update_one(
+            {"_id": other["_id"]},
+            {"$set": {
+                "status": "ready",
+                "record": {**record, "session_id": other.get("session_id") or other["_id"]},
+                "samples": info["samples"],
+                "recording_size_bytes": info["size_bytes"],
+                "metrics_summary": metrics_summary,
+                "ingest_error": None,
+                "processed_at": datetime.now(timezone.utc),
+            }},
+        )
+    # Sets already linked to SessionSets get the new numbers
+    async for other in db.imu_logs.find({**same_content, "set_links.0": {"$exists": True}}):
+        await _store_set_metrics(other, other["set_links"])
+    return {"log_id": log["_id"], "samples": info["samples"]}
+
+
+def _recording_id(log: dict) -> str:
+    """Previews belong to the content, not to a particular upload of it"""
+    return log.get("sha256") or log["_id"]
+
+
+async def _store_previews(recording_id: str, previews: dict) -> None:
+    """One imu_previews document per (mode, points) level"""
+    await db.imu_previews.delete_many({"recording_id": recording_id})
+    await db.imu_previews.insert_many([
+        {"recording_id": recording_id, "mode": mode, "points": points, "series": series}
+        for mode, levels in previews.items()
+        for points, series in levels.items()
+    ])
+    imu_preview.cache.invalidate(recording_id)
+
+
+async def _get_open_upload(upload_id: str, user_id: str) -> dict:
+    doc = await db.imu_uploads.find_one({"_id": upload_id, "owner_id": user_id})
+    if not doc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    if doc["status"] != "open":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload already completed")
+    if _as_utc(doc["expires_at"]) < datetime.now(timezone.utc):
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Upload session expired")
+    return doc
 
 
 @router.post("/upload", status_code=status.HTTP_201_CREATED)
 async def upload_imu_log(
     payload: IMULogUpload,
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """
     Принимает текстовый лог IMU-данных, полученный с трекера по BLE.
-    Сохраняет файл в /app/uploads/imu_logs/{user_id}/{filename}.
+    Файл хранится один раз на содержимое: /app/uploads/imu_logs/blobs/ab/{sha256}.txt.
+    Повторная отправка того же лога возвращает уже существующую запись.
+    Для длинных логов используйте загрузку по частям (/imu/uploads).
+    """
+    _validate_filename(payload.filename)
+
+    data = payload.content.encode("utf-8")
+    if len(data) > MAX_LOG_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Log is too large",
+        )
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    existing = await db.imu_logs.find_one({"owner_id": user_id, "sha256": sha256})
+    if existing:
+        await _recover_processing(existing)
+        return _duplicate_response(existing)
+
+    try:
+        await _store_blob(data, sha256)
+    except OSError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to save log: {e}",
+        )
+
+    log, duplicate = await _record_log(user_id, payload.filename, sha256, len(data), payload.session_id)
+    if duplicate:
+        return _duplicate_response(log)
+
+    return {
+        "success": True,
+        "duplicate": False,
+        "log_id": log["_id"],
+        "job_id": log["job_id"],
+        "status": log["status"],
+        "filename": payload.filename,
+        "size_bytes": len(data),
+    }
+
+
+@router.get("/logs/{log_id}")
+async def get_imu_log(
+    log_id: str,
+    current_user_id: str = Depends(get_current_user_id),
+):
+    """Статус обработки лога (queued → processing → ready / failed)"""
+    log = await db.imu_logs.find_one(
+        {"_id": log_id, "owner_id": current_user_id},
+        {"path": 0, "metrics_summary": 0},
+    )
+    if not log:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="IMU log not found")
+
+    job = None
+    if log.get("job_id"):
+        job = await db.imu_jobs.find_one(
+            {"_id": log["job_id"]},
+            {"status": 1, "attempts": 1, "last_error": 1, "run_after": 1},
+        )
+    log["log_id"] = log.pop("_id")
+    log["job"] = job
+    return log
+
+
+@router.get("/logs/{log_id}/preview")
+async def get_imu_log_preview(
+    log_id: str,
+    points: int = Query(512, ge=imu_preview.MIN_POINTS, le=imu_preview.MAX_POINTS),
+    mode: str = Query("lttb", pattern="^(lttb|minmax)$"),
+    current_user_id: str = Depends(get_current_user_id),
+):
     """
-    if not _SAFE_FILENAME.match(payload.filename):
+    Прореженный ряд для графика: не более points точек (LTTB или min/max по корзинам).
+    """
+    log = await db.imu_logs.find_one(
+        {"_id": log_id, "owner_id": current_user_id},
+        {"status": 1, "path": 1, "samples": 1, "sha256": 1, "storage_tier": 1},
+    )
+    if not log:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="IMU log not found")
+    if log.get("status") != "ready":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Log is not processed yet")
+
+    recording_id = _recording_id(log)
+    key = (recording_id, mode, points)
+    series = imu_preview.cache.get(key)
+    if series is None:
+        level = imu_preview.level_for(points)
+        doc = await db.imu_previews.find_one({"recording_id": recording_id, "mode": mode, "points": level})
+        if doc is None:
+            # Logs processed before previews existed: build the levels now
+            _check_hot(log)
+            target = imu_format.recording_path_for(Path(log["path"]))
+            previews = await imu_jobs.run_cpu(imu_preview.build_previews, target)
+            await _store_previews(recording_id, previews)
+            level_series = previews[mode][level]
+        else:
+            level_series = doc["series"]
+        series = await run_in_threadpool(imu_preview.redecimate, level_series, points, mode)
+        imu_preview.cache.put(key, series)
+
+    return {
+        "log_id": log_id,
+        "mode": mode,
+        "points": len(series["t_ms"]),
+        "source_samples": log.get("samples"),
+        **series,
+    }
+
+
+@router.get("/logs/{log_id}/metrics")
+async def get_imu_log_metrics(
+    log_id: str,
+    current_user_id: str = Depends(get_current_user_id),
+):
+    """Повторения, подходы, темп и амплитуда, рассчитанные по логу"""
+    log = await db.imu_logs.find_one(
+        {"_id": log_id, "owner_id": current_user_id},
+        {"metrics_summary": 1, "ingest_error": 1, "session_id": 1, "status": 1},
+    )
+    if not log:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="IMU log not found")
+    if log.get("status") in ("queued", "processing"):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Log is still being processed")
+    if log.get("metrics_summary") is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=log.get("ingest_error") or "Metrics are not available for this log",
+        )
+    return {
+        "log_id": log_id,
+        "session_id": log.get("session_id"),
+        "metrics_summary": log["metrics_summary"],
+    }
+
+
+# ─── Retention ────────────────────────────────────────────────────────────────
+#
+# Old recordings are moved to monthly archives by scripts/imu_retention.py;
+# summaries and previews stay in MongoDB. Raw samples need the recording back.
+
+async def _rehydrate_failed(payload: dict, error: str) -> None:
+    """A failed rehydration leaves the log archived, so it can be requested again"""
+    log = await db.imu_logs.find_one({"_id": payload["log_id"]})
+    if not log:
+        return
+    same_content = {"sha256": log["sha256"]} if log.get("sha256") else {"_id": log["_id"]}
+    await db.imu_logs.update_many(
+        {**same_content, "storage_tier": "rehydrating"},
+        {"$set": {"storage_tier": "archived"}},
+    )
+
+
+@imu_jobs.register(REHYDRATE_LOG_JOB, on_failure=_rehydrate_failed)
+async def _rehydrate_log_job(payload: dict) -> dict:
+    """Restores an archived recording to the hot tier"""
+    log = await db.imu_logs.find_one({"_id": payload["log_id"]})
+    if not log:
+        raise imu_jobs.PermanentJobError(f"IMU log {payload['log_id']} not found")
+    cloud_path = (log.get("record") or {}).get("cloud_path")
+    if not cloud_path:
+        raise imu_jobs.PermanentJobError("Log has no archive location")
+
+    same_content = {"sha256": log["sha256"]} if log.get("sha256") else {"_id": log["_id"]}
+    await run_in_threadpool(imu_retention.restore_recording, cloud_path, log["path"])
+    await db.imu_logs.update_many(
+        same_content,
+        # The archive may have brought the text log back; it is pruned again later
+        {"$set": {"storage_tier": "hot", "rehydrated_at": datetime.now(timezone.utc), "raw_pruned_at": None}},
+    )
+    return {"log_id": log["_id"]}
+
+
+@router.post("/logs/{log_id}/rehydrate", status_code=status.HTTP_202_ACCEPTED)
+async def rehydrate_imu_log(
+    log_id: str,
+    current_user_id: str = Depends(get_current_user_id),
+):
+    """Возвращает архивный лог в «горячее» хранилище (фоновая задача)"""
+    log = await db.imu_logs.find_one({"_id": log_id, "owner_id": current_user_id})
+    if not log:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="IMU log not found")
+    same_content = {"sha256": log["sha256"]} if log.get("sha256") else {"_id": log["_id"]}
+    if log.get("storage_tier") == "rehydrating" and log.get("rehydrate_job_id"):
+        job = await db[imu_jobs.JOBS_COLLECTION].find_one({"_id": log["rehydrate_job_id"]}, {"status": 1})
+        if job is None or job["status"] == "failed":
+            # The job failed before its hook could put the log back
+            await db.imu_logs.update_many(
+                {**same_content, "storage_tier": "rehydrating", "rehydrate_job_id": log["rehydrate_job_id"]},
+                {"$set": {"storage_tier": "archived"}},
+            )
+            log["storage_tier"] = "archived"
+        else:
+            return {"log_id": log_id, "storage_tier": "rehydrating", "job_id": job["_id"]}
+    if log.get("storage_tier") != "archived":
+        return {"log_id": log_id, "storage_tier": log.get("storage_tier") or "hot", "job_id": None}
+
+    claimed = await db.imu_logs.update_many(
+        {**same_content, "storage_tier": "archived"},
+        {"$set": {"storage_tier": "rehydrating", "rehydrate_job_id": None}},
+    )
+    job_id = None
+    if claimed.modified_count:
+        job = await imu_jobs.enqueue(db, REHYDRATE_LOG_JOB, {"log_id": log_id})
+        job_id = job["_id"]
+        await db.imu_logs.update_many(
+            {**same_content, "storage_tier": "rehydrating"},
+            {"$set": {"rehydrate_job_id": job_id}},
+        )
+    return {"log_id": log_id, "storage_tier": "rehydrating", "job_id": job_id}
+
+
+# ─── Random access to recordings ──────────────────────────────────────────────
+#
+# Samples are read from memory-mapped columns: a time window is located with the
+# sparse time index stored in the recording, a set by the row range from the
+# analysis. Reading one set costs the same whatever the length of the session.
+
+async def _get_ready_log(log_id: str, user_id: str) -> dict:
+    log = await db.imu_logs.find_one({"_id": log_id, "owner_id": user_id})
+    if not log:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="IMU log not found")
+    if log.get("status") != "ready":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Log is not processed yet")
+    _check_hot(log)
+    return log
+
+
+def _check_hot(log: dict) -> None:
+    if log.get("storage_tier") in ("archived", "rehydrating"):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "Log is archived; request POST /imu/logs/{log_id}/rehydrate and retry",
+                "storage_tier": log["storage_tier"],
+            },
+        )
+
+
+def _get_log_set(log: dict, set_index: int) -> dict:
+    sets = (log.get("metrics_summary") or {}).get("sets") or []
+    if not 0 <= set_index < len(sets):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Set not found in this log")
+    return sets[set_index]
+
+
+def _check_row_count(rows: int) -> None:
+    if rows > MAX_SAMPLE_ROWS:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid filename. Must be a .txt file with no path components.",
+            detail=f"Window is too large: {rows} samples, at most {MAX_SAMPLE_ROWS} per request",
+        )
+
+
+def _samples_response(log: dict, start_row: int, end_row: int, columns: dict) -> dict:
+    return {
+        "log_id": log["_id"],
+        "start_row": start_row,
+        "end_row": end_row,
+        "samples": end_row - start_row,
+        "t_ms": columns["t_ms"].tolist(),
+        # float32 → shortest decimal that round-trips the logged value
+        **{name: np.round(columns[name].astype(np.float64), 6).tolist() for name in imu_format.SENSOR_COLUMNS},
+    }
+
+
+def _set_record(log: dict, log_set: dict, link: dict) -> dict:
+    """IMURecord of a single set, linked to its SessionSet"""
+    record = log.get("record") or {}
+    return IMURecord(
+        session_id=log.get("session_id") or log["_id"],
+        set_id=link["set_id"],
+        exercise_id=link.get("exercise_id"),
+        sample_rate_hz=record.get("sample_rate_hz", 0),
+        duration_ms=log_set["end_ms"] - log_set["start_ms"],
+        format=record.get("format", imu_format.FORMAT),
+        checksum=record.get("checksum"),
+        local_path=record.get("local_path", ""),
+    ).model_dump()
+
+
+async def _is_imu_exercise(exercise_id: Optional[str]) -> bool:
+    """Velocity metrics only make sense for exercises tracked with the IMU"""
+    if not exercise_id:
+        return True
+    await catalog.ensure_loaded(db)
+    exercise = catalog.get(exercise_id)
+    if not exercise:
+        # User exercises have no catalog entry — keep the numbers
+        return True
+    return tracking_type(exercise) == "imu"
+
+
+async def _store_set_metrics(log: dict, links: list) -> None:
+    """
+    Precomputed VBT numbers per SessionSet (session_set_metrics, _id = set_id),
+    so history is read without touching raw samples.
+    """
+    for link in links:
+        metrics = imu_analysis.set_velocity_metrics(log.get("metrics_summary"), link["set_index"])
+        if metrics is None or not await _is_imu_exercise(link.get("exercise_id")):
+            await db.session_set_metrics.delete_one({"_id": link["set_id"]})
+            continue
+        log_set = log["metrics_summary"]["sets"][link["set_index"]]
+        await db.session_set_metrics.replace_one(
+            {"_id": link["set_id"]},
+            {
+                "owner_id": log["owner_id"],
+                "exercise_id": link.get("exercise_id"),
+                "session_id": log.get("session_id"),
+                "log_id": log["_id"],
+                "set_index": link["set_index"],
+                **metrics,
+                "recorded_at": log["uploaded_at"] + timedelta(milliseconds=log_set["start_ms"]),
+                "updated_at": datetime.now(timezone.utc),
+            },
+            upsert=True,
+        )
+
+
+@router.get("/logs/{log_id}/samples")
+async def get_imu_log_samples(
+    log_id: str,
+    start_ms: int = Query(..., ge=0, description="Начало окна, мс от начала записи"),
+    end_ms: int = Query(..., ge=0, description="Конец окна (не включая), мс от начала записи"),
+    current_user_id: str = Depends(get_current_user_id),
+):
+    """Сырые отсчёты за окно времени [start_ms, end_ms)"""
+    if end_ms <= start_ms:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end_ms must be greater than start_ms")
+    log = await _get_ready_log(log_id, current_user_id)
+    target = imu_format.recording_path_for(Path(log["path"]))
+
+    start_row, end_row = await run_in_threadpool(imu_format.window_rows, target, start_ms, end_ms)
+    _check_row_count(end_row - start_row)
+    columns = await run_in_threadpool(imu_format.read_rows, target, start_row, end_row)
+    return _samples_response(log, start_row, end_row, columns)
+
+
+@router.get("/logs/{log_id}/sets/{set_index}/samples")
+async def get_imu_log_set_samples(
+    log_id: str,
+    set_index: int,
+    current_user_id: str = Depends(get_current_user_id),
+):
+    """Сырые отсчёты одного подхода (по границам из анализа)"""
+    log = await _get_ready_log(log_id, current_user_id)
+    log_set = _get_log_set(log, set_index)
+    _check_row_count(log_set["end_row"] - log_set["start_row"])
+
+    target = imu_format.recording_path_for(Path(log["path"]))
+    columns = await run_in_threadpool(imu_format.read_rows, target, log_set["start_row"], log_set["end_row"])
+    return _samples_response(log, log_set["start_row"], log_set["end_row"], columns)
+
+
+@router.put("/logs/{log_id}/sets/{set_index}")
+async def link_imu_log_set(
+    log_id: str,
+    set_index: int,
+    payload: IMUSetLink,
+    current_user_id: str = Depends(get_current_user_id),
+):
+    """Связывает подход из лога с SessionSet (IMURecord.set_id)"""
+    log = await _get_ready_log(log_id, current_user_id)
+    log_set = _get_log_set(log, set_index)
+
+    link = {"set_index": set_index, "set_id": payload.set_id, "exercise_id": payload.exercise_id}
+    # A SessionSet is recorded by exactly one set of one log
+    await db.imu_logs.update_many(
+        {"owner_id": current_user_id, "set_links.set_id": payload.set_id},
+        {"$pull": {"set_links": {"set_id": payload.set_id}}},
+    )
+    await db.imu_logs.update_one({"_id": log_id}, {"$pull": {"set_links": {"set_index": set_index}}})
+    await db.imu_logs.update_one({"_id": log_id}, {"$push": {"set_links": link}})
+    await _store_set_metrics(log, [link])
+
+    return {**log_set, "set_id": payload.set_id, "record": _set_record(log, log_set, link)}
+
+
+@router.get("/sets/{set_id}/samples")
+async def get_imu_set_samples(
+    set_id: str,
+    current_user_id: str = Depends(get_current_user_id),
+):
+    """Сырые отсчёты подхода по id SessionSet"""
+    log = await db.imu_logs.find_one({"owner_id": current_user_id, "set_links.set_id": set_id})
+    if not log:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No IMU data linked to this set")
+    link = next(link for link in log["set_links"] if link["set_id"] == set_id)
+    response = await get_imu_log_set_samples(log["_id"], link["set_index"], current_user_id)
+    log_set = _get_log_set(log, link["set_index"])
+    return {**response, "set_id": set_id, "record": _set_record(log, log_set, link)}
+
+
+@router.get("/exercises/{exercise_id}/velocity-history")
+async def get_imu_velocity_history(
+    exercise_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    current_user_id: str = Depends(get_current_user_id),
+):
+    """История скорости по подходам упражнения (последние сначала)"""
+    cursor = db.session_set_metrics.find(
+        {"owner_id": current_user_id, "exercise_id": exercise_id},
+        {"owner_id": 0},
+    ).sort("recorded_at", -1).limit(limit)
+    sets = []
+    async for doc in cursor:
+        doc["set_id"] = doc.pop("_id")
+        sets.append(doc)
+    return {"exercise_id": exercise_id, "sets": sets}
+
+
+# ─── Chunked / resumable upload ───────────────────────────────────────────────
+#
+# 1. POST /imu/uploads                        → upload_id (or the existing log if
+#                                               the sha256 is already known)
+# 2. PUT  /imu/uploads/{upload_id}?offset=N   → raw bytes, appended at offset N
+# 3. GET  /imu/uploads/{upload_id}            → current offset (resume after a drop)
+# 4. POST /imu/uploads/{upload_id}/complete   → CRC32 check, file becomes visible
+#
+# Chunks are streamed straight to a partial file; a CRC32 of everything received
+# so far is kept in the upload document so completion can verify the transfer
+# without re-reading. The file is hashed once on completion to store it
+# content-addressed.
+
+@router.post("/uploads", status_code=status.HTTP_201_CREATED)
+async def init_imu_upload(
+    payload: IMUUploadInit,
+    current_user_id: str = Depends(get_current_user_id),
+):
+    """
+    Создаёт сессию загрузки лога по частям.
+    Если передан sha256 уже загруженного лога, сессия не создаётся:
+    ответ содержит duplicate=true и log_id существующей записи.
+    """
+    _validate_filename(payload.filename)
+    expected_crc32 = _validate_crc32(payload.crc32) if payload.crc32 else None
+    expected_sha256 = _validate_sha256(payload.sha256) if payload.sha256 else None
+
+    if expected_sha256 and await _blob_exists(expected_sha256):
+        # Known content: nothing to transfer
+        log, _ = await _record_log(
+            current_user_id,
+            payload.filename,
+            expected_sha256,
+            (await db.imu_blobs.find_one({"_id": expected_sha256}))["size_bytes"],
+            payload.session_id,
         )
+        return _duplicate_response(log)
+
+    now = datetime.now(timezone.utc)
+    doc = {
+        "_id": str(uuid.uuid4()),
+        "owner_id": current_user_id,
+        "filename": payload.filename,
+        "size_bytes": payload.size_bytes,
+        "expected_crc32": expected_crc32,
+        "expected_sha256": expected_sha256,
+        "session_id": payload.session_id,
+        "offset": 0,
+        "crc32": 0,
+        "status": "open",
+        "locked_until": None,
+        "created_at": now,
+        "updated_at": now,
+        "expires_at": now + UPLOAD_SESSION_TTL,
+    }
 
-    user_id = current_user["id"]
-    user_dir = UPLOAD_DIR / user_id
-    user_dir.mkdir(parents=True, exist_ok=True)
+    INCOMING_DIR.mkdir(parents=True, exist_ok=True)
+    async with aiofiles.open(INCOMING_DIR / f"{doc['_id']}.part", "wb"):
+        pass
 
-    file_path = user_dir / payload.filename
+    await db.imu_uploads.insert_one(doc)
+    return _upload_state(doc)
 
+
+@router.get("/uploads/{upload_id}")
+async def get_imu_upload(
+    upload_id: str,
+    current_user_id: str = Depends(get_current_user_id),
+):
+    """Состояние загрузки — с какого смещения продолжать после обрыва связи"""
+    doc = await db.imu_uploads.find_one({"_id": upload_id, "owner_id": current_user_id})
+    if not doc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    return _upload_state(doc)
+
+
+@router.put("/uploads/{upload_id}")
+async def append_imu_upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user_id: str = Depends(get_current_user_id),
+):
+    """
+    Дописывает часть лога (тело запроса — сырые байты) начиная с offset.
+    Повторная отправка той же части после обрыва безопасна.
+    """
+    doc = await _get_open_upload(upload_id, current_user_id)
+
+    # Claim the upload so that two retries of the same chunk never write
+    # into the partial file at the same time
+    now = datetime.now(timezone.utc)
+    claimed = await db.imu_uploads.find_one_and_update(
+        {
+            "_id": upload_id,
+            "status": "open",
+            "offset": offset,
+            "$or": [{"locked_until": None}, {"locked_until": {"$lt": now}}],
+        },
+        {"$set": {"locked_until": now + CHUNK_LOCK_TTL}},
+    )
+    if claimed is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Offset mismatch or chunk in progress", "offset": doc["offset"]},
+        )
+
+    part_path = INCOMING_DIR / f"{upload_id}.part"
+    crc = claimed["crc32"]
+    received = 0
+
+    try:
+        # Overwrite from the acknowledged offset: leftovers of an interrupted
+        # chunk are discarded by the truncates below.
+        async with aiofiles.open(part_path, "r+b") as f:
+            await f.seek(offset)
+            async for piece in request.stream():
+                if not piece:
+                    continue
+                received += len(piece)
+                if received > MAX_CHUNK_BYTES:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"Chunk must not exceed {MAX_CHUNK_BYTES} bytes",
+                    )
+                if offset + received > MAX_LOG_BYTES:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail="Log is too large",
+                    )
+                crc = zlib.crc32(piece, crc)
+                await f.write(piece)
+            await f.truncate()
+    except BaseException:
+        # Bytes past the acknowledged offset were never acknowledged
+        try:
+            await run_in_threadpool(os.truncate, part_path, offset)
+        except OSError:
+            pass
+        await db.imu_uploads.update_one({"_id": upload_id}, {"$set": {"locked_until": None}})
+        raise
+
+    new_offset = offset + received
+    await db.imu_uploads.update_one(
+        {"_id": upload_id},
+        {"$set": {
+            "offset": new_offset,
+            "crc32": crc,
+            "locked_until": None,
+            "updated_at": datetime.now(timezone.utc),
+        }},
+    )
+
+    return {"upload_id": upload_id, "offset": new_offset}
+
+
+@router.post("/uploads/{upload_id}/complete", status_code=status.HTTP_201_CREATED)
+async def complete_imu_upload(
+    upload_id: str,
+    payload: IMUUploadComplete,
+    user_id: str = Depends(get_current_user_id),
+):
+    """Проверяет CRC32 и публикует загруженный лог"""
+    doc = await _get_open_upload(upload_id, user_id)
+    crc32 = _validate_crc32(payload.crc32)
+
+    actual = _crc32_hex(doc["crc32"])
+    if crc32 != actual or (doc.get("expected_crc32") and doc["expected_crc32"] != actual):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"message": "Checksum mismatch", "crc32": actual, "offset": doc["offset"]},
+        )
+    if doc.get("size_bytes") is not None and doc["size_bytes"] != doc["offset"]:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"message": "Size mismatch", "offset": doc["offset"]},
+        )
+
+    claimed = await db.imu_uploads.find_one_and_update(
+        {
+            "_id": upload_id,
+            "status": "open",
+            "offset": doc["offset"],
+            "$or": [{"locked_until": None}, {"locked_until": {"$lt": datetime.now(timezone.utc)}}],
+        },
+        {"$set": {"status": "complete", "updated_at": datetime.now(timezone.utc)}},
+    )
+    if claimed is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload was modified concurrently")
+
+    part_path = INCOMING_DIR / f"{upload_id}.part"
     try:
-        file_path.write_text(payload.content, encoding="utf-8")
+        # Only the acknowledged bytes (the ones the CRC covers) are the log;
+        # a chunk that died mid-write may have left more behind
+        await run_in_threadpool(os.truncate, part_path, doc["offset"])
+        sha256 = await run_in_threadpool(_sha256_file, part_path)
+        if doc.get("expected_sha256") and doc["expected_sha256"] != sha256:
+            await db.imu_uploads.update_one({"_id": upload_id}, {"$set": {"status": "open"}})
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail={"message": "Checksum mismatch", "sha256": sha256, "offset": doc["offset"]},
+            )
+        if await _blob_exists(sha256):
+            # Same content arrived through another upload meanwhile
+            await aiofiles.os.remove(part_path)
+        else:
+            blob_path = _blob_path(sha256)
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            await aiofiles.os.replace(part_path, blob_path)
     except OSError as e:
+        await db.imu_uploads.update_one({"_id": upload_id}, {"$set": {"status": "open"}})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to save log: {e}",
         )
 
-    # Store metadata in DB so logs are queryable
-    if db is not None:
-        await db.imu_logs.insert_one({
-            "owner_id": user_id,
-            "filename": payload.filename,
-            "size_bytes": len(payload.content.encode("utf-8")),
-            "path": str(file_path),
-            "uploaded_at": datetime.now(timezone.utc),
-        })
+    log, duplicate = await _record_log(user_id, doc["filename"], sha256, doc["offset"], doc.get("session_id"))
+    if duplicate:
+        return {**_duplicate_response(log), "crc32": actual}
 
     return {
         "success": True,
-        "filename": payload.filename,
-        "size_bytes": len(payload.content.encode("utf-8")),
+        "duplicate": False,
+        "log_id": log["_id"],
+        "job_id": log["job_id"],
+        "status": log["status"],
+        "filename": doc["filename"],
+        "size_bytes": doc["offset"],
+        "crc32": actual,
     }
@@ -12,16 +12,16 @@ if str(parent_dir) not in sys.path:
 try:
     from backend.models import RoutineCreate, RoutineUpdate, RoutineResponse
     from backend.models.mongo_models import Routine
-    from backend.routers.auth import get_current_user
+    from backend.routers.auth import get_current_user_id
 except ImportError:
     try:
         from models import RoutineCreate, RoutineUpdate, RoutineResponse
         from models.mongo_models import Routine
-        from routers.auth import get_current_user
+        from routers.auth import get_current_user_id
     except ImportError:
         from ..models import RoutineCreate, RoutineUpdate, RoutineResponse
         from ..models.mongo_models import Routine
-        from ..routers.auth import get_current_user
+        from ..routers.auth import get_current_user_id
 
 router = APIRouter(prefix="/routines", tags=["routines"])
 
@@ -59,10 +59,9 @@ async def _compute_streak(user_id: str, routine: dict) -> int:
 
     # Build week → count map  (week key = ISO date of Monday)
     week_counts: dict[str, int] = {}
+    # The $gte on a date only matches BSON dates, never legacy strings
     for log in logs:
         ld = log.get("logged_at")
-        if isinstance(ld, str):
-            ld = datetime.fromisoformat(ld.replace("Z", "+00:00"))
         if ld is None:
             continue
         d = ld.date() if hasattr(ld, "date") else ld
@@ -115,10 +114,9 @@ async def _routine_to_response(r: dict, user_id: str) -> RoutineResponse:
 
 @router.get("", response_model=List[RoutineResponse])
 async def get_routines(
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Получение всех Routines пользователя"""
-    user_id = current_user["id"]
     routines = await db.routines.find(
         {"owner_id": user_id, "deleted_at": None},
     ).sort("updated_at", -1).to_list(length=200)
@@ -128,7 +126,7 @@ async def get_routines(
 @router.post("", response_model=RoutineResponse, status_code=status.HTTP_201_CREATED)
 async def create_routine(
     routine_data: RoutineCreate,
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Создание новой Routine"""
     if len(routine_data.workout_ids) == 0:
@@ -137,8 +135,6 @@ async def create_routine(
             detail="A routine must include at least one workout",
         )
 
-    user_id = current_user["id"]
-
     routine = Routine(
         owner_id=user_id,
         name=routine_data.name,
@@ -155,10 +151,9 @@ async def create_routine(
 @router.get("/{routine_id}", response_model=RoutineResponse)
 async def get_routine(
     routine_id: str,
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Получение конкретной Routine"""
-    user_id = current_user["id"]
     r = await db.routines.find_one({"_id": routine_id, "owner_id": user_id})
     if not r:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Routine not found")
@@ -169,10 +164,9 @@ async def get_routine(
 async def update_routine(
     routine_id: str,
     routine_data: RoutineUpdate,
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Обновление Routine (название, список workouts, workouts_per_week)"""
-    user_id = current_user["id"]
 
     r = await db.routines.find_one({"_id": routine_id, "owner_id": user_id})
     if not r:
@@ -199,10 +193,9 @@ async def update_routine(
 @router.post("/{routine_id}/set-active", response_model=RoutineResponse)
 async def set_active_routine(
     routine_id: str,
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Установить Routine как активную (снимает флаг с остальных)"""
-    user_id = current_user["id"]
 
     r = await db.routines.find_one({"_id": routine_id, "owner_id": user_id})
     if not r:
@@ -228,10 +221,9 @@ async def set_active_routine(
 @router.delete("/{routine_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_routine(
     routine_id: str,
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Удаление Routine"""
-    user_id = current_user["id"]
 
     result = await db.routines.delete_one({"_id": routine_id, "owner_id": user_id})
     if result.deleted_count == 0:
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from typing import List, Optional
 from datetime import datetime, timezone
 import secrets
@@ -19,7 +19,10 @@ try:
         PaginatedResponse
     )
     from backend.models.mongo_models import Workout, TemplateItem
-    from backend.routers.auth import get_current_user
+    from backend.routers.auth import get_current_user_id
+    from backend.services import etags
+    from backend.services.exercise_catalog import catalog, tracking_type
+    from backend.services.pagination import allowed_sort_field, keyset_filter, keyset_page, keyset_sort
 except ImportError:
     try:
         from models import (
@@ -30,7 +33,10 @@ except ImportError:
             PaginatedResponse
         )
         from models.mongo_models import Workout, TemplateItem
-        from routers.auth import get_current_user
+        from routers.auth import get_current_user_id
+        from services import etags
+        from services.exercise_catalog import catalog, tracking_type
+        from services.pagination import allowed_sort_field, keyset_filter, keyset_page, keyset_sort
     except ImportError:
         from ..models import (
             WorkoutCreate,
@@ -40,11 +46,16 @@ except ImportError:
             PaginatedResponse
         )
         from ..models.mongo_models import Workout, TemplateItem
-        from ..routers.auth import get_current_user
+        from ..routers.auth import get_current_user_id
+        from ..services import etags
+        from ..services.exercise_catalog import catalog, tracking_type
+        from ..services.pagination import allowed_sort_field, keyset_filter, keyset_page, keyset_sort
 
 router = APIRouter(prefix="/workouts", tags=["workouts"])
 
 db = None
+# sort_by of the paginated list: never null, each with an owner_id index
+SORT_FIELDS = ("updated_at", "created_at", "title")
 
 
 def set_db_connection(database):
@@ -56,64 +67,66 @@ def set_db_connection(database):
 
 async def _populate_exercise_names(workout_docs: list) -> list:
     """
-    One-shot batch query: collect all unique exercise_ids across all workout
-    documents, fetch their names and default_tracking.type from exercises_global,
-    then attach exercise_name and exercise_type to every item dict.
+    Attach exercise_name and exercise_type (default_tracking.type) to every
+    item dict. Global exercises come from the in-memory catalog; the rest
+    are looked up in exercises_user with one _id $in query.
     Falls back to exercise_id / None if not found.
     """
-    all_ids = list({
+    await catalog.ensure_loaded(db)
+    unknown = list({
         item["exercise_id"]
         for w in workout_docs
         for item in w.get("items", [])
+        if not catalog.get(item["exercise_id"])
     })
-    if not all_ids:
-        return workout_docs
-
-    exercises = await db.exercises_global.find(
-        {"_id": {"$in": all_ids}},
-        {"_id": 1, "name": 1, "default_tracking": 1}
-    ).to_list(length=len(all_ids))
-
-    # id → {name, type}
-    ex_map = {ex["_id"]: {
-        "name": ex["name"],
-        "type": (ex.get("default_tracking") or {}).get("type", "imu").lower(),
-    } for ex in exercises}
-
-    # Fallback: legacy workouts that stored exercise name as exercise_id
-    missing = [eid for eid in all_ids if eid not in ex_map]
-    if missing:
-        by_name = await db.exercises_global.find(
-            {"name": {"$in": missing}},
+    user_exercises = {}
+    if unknown:
+        # Deleted ones too: existing workouts keep showing their names
+        docs = await db.exercises_user.find(
+            {"_id": {"$in": unknown}},
             {"_id": 1, "name": 1, "default_tracking": 1}
-        ).to_list(length=len(missing))
-        for ex in by_name:
-            ex_map[ex["name"]] = {
-                "name": ex["name"],
-                "type": (ex.get("default_tracking") or {}).get("type", "imu").lower(),
-            }
+        ).to_list(length=len(unknown))
+        user_exercises = {ex["_id"]: ex for ex in docs}
 
     for w in workout_docs:
         for item in w.get("items", []):
-            info = ex_map.get(item["exercise_id"])
-            item["exercise_name"] = info["name"] if info else item["exercise_id"]
-            item["exercise_type"] = info["type"] if info else None
+            # Fallback: legacy workouts that stored exercise name as exercise_id
+            ex = (
+                catalog.get(item["exercise_id"])
+                or user_exercises.get(item["exercise_id"])
+                or catalog.find_by_name(item["exercise_id"])
+            )
+            item["exercise_name"] = ex["name"] if ex else item["exercise_id"]
+            item["exercise_type"] = tracking_type(ex) if ex else None
 
     return workout_docs
 
 
+def _etag_part(doc: dict) -> tuple:
+    """What a workout response depends on: its version and the resolved exercise names"""
+    return (
+        doc["_id"],
+        doc.get("updated_at"),
+        doc.get("revision"),
+        # A soft delete only sets deleted_at
+        doc.get("deleted_at"),
+        [(item.get("exercise_name"), item.get("exercise_type")) for item in doc.get("items", [])],
+    )
+
+
 # ─── Endpoints ────────────────────────────────────────────────────────────────
 
 @router.get("", response_model=PaginatedResponse)
 async def get_workouts(
-    current_user: dict = Depends(get_current_user),
+    request: Request,
+    response: Response,
+    user_id: str = Depends(get_current_user_id),
     pagination: PaginationParams = Depends(),
     search: Optional[str] = None,
     visibility: Optional[str] = Query(None, pattern="^(private|unlisted|public)$"),
     include_deleted: bool = False
 ):
-    """Получение Workouts пользователя с пагинацией"""
-    user_id = current_user["id"]
+    """Получение Workouts пользователя с пагинацией. Поддерживает If-None-Match (304)"""
 
     filters = {"owner_id": user_id}
     if not include_deleted:
@@ -130,15 +143,28 @@ async def get_workouts(
 
     total = await db.workouts.count_documents(filters)
 
-    sort_field = pagination.sort_by or "updated_at"
+    sort_field = allowed_sort_field(pagination.sort_by, SORT_FIELDS, "updated_at")
     sort_order = -1 if pagination.sort_order == "desc" else 1
 
+    # Keyset pagination: with a cursor the page starts right after the
+    # previous one; page > 1 without a cursor still skips (older clients)
+    query = keyset_filter(filters, sort_field, sort_order, pagination.cursor)
+    skip = 0 if pagination.cursor else (pagination.page - 1) * pagination.page_size
+
     # NOTE: do NOT pass {"_id": 0} — we need _id to build stable workout IDs
-    docs = await db.workouts.find(filters).sort(sort_field, sort_order).skip(
-        (pagination.page - 1) * pagination.page_size
-    ).limit(pagination.page_size).to_list(length=pagination.page_size)
+    docs = await db.workouts.find(query).sort(keyset_sort(sort_field, sort_order)).skip(skip).limit(
+        pagination.page_size + 1
+    ).to_list(length=pagination.page_size + 1)
+    docs, next_cursor = keyset_page(docs, pagination.page_size, sort_field, sort_order)
 
     docs = await _populate_exercise_names(docs)
+
+    # Checked before building models: a 304 skips validation and serialization
+    etag = etags.weak_etag(request.url.query, total, next_cursor, [_etag_part(d) for d in docs])
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+    response.headers.update(etags.headers(etag))
+
     items = [Workout.from_mongo(w) for w in docs]
 
     return PaginatedResponse(
@@ -146,17 +172,19 @@ async def get_workouts(
         total=total,
         page=pagination.page,
         page_size=pagination.page_size,
-        total_pages=(total + pagination.page_size - 1) // pagination.page_size
+        total_pages=(total + pagination.page_size - 1) // pagination.page_size,
+        next_cursor=next_cursor
     )
 
 
 @router.get("/{workout_id}", response_model=Workout)
 async def get_workout(
     workout_id: str,
-    current_user: dict = Depends(get_current_user)
+    request: Request,
+    response: Response,
+    user_id: str = Depends(get_current_user_id)
 ):
-    """Получение конкретного Workout"""
-    user_id = current_user["id"]
+    """Получение конкретного Workout. Поддерживает If-None-Match (304)"""
 
     doc = await db.workouts.find_one({
         "_id": workout_id,
@@ -175,16 +203,21 @@ async def get_workout(
         )
 
     docs = await _populate_exercise_names([doc])
+
+    etag = etags.weak_etag(_etag_part(docs[0]))
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+    response.headers.update(etags.headers(etag))
+
     return Workout.from_mongo(docs[0])
 
 
 @router.post("", response_model=Workout, status_code=status.HTTP_201_CREATED)
 async def create_workout(
     workout_data: WorkoutCreate,
-    current_user: dict = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """Создание Workout"""
-    user_id = current_user["id"]
 
     items = [
         TemplateItem(
@@ -224,10 +257,9 @@ async def create_workout(
 async def update_workout(
     workout_id: str,
     workout_data: WorkoutUpdate,
-    current_user: dict = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """Обновление Workout"""
-    user_id = current_user["id"]
 
     doc = await db.workouts.find_one({
         "_id": workout_id,
@@ -241,7 +273,7 @@ async def update_workout(
         )
 
     update_fields = workout_data.model_dump(exclude_unset=True)
-    update_fields["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_fields["updated_at"] = datetime.now(timezone.utc)
     if "revision" in update_fields:
         update_fields["revision"] = doc.get("revision", 1) + 1
 
@@ -255,11 +287,10 @@ async def update_workout(
 @router.delete("/{workout_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_workout(
     workout_id: str,
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
     permanent: bool = Query(False, description="Permanent deletion")
 ):
     """Удаление Workout"""
-    user_id = current_user["id"]
 
     doc = await db.workouts.find_one({"_id": workout_id, "owner_id": user_id})
     if not doc:
@@ -273,7 +304,7 @@ async def delete_workout(
     else:
         await db.workouts.update_one(
             {"_id": workout_id},
-            {"$set": {"deleted_at": datetime.now(timezone.utc).isoformat()}}
+            {"$set": {"deleted_at": datetime.now(timezone.utc)}}
         )
 
     return None
@@ -282,10 +313,9 @@ async def delete_workout(
 @router.post("/{workout_id}/duplicate", response_model=Workout)
 async def duplicate_workout(
     workout_id: str,
-    current_user: dict = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """Дублирование Workout"""
-    user_id = current_user["id"]
 
     source = await db.workouts.find_one({
         "_id": workout_id,
@@ -305,7 +335,7 @@ async def duplicate_workout(
     new_doc["title"] = f"{source['title']} (Copy)"
     new_doc["share_code"] = None
     new_doc["visibility"] = "private"
-    now = datetime.now(timezone.utc).isoformat()
+    now = datetime.now(timezone.utc)
     new_doc["created_at"] = now
     new_doc["updated_at"] = now
     new_doc["deleted_at"] = None
@@ -12,16 +12,16 @@ if str(parent_dir) not in sys.path:
 try:
     from backend.models import WorkoutLogCreate, WorkoutLogResponse
     from backend.models.mongo_models import WorkoutLog
-    from backend.routers.auth import get_current_user
+    from backend.routers.auth import get_current_user_id
 except ImportError:
     try:
         from models import WorkoutLogCreate, WorkoutLogResponse
         from models.mongo_models import WorkoutLog
-        from routers.auth import get_current_user
+        from routers.auth import get_current_user_id
     except ImportError:
         from ..models import WorkoutLogCreate, WorkoutLogResponse
         from ..models.mongo_models import WorkoutLog
-        from ..routers.auth import get_current_user
+        from ..routers.auth import get_current_user_id
 
 router = APIRouter(prefix="/workout-logs", tags=["workout-logs"])
 
@@ -35,11 +35,7 @@ def set_db_connection(database):
 
 def _log_to_response(doc: dict) -> WorkoutLogResponse:
     logged_at = doc.get("logged_at", doc.get("created_at", datetime.now(timezone.utc)))
-    if isinstance(logged_at, str):
-        logged_at = datetime.fromisoformat(logged_at.replace("Z", "+00:00"))
     created_at = doc.get("created_at", datetime.now(timezone.utc))
-    if isinstance(created_at, str):
-        created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
     return WorkoutLogResponse(
         id=str(doc["_id"]),
         workout_name=doc["workout_name"],
@@ -55,10 +51,9 @@ def _log_to_response(doc: dict) -> WorkoutLogResponse:
 @router.get("", response_model=List[WorkoutLogResponse])
 async def get_workout_logs(
     limit: int = 50,
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Получение журнала тренировок пользователя"""
-    user_id = current_user["id"]
     logs = await db.workout_logs.find(
         {"owner_id": user_id},
     ).sort("logged_at", -1).to_list(length=limit)
@@ -68,10 +63,9 @@ async def get_workout_logs(
 @router.post("", response_model=WorkoutLogResponse, status_code=status.HTTP_201_CREATED)
 async def create_workout_log(
     log_data: WorkoutLogCreate,
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Добавить запись о тренировке"""
-    user_id = current_user["id"]
 
     logged_at = log_data.logged_at or datetime.now(timezone.utc)
 
@@ -92,10 +86,9 @@ async def create_workout_log(
 @router.delete("/{log_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_workout_log(
     log_id: str,
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_current_user_id),
 ):
     """Удалить запись о тренировке"""
-    user_id = current_user["id"]
     result = await db.workout_logs.delete_one({"_id": log_id, "owner_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Log entry not found")
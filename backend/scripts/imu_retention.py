@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Move old IMU recordings to monthly archives (and back).
+
+Usage:
+    # Inside Docker container (recommended for prod), e.g. nightly from cron:
+    docker compose exec backend python scripts/imu_retention.py compact
+
+    # See what would be archived, with a custom age:
+    python scripts/imu_retention.py compact --days 30 --dry-run
+
+    # Restore the recording of one log right away (no job queue):
+    python scripts/imu_retention.py rehydrate <log_id>
+
+Archives go to IMU_ARCHIVE_DIR (one zip per user per month); logs older than
+IMU_RETENTION_DAYS are archived by default. compact also deletes text logs
+uploaded more than IMU_RAW_LOG_DAYS ago (--raw-days) whose columnar recording
+exists, trims the unpacked column cache and deletes partial uploads whose
+session expired. Summaries and previews stay in
+MongoDB. Safe to rerun: members already in an archive are not written twice.
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent.parent
+if str(ROOT_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR.parent))
+load_dotenv(ROOT_DIR / ".env")
+
+try:
+    from backend.services import imu_retention
+except ImportError:
+    sys.path.insert(0, str(ROOT_DIR))
+    from services import imu_retention
+
+
+async def compact(db, args):
+    print(f"\n=== Archiving IMU recordings older than {args.days} days into {imu_retention.ARCHIVE_DIR} ===\n")
+    stats = await imu_retention.compact(db, older_than_days=args.days, dry_run=args.dry_run, limit=args.limit)
+    verb = "would be archived" if args.dry_run else "archived"
+    print(f"  {stats['recordings']} recordings {verb} into {stats['archives']} archives")
+    if not args.dry_run:
+        print(f"  {stats['bytes_freed'] / 1e6:.1f} MB freed")
+
+    print(f"\n=== Deleting text logs older than {args.raw_days} days (columnar copy kept) ===\n")
+    stats = await imu_retention.prune_raw_logs(db, older_than_days=args.raw_days, dry_run=args.dry_run)
+    verb = "would be deleted" if args.dry_run else "deleted"
+    print(f"  {stats['logs']} text logs {verb}")
+    if not args.dry_run:
+        print(f"  {stats['bytes_freed'] / 1e6:.1f} MB freed (text logs and column cache)")
+
+    print(f"\n=== Deleting abandoned partial uploads in {imu_retention.INCOMING_DIR} ===\n")
+    stats = await imu_retention.sweep_incoming(db, dry_run=args.dry_run)
+    verb = "would be deleted" if args.dry_run else "deleted"
+    print(f"  {stats['parts']} partial uploads {verb}")
+    if not args.dry_run:
+        print(f"  {stats['bytes_freed'] / 1e6:.1f} MB freed")
+
+
+async def rehydrate(db, args):
+    log = await db.imu_logs.find_one({"_id": args.log_id})
+    if not log:
+        print(f"ERROR: IMU log {args.log_id} not found")
+        sys.exit(1)
+    cloud_path = (log.get("record") or {}).get("cloud_path")
+    if log.get("storage_tier") not in ("archived", "rehydrating") or not cloud_path:
+        print("  Log is not archived — nothing to do")
+        return
+
+    imu_retention.restore_recording(cloud_path, log["path"])
+    same_content = {"sha256": log["sha256"]} if log.get("sha256") else {"_id": log["_id"]}
+    await db.imu_logs.update_many(
+        same_content,
+        # The archive may have brought the text log back; it is pruned again later
+        {"$set": {"storage_tier": "hot", "rehydrated_at": datetime.now(timezone.utc), "raw_pruned_at": None}},
+    )
+    print(f"  Restored {log['path']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="IMU log retention")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compact_cmd = commands.add_parser("compact", help="archive old recordings")
+    compact_cmd.add_argument("--days", type=int, default=imu_retention.RETENTION_DAYS)
+    compact_cmd.add_argument("--limit", type=int, default=None, help="archive at most this many recordings")
+    compact_cmd.add_argument("--raw-days", type=int, default=imu_retention.RAW_LOG_DAYS,
+                             help="delete text logs uploaded more than this many days ago")
+    compact_cmd.add_argument("--dry-run", action="store_true")
+
+    rehydrate_cmd = commands.add_parser("rehydrate", help="restore one log's recording")
+    rehydrate_cmd.add_argument("log_id")
+    args = parser.parse_args()
+
+    mongo_url = os.environ.get("MONGO_URL", "").strip()
+    db_name = os.environ.get("DB_NAME", "").strip() or "hawklets_db"
+    if not mongo_url:
+        print("ERROR: MONGO_URL is required.")
+        sys.exit(1)
+
+    client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=5000)
+    try:
+        await client.admin.command("ping")
+    except Exception as e:
+        print(f"ERROR: Cannot connect to MongoDB — {e}")
+        sys.exit(1)
+
+    try:
+        if args.command == "compact":
+            await compact(client[db_name], args)
+        else:
+            await rehydrate(client[db_name], args)
+    finally:
+        client.close()
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Compare, build and check the MongoDB indexes declared by the models.
+
+Usage:
+    # Inside Docker container (recommended for prod):
+    docker compose exec backend python scripts/manage_indexes.py plan
+
+    # Build the missing indexes (the server also does this at startup):
+    python scripts/manage_indexes.py apply
+
+    # CI: every query shape in routers/services must have a usable index.
+    # Needs no database; exits 1 otherwise.
+    python scripts/manage_indexes.py check
+
+Declarations live in Config.indexes of models/mongo_models.py (and
+EXTRA_INDEXES in services/db_indexes.py for collections without a model).
+Nothing is ever dropped: undeclared, redundant and unused indexes are only
+reported. "Unused" counts operations since the MongoDB server last started.
+"""
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent.parent
+if str(ROOT_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR.parent))
+load_dotenv(ROOT_DIR / ".env")
+
+try:
+    from backend.services import db_indexes
+except ImportError:
+    sys.path.insert(0, str(ROOT_DIR))
+    from services import db_indexes
+
+
+def print_report(report):
+    print(f"  Missing:     {len(report['missing'])}")
+    for item in report["missing"]:
+        print(f"    + {item['collection']}.{item['name']}")
+    print(f"  Conflicting: {len(report['conflicting'])}")
+    for item in report["conflicting"]:
+        print(f"    ! {item['collection']}.{item['name']}: existing {item['existing']}, declared {item['declared']}")
+    print(f"  Undeclared:  {len(report['undeclared'])}")
+    for item in report["undeclared"]:
+        print(f"    ? {item['collection']}.{item['name']}")
+    print(f"  Redundant:   {len(report['redundant'])}")
+    for item in report["redundant"]:
+        print(f"    - {item['collection']}.{item['name']} (prefix of {item['covered_by']})")
+    if report["unused"]:
+        print(f"  Unused since server start: {len(report['unused'])}")
+        for item in report["unused"]:
+            print(f"    0 {item['collection']}.{item['name']}")
+
+
+def check():
+    print("\n=== Checking query shapes against declared indexes ===\n")
+    unsupported, unresolved = db_indexes.check_query_shapes()
+    for shape in unresolved:
+        print(f"  skipped  {shape.path}:{shape.line} {shape.collection} (filter built dynamically)")
+    for shape in unsupported:
+        fields = " | ".join(", ".join(sorted(a)) or "-" for a in shape.alternatives)
+        sort = f" sort {', '.join(shape.sort)}" if shape.sort else ""
+        print(f"  NO INDEX {shape.path}:{shape.line} {shape.collection} {{{fields}}}{sort}")
+    total = len(db_indexes.query_shapes())
+    print(f"\n  {total} query shapes, {len(unsupported)} without an index, {len(unresolved)} skipped")
+    if unsupported:
+        sys.exit(1)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="MongoDB index management")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("plan", help="compare declared and existing indexes")
+    commands.add_parser("apply", help="build missing indexes")
+    commands.add_parser("check", help="static check of query shapes (no database)")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        check()
+        return
+
+    mongo_url = os.environ.get("MONGO_URL", "").strip()
+    db_name = os.environ.get("DB_NAME", "").strip() or "hawklets_db"
+    if not mongo_url:
+        print("ERROR: MONGO_URL is required.")
+        sys.exit(1)
+
+    client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=5000)
+    try:
+        await client.admin.command("ping")
+    except Exception as e:
+        print(f"ERROR: Cannot connect to MongoDB — {e}")
+        sys.exit(1)
+
+    try:
+        db = client[db_name]
+        if args.command == "apply":
+            print(f"\n=== Building missing indexes in {db_name} ===\n")
+            await db_indexes.ensure_indexes(db)
+        print(f"\n=== Indexes in {db_name} ===\n")
+        print_report(await db_indexes.plan(db))
+    finally:
+        client.close()
+    print("\nDone.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Convert timestamps stored as ISO strings into native BSON dates.
+
+Older code wrote created_at / updated_at / deleted_at (and a few others) as
+ISO strings, newer code writes dates, so collections mix both. Range
+queries such as ``{"created_at": {"$gte": <date>}}`` never match the string
+rows (MongoDB compares values of different BSON types by type, not by
+time), and readers had to re-parse strings. Run this once after deploying
+the version that writes dates.
+
+Usage:
+    # Inside Docker container (recommended for prod):
+    docker compose exec backend python scripts/migrate_dates.py
+
+    # See how many values would change:
+    python scripts/migrate_dates.py --dry-run
+
+    # One collection, smaller batches with a pause (online, low impact):
+    python scripts/migrate_dates.py --collection users --batch-size 200 --pause-ms 50
+
+How it works:
+  - Documents with a string in one of DATE_FIELDS are read in _id order,
+    --batch-size at a time, and rewritten with bulk_write.
+  - Each update is conditional on the old string still being there, so it
+    never overwrites a value the application changed in the meantime — the
+    API can keep serving while this runs.
+  - After every batch the last _id is stored in date_migration_checkpoints;
+    an interrupted run resumes from it. Use --restart to start over.
+  - Strings that are not ISO timestamps are left alone and reported.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent.parent
+load_dotenv(ROOT_DIR / ".env")
+
+CHECKPOINTS = "date_migration_checkpoints"
+
+COLLECTIONS = (
+    "users", "admins", "exercises_global", "exercises_user", "workouts", "routines",
+    "workout_logs", "challenges", "notifications", "waitlist", "status_checks",
+)
+DATE_FIELDS = (
+    "created_at", "updated_at", "deleted_at", "logged_at", "streak_started_at",
+    "timestamp", "last_login", "auth.last_login",
+)
+
+
+def parse_timestamp(value: str):
+    """ISO string → aware UTC datetime; None if it is not a timestamp"""
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        # Naive strings were written with utcnow()
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def _get(doc: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+async def migrate_collection(db, name: str, args) -> dict:
+    collection = db[name]
+    has_strings = {"$or": [{field: {"$type": "string"}} for field in DATE_FIELDS]}
+    checkpoint = None if args.restart else await db[CHECKPOINTS].find_one({"_id": name})
+    last_id = checkpoint["last_id"] if checkpoint else None
+    stats = {"documents": 0, "values": 0, "unparseable": 0}
+
+    while True:
+        query = dict(has_strings)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        projection = {field: 1 for field in DATE_FIELDS}
+        batch = await collection.find(query, projection).sort("_id", 1).limit(args.batch_size).to_list(length=None)
+        if not batch:
+            break
+
+        ops = []
+        for doc in batch:
+            update, expected = {}, {}
+            for field in DATE_FIELDS:
+                value = _get(doc, field)
+                if not isinstance(value, str):
+                    continue
+                parsed = parse_timestamp(value)
+                if parsed is None:
+                    stats["unparseable"] += 1
+                    print(f"  ! {name} {doc['_id']}: {field}={value!r} is not a timestamp")
+                    continue
+                update[field] = parsed
+                expected[field] = value
+            if update:
+                stats["documents"] += 1
+                stats["values"] += len(update)
+                ops.append(UpdateOne({"_id": doc["_id"], **expected}, {"$set": update}))
+
+        if ops and not args.dry_run:
+            await collection.bulk_write(ops, ordered=False)
+        last_id = batch[-1]["_id"]
+        if not args.dry_run:
+            await db[CHECKPOINTS].update_one(
+                {"_id": name},
+                {"$set": {"last_id": last_id, "updated_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+        if args.pause_ms:
+            await asyncio.sleep(args.pause_ms / 1000)
+
+    if not args.dry_run:
+        await db[CHECKPOINTS].delete_one({"_id": name})
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Convert ISO string timestamps to BSON dates")
+    parser.add_argument("--collection", choices=COLLECTIONS, help="only this collection")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause-ms", type=int, default=0, help="sleep between batches")
+    parser.add_argument("--restart", action="store_true", help="ignore saved checkpoints")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    mongo_url = os.environ.get("MONGO_URL", "").strip()
+    db_name = os.environ.get("DB_NAME", "").strip() or "hawklets_db"
+    if not mongo_url:
+        print("ERROR: MONGO_URL is required.")
+        sys.exit(1)
+
+    client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=5000)
+    try:
+        await client.admin.command("ping")
+    except Exception as e:
+        print(f"ERROR: Cannot connect to MongoDB — {e}")
+        sys.exit(1)
+
+    verb = "would be converted" if args.dry_run else "converted"
+    print(f"\n=== Converting string timestamps to dates in {db_name} ===\n")
+    started = time.monotonic()
+    try:
+        db = client[db_name]
+        for name in [args.collection] if args.collection else COLLECTIONS:
+            stats = await migrate_collection(db, name, args)
+            print(f"  {name}: {stats['values']} values in {stats['documents']} documents {verb}"
+                  + (f", {stats['unparseable']} unparseable" if stats["unparseable"] else ""))
+    finally:
+        client.close()
+    print(f"\nDone in {time.monotonic() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Recompute columnar recordings, metrics and previews for stored IMU logs.
+
+Run after changing the parser or the rep/set analysis: every log whose
+metrics_summary was produced by an older ANALYSIS_VERSION is re-ingested from
+its raw text log (or its recording, once the text log was pruned). Logs
+uploaded before processing existed (no status) are included; the oldest of
+them have ObjectId ids, which are converted to the string ids the API looks
+logs up by before anything else runs.
+
+Usage:
+    # Inside Docker container (recommended for prod):
+    docker compose exec backend python scripts/reprocess_imu_logs.py
+
+    # All logs, 8 processes:
+    python scripts/reprocess_imu_logs.py --all --workers 8
+
+How it works:
+  - imu_logs metadata is streamed with a cursor in _id order; logs sharing the
+    same content (sha256) are processed once.
+  - Parsing and analysis fan out over a ProcessPoolExecutor; at most
+    --max-in-flight logs are submitted at a time, so memory stays bounded.
+  - Results are written back with bulk_write every --batch-size logs.
+  - After every flush the last fully written _id is stored in the
+    imu_reprocess_checkpoints collection; an interrupted run resumes from it,
+    a finished run deletes it. Use --restart to start over.
+  - Finally the per-SessionSet numbers in session_set_metrics are refreshed
+    from the new summaries of linked logs.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteMany, DeleteOne, InsertOne, UpdateMany, UpdateOne
+
+ROOT_DIR = Path(__file__).parent.parent
+if str(ROOT_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR.parent))
+load_dotenv(ROOT_DIR / ".env")
+
+try:
+    from backend.services import imu_analysis, imu_format, imu_preview
+except ImportError:
+    sys.path.insert(0, str(ROOT_DIR))
+    from services import imu_analysis, imu_format, imu_preview
+
+CHECKPOINTS = "imu_reprocess_checkpoints"
+REPORT_EVERY_S = 10.0
+
+
+# ─── Worker (runs in the process pool) ────────────────────────────────────────
+
+def reprocess_log(raw_path: str) -> dict:
+    """Parse + analyse + previews for one raw log. Errors are returned, not raised."""
+    raw = Path(raw_path)
+    target = imu_format.recording_path_for(raw)
+    try:
+        info, summary = imu_analysis.process_log(raw, target)
+        previews = imu_preview.build_previews(target)
+        size = raw.stat().st_size if raw.exists() else info["size_bytes"]
+    except Exception as e:
+        # One broken log must not stop the run
+        return {"error": f"{type(e).__name__}: {e}", "bytes": 0}
+    return {
+        "info": info,
+        "metrics_summary": summary,
+        "previews": previews,
+        "bytes": size,
+    }
+
+
+# ─── Writing results ──────────────────────────────────────────────────────────
+
+def _result_ops(log: dict, result: dict):
+    """Bulk operations for imu_logs and imu_previews"""
+    if result.get("duplicate"):
+        # Written together with the first log that has the same content
+        return [], []
+
+    same_content = {"sha256": log["sha256"]} if log.get("sha256") else {"_id": log["_id"]}
+    now = datetime.now(timezone.utc)
+
+    if "error" in result:
+        update = {"status": "failed", "ingest_error": result["error"], "processed_at": now}
+        return [UpdateMany(same_content, {"$set": update})], []
+
+    info = result["info"]
+    update = {
+        "status": "ready",
+        # Field-wise so every log keeps its own record.session_id
+        "record.sample_rate_hz": info["sample_rate_hz"],
+        "record.duration_ms": info["duration_ms"],
+        "record.format": info["format"],
+        "record.checksum": info["checksum"],
+        "record.local_path": info["local_path"],
+        "samples": info["samples"],
+        "recording_size_bytes": info["size_bytes"],
+        "metrics_summary": result["metrics_summary"],
+        "ingest_error": None,
+        "processed_at": now,
+    }
+    if not (log.get("record") or {}).get("session_id"):
+        # Logs uploaded before processing existed have no record yet
+        update["record.session_id"] = str(log["_id"])
+    recording_id = log.get("sha256") or log["_id"]
+    preview_ops = [DeleteMany({"recording_id": recording_id})] + [
+        InsertOne({"recording_id": recording_id, "mode": mode, "points": points, "series": series})
+        for mode, levels in result["previews"].items()
+        for points, series in levels.items()
+    ]
+    return [UpdateMany(same_content, {"$set": update})], preview_ops
+
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = self.failed = self.bytes = 0
+        self.started = self.last_report = time.monotonic()
+
+    def add(self, result: dict) -> None:
+        self.done += 1
+        self.failed += "error" in result
+        self.bytes += result["bytes"]
+
+    def report(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self.last_report < REPORT_EVERY_S:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate else float("inf")
+        print(
+            f"  {self.done}/{self.total} logs  {self.failed} failed  "
+            f"{rate:.1f} logs/s  {self.bytes / elapsed / 1e6:.1f} MB/s  "
+            f"elapsed {elapsed:.0f}s  eta {eta:.0f}s",
+            flush=True,
+        )
+
+
+async def refresh_set_metrics(db, batch_size: int) -> int:
+    """Rewrites session_set_metrics of every linked set. Returns sets updated."""
+    ops, updated = [], 0
+    cursor = db.imu_logs.find(
+        {"set_links.0": {"$exists": True}},
+        {"set_links": 1, "metrics_summary": 1},
+    ).batch_size(batch_size)
+    async for log in cursor:
+        for link in log["set_links"]:
+            metrics = imu_analysis.set_velocity_metrics(log.get("metrics_summary"), link["set_index"])
+            if metrics is None:
+                ops.append(DeleteOne({"_id": link["set_id"], "log_id": log["_id"]}))
+            else:
+                # Only existing documents: the link endpoint decides which sets get one
+                ops.append(UpdateOne(
+                    {"_id": link["set_id"], "log_id": log["_id"]},
+                    {"$set": {**metrics, "updated_at": datetime.now(timezone.utc)}},
+                ))
+                updated += 1
+        if len(ops) >= batch_size:
+            await db.session_set_metrics.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.session_set_metrics.bulk_write(ops, ordered=False)
+    return updated
+
+
+async def migrate_object_ids(db) -> int:
+    """Re-inserts logs with an ObjectId _id under str(_id). Returns logs migrated."""
+    migrated = 0
+    async for log in db.imu_logs.find({"_id": {"$type": "objectId"}}):
+        old_id, new_id = log["_id"], str(log["_id"])
+        # owner_id + sha256 is unique: the old document gives up its hash before
+        # the copy is written, so an interrupted run can simply be repeated
+        sha256 = log.pop("legacy_sha256", None) or log.get("sha256")
+        if log.get("sha256"):
+            await db.imu_logs.update_one({"_id": old_id}, {"$rename": {"sha256": "legacy_sha256"}})
+        doc = {**log, "_id": new_id}
+        if sha256:
+            doc["sha256"] = sha256
+        await db.imu_logs.replace_one({"_id": new_id}, doc, upsert=True)
+
+        set_ids = [link["set_id"] for link in log.get("set_links") or []]
+        if set_ids:
+            await db.session_set_metrics.update_many(
+                {"_id": {"$in": set_ids}, "log_id": old_id},
+                {"$set": {"log_id": new_id}},
+            )
+        if not sha256:
+            # Previews of a log without a hash are keyed by its id
+            await db.imu_previews.update_many({"recording_id": old_id}, {"$set": {"recording_id": new_id}})
+        await db.imu_logs.delete_one({"_id": old_id})
+        migrated += 1
+    return migrated
+
+
+# ─── Main loop ────────────────────────────────────────────────────────────────
+
+async def reprocess(db, args) -> Progress:
+    checkpoint_id = f"analysis-v{imu_analysis.ANALYSIS_VERSION}" + ("-all" if args.all else "")
+    if args.restart:
+        await db[CHECKPOINTS].delete_one({"_id": checkpoint_id})
+    checkpoint = await db[CHECKPOINTS].find_one({"_id": checkpoint_id}) or {}
+    if checkpoint.get("last_id") and not isinstance(checkpoint["last_id"], str):
+        # Saved before the ObjectId logs were migrated: those now sort among
+        # the string ids, so the position means nothing any more
+        print("  Checkpoint predates the id migration, starting over")
+        checkpoint = {}
+
+    # Archived recordings have no raw log on disk; rehydrate them first
+    conditions = [
+        # Logs from before background processing have no status at all
+        {"$or": [{"status": {"$in": ["ready", "failed"]}}, {"status": {"$exists": False}}]},
+        {"storage_tier": {"$nin": ["archived", "rehydrating"]}},
+    ]
+    if not args.all:
+        conditions.append({"$or": [
+            {"metrics_summary": None},
+            {"metrics_summary.analysis_version": {"$lt": imu_analysis.ANALYSIS_VERSION}},
+        ]})
+    if checkpoint.get("last_id"):
+        conditions.append({"_id": {"$gt": checkpoint["last_id"]}})
+        print(f"  Resuming after {checkpoint['last_id']}")
+    query = {"$and": conditions}
+
+    progress = Progress(await db.imu_logs.count_documents(query))
+    print(f"\n=== Reprocessing {progress.total} IMU logs with {args.workers} processes ===\n")
+
+    loop = asyncio.get_running_loop()
+    pool = ProcessPoolExecutor(max_workers=args.workers)
+    # (log, future) in submission order — results are written in the same order,
+    # so the checkpoint is always a prefix of fully written logs
+    pending = deque()
+    log_ops, preview_ops = [], []
+    seen_content = set()
+    last_id = checkpoint.get("last_id")
+
+    async def flush():
+        nonlocal log_ops, preview_ops
+        if log_ops:
+            await db.imu_logs.bulk_write(log_ops, ordered=False)
+        if preview_ops:
+            # Deletes must run before the inserts that follow them
+            await db.imu_previews.bulk_write(preview_ops, ordered=True)
+        log_ops, preview_ops = [], []
+        if last_id:
+            await db[CHECKPOINTS].update_one(
+                {"_id": checkpoint_id},
+                {"$set": {"last_id": last_id, "updated_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+
+    async def collect_head():
+        nonlocal last_id
+        log, future = pending.popleft()
+        result = await future
+        ops, previews = _result_ops(log, result)
+        log_ops.extend(ops)
+        preview_ops.extend(previews)
+        last_id = log["_id"]
+        progress.add(result)
+        progress.report()
+        if progress.done % args.batch_size == 0:
+            await flush()
+
+    try:
+        cursor = db.imu_logs.find(query, {"path": 1, "sha256": 1, "record.session_id": 1}).sort("_id", 1).batch_size(args.batch_size)
+        async for log in cursor:
+            if log.get("sha256") and log["sha256"] in seen_content:
+                # Already being reprocessed through another log with the same content
+                future = loop.create_future()
+                future.set_result({"duplicate": True, "bytes": 0})
+            else:
+                if log.get("sha256"):
+                    seen_content.add(log["sha256"])
+                future = loop.run_in_executor(pool, reprocess_log, log["path"])
+
+            pending.append((log, future))
+            if len(pending) >= args.max_in_flight:
+                await collect_head()
+
+        while pending:
+            await collect_head()
+        await flush()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    await db[CHECKPOINTS].delete_one({"_id": checkpoint_id})
+
+    progress.report(force=True)
+    return progress
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Recompute recordings and metrics of stored IMU logs")
+    parser.add_argument("--all", action="store_true", help="reprocess every log, not only outdated ones")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes (default: all cores)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="logs submitted at once (default: 4 x workers)")
+    parser.add_argument("--batch-size", type=int, default=200, help="logs per bulk write / checkpoint")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    args = parser.parse_args()
+    args.max_in_flight = args.max_in_flight or 4 * args.workers
+
+    mongo_url = os.environ.get("MONGO_URL", "").strip()
+    db_name = os.environ.get("DB_NAME", "").strip() or "hawklets_db"
+    if not mongo_url:
+        print("ERROR: MONGO_URL is required.")
+        sys.exit(1)
+
+    client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=5000)
+    try:
+        await client.admin.command("ping")
+    except Exception as e:
+        print(f"ERROR: Cannot connect to MongoDB — {e}")
+        sys.exit(1)
+
+    try:
+        migrated = await migrate_object_ids(client[db_name])
+        if migrated:
+            print(f"  {migrated} logs with ObjectId ids given string ids")
+        progress = await reprocess(client[db_name], args)
+        sets = await refresh_set_metrics(client[db_name], args.batch_size)
+        print(f"  {sets} linked sets refreshed")
+    finally:
+        client.close()
+    print(f"\nDone — {progress.done} logs, {progress.failed} failed.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
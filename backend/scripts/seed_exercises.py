@@ -112,7 +112,7 @@ async def seed():
         print(f"ERROR: Cannot connect to MongoDB — {e}")
         sys.exit(1)
 
-    NOW = datetime.now(timezone.utc).isoformat()
+    NOW = datetime.now(timezone.utc)
     created = updated = 0
 
     print(f"\n=== Seeding {len(EXERCISES)} exercises into '{DB_NAME}' ===\n")
@@ -57,7 +57,7 @@ if confirm.lower() != "yes":
 # ─── Data (same as seed_test_data.py) ────────────────────────────────────────
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-NOW = datetime.now(timezone.utc).isoformat()
+NOW = datetime.now(timezone.utc)
 HASHED_PASSWORD = pwd_context.hash("Password123!")
 
 TEST_USERS = [
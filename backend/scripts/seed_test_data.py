@@ -24,7 +24,7 @@ DB_NAME = os.environ["DB_NAME"]
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-NOW = datetime.now(timezone.utc).isoformat()
+NOW = datetime.now(timezone.utc)
 HASHED_PASSWORD = pwd_context.hash("Password123!")
 
 TEST_USERS = [
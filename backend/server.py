@@ -1,6 +1,6 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi.openapi.utils import get_openapi
 from fastapi.staticfiles import StaticFiles
-from fastapi.security import APIKeyHeader
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -16,6 +16,10 @@ import uuid
 from datetime import datetime, timezone
 import sys
 
+ROOT_DIR = Path(__file__).parent
+# Before the router/service imports: several of them read settings at import
+load_dotenv(ROOT_DIR / '.env')
+
 # Импорт роутеров
 # Add parent directory to sys.path to allow both absolute and relative imports
 current_dir = Path(__file__).parent
@@ -25,11 +29,17 @@ if str(parent_dir) not in sys.path:
 
 try:
     from backend.routers import auth, exercises, templates, routines, workout_logs, community, admin_auth, admin_management, imu
+    from backend.services import api_keys, avatars, db_indexes, exercise_catalog, imu_jobs, password_pool, redis_client
+    from backend.services.rate_limit import by_ip, rate_limit
 except ImportError:
     try:
         from routers import auth, exercises, templates, routines, workout_logs, community, admin_auth, admin_management, imu
+        from services import api_keys, avatars, db_indexes, exercise_catalog, imu_jobs, password_pool, redis_client
+        from services.rate_limit import by_ip, rate_limit
     except ImportError:
         from .routers import auth, exercises, templates, routines, workout_logs, community, admin_auth, admin_management, imu
+        from .services import api_keys, avatars, db_indexes, exercise_catalog, imu_jobs, password_pool, redis_client
+        from .services.rate_limit import by_ip, rate_limit
 
 # Configure logging
 logging.basicConfig(
@@ -38,45 +48,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
-
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware: dates come back as UTC-aware datetimes, like the ones we write
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
-# API Key configuration
-API_KEY_NAME = "X-API-Key"
-API_KEY = os.getenv("API_KEY", "default-api-key-change-in-production")
-
-# Security scheme for OpenAPI docs
-api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
-
-async def verify_api_key(api_key_header: str = Depends(api_key_header)):
-    """Verify API key from request header"""
-    if not api_key_header:
-        raise HTTPException(
-            status_code=401,
-            detail="API key is missing"
-        )
-    
-    if api_key_header != API_KEY:
-        raise HTTPException(
-            status_code=401,
-            detail="Invalid API key"
-        )
-    
-    return api_key_header
-
 # Create the main app without a prefix
+# The API key is checked by api_keys.ApiKeyMiddleware before routing
 app = FastAPI(
     title="Hawklets API",
     description="API for Hawklets fitness tracking application",
     version="1.0.0",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
-    dependencies=[Depends(verify_api_key)]  # Apply to all endpoints
 )
 
 # Database dependency (for future use)
@@ -84,8 +69,8 @@ async def get_database():
     """Dependency to get database connection"""
     return db
 
-# Create a router with the /api prefix and API key dependency
-api_router = APIRouter(prefix="/api", dependencies=[Depends(verify_api_key)])
+# Create a router with the /api prefix
+api_router = APIRouter(prefix="/api")
 
 # Подключаем роутеры
 # Set database connection for auth router
@@ -155,9 +140,7 @@ async def create_status_check(input: StatusCheckCreate):
     status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
     
-    # Convert to dict and serialize datetime to ISO string for MongoDB
     doc = status_obj.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
     
     _ = await db.status_checks.insert_one(doc)
     return status_obj
@@ -166,16 +149,10 @@ async def create_status_check(input: StatusCheckCreate):
 async def get_status_checks():
     # Exclude MongoDB's _id field from the query results
     status_checks = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
-    
-    # Convert ISO string timestamps back to datetime objects
-    for check in status_checks:
-        if isinstance(check['timestamp'], str):
-            check['timestamp'] = datetime.fromisoformat(check['timestamp'])
-    
     return status_checks
 
 # Waitlist endpoints
-@api_router.post("/waitlist")
+@api_router.post("/waitlist", dependencies=[Depends(rate_limit("waitlist_ip", by_ip))])
 async def add_to_waitlist(input: WaitlistCreate):
     """Add a user to the waitlist"""
     try:
@@ -187,9 +164,7 @@ async def add_to_waitlist(input: WaitlistCreate):
         # Create waitlist entry
         waitlist_entry = Waitlist(**input.model_dump())
         
-        # Convert to dict and serialize datetime to ISO string for MongoDB
         doc = waitlist_entry.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
         
         await db.waitlist.insert_one(doc)
         
@@ -216,11 +191,6 @@ async def get_waitlist():
         # Exclude MongoDB's _id field from the query results
         waitlist = await db.waitlist.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
         
-        # Convert ISO string timestamps back to datetime objects
-        for entry in waitlist:
-            if isinstance(entry['created_at'], str):
-                entry['created_at'] = datetime.fromisoformat(entry['created_at'])
-        
         return {
             "success": True,
             "count": len(waitlist),
@@ -230,22 +200,82 @@ async def get_waitlist():
         logger.error(f"Error fetching waitlist: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch waitlist")
 
+@app.exception_handler(password_pool.PasswordPoolBusy)
+async def password_pool_busy_handler(request: Request, exc: password_pool.PasswordPoolBusy):
+    """Login/registration storm: shed load instead of queueing bcrypt work without bound"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please retry"},
+        headers={"Retry-After": str(password_pool.RETRY_AFTER_S)},
+    )
+
 # Include the router in the main app
 app.include_router(api_router)
 
+class UploadsStaticFiles(StaticFiles):
+    """StaticFiles with long-term caching for content-addressed avatar variants"""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        # ETag / Last-Modified and 304s come from StaticFiles itself
+        if avatars.is_immutable(str(full_path)):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
 # Serve uploaded files (avatars, etc.)
 _uploads_dir = Path("/app/uploads")
 _uploads_dir.mkdir(parents=True, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=str(_uploads_dir)), name="uploads")
+app.mount("/uploads", UploadsStaticFiles(directory=str(_uploads_dir)), name="uploads")
+
+def custom_openapi():
+    """OpenAPI schema with the X-API-Key header on every operation (for the docs' Authorize)"""
+    if app.openapi_schema:
+        return app.openapi_schema
+    schema = get_openapi(title=app.title, version=app.version, description=app.description, routes=app.routes)
+    schema.setdefault("components", {}).setdefault("securitySchemes", {})["APIKeyHeader"] = {
+        "type": "apiKey",
+        "in": "header",
+        "name": api_keys.API_KEY_NAME,
+    }
+    for path_item in schema.get("paths", {}).values():
+        for operation in path_item.values():
+            requirements = operation.get("security") or [{}]
+            operation["security"] = [{**requirement, "APIKeyHeader": []} for requirement in requirements]
+    app.openapi_schema = schema
+    return schema
 
+app.openapi = custom_openapi
+
+# Added before CORS so that CORS stays outermost: preflights are answered and
+# 401s carry the CORS headers
+app.add_middleware(api_keys.ApiKeyMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
+@app.on_event("startup")
+async def start_background_workers():
+    # IMU post-processing (ingest, compression, analytics) runs off the request path
+    imu_jobs.worker.start(db)
+    # Indexes declared in the models (Config.indexes); missing ones are built
+    if os.getenv("INDEX_BOOTSTRAP", "true").strip().lower() in ("1", "true", "yes"):
+        try:
+            await db_indexes.ensure_indexes(db)
+        except Exception as e:
+            logger.error(f"Failed to create indexes: {str(e)}")
+    # Global exercise catalog served from memory, reloaded when it changes
+    await exercise_catalog.catalog.start(db)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    await client.close()
\ No newline at end of file
+    await imu_jobs.worker.stop()
+    await exercise_catalog.catalog.stop()
+    await redis_client.close_redis()
+    password_pool.pool.shutdown()
+    avatars.shutdown()
+    client.close()
\ No newline at end of file
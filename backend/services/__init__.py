@@ -0,0 +1,3 @@
+"""
+Сервисы Hawklets API (логика, не привязанная к конкретному роутеру)
+"""
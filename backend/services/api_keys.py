@@ -0,0 +1,149 @@
+"""
+API key check as a pure ASGI middleware.
+
+The key used to be a FastAPI dependency declared on both the app and the
+``/api`` router, so every request resolved it twice after routing. Here it
+is checked once, before routing and dependency resolution; a rejected
+request never reaches FastAPI.
+
+Keys are configured as ``API_KEYS=mobile:<key>,web:<key>`` (client name →
+key); the legacy ``API_KEY`` is still accepted as client ``default``. Only
+SHA-256 digests are kept, and the presented key's digest is compared with
+every configured digest using ``hmac.compare_digest``, so the time taken
+does not depend on how much of a key matched or on which client it is.
+
+Per-client request counters (per process) are exposed through
+``/api/admin/stats/api-keys``.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+API_KEY_NAME = "X-API-Key"
+_HEADER = API_KEY_NAME.lower().encode("latin-1")
+
+# Served without a key: API docs, uploaded files (public URLs in <img>) and
+# CORS preflights, which browsers send without custom headers
+EXEMPT_PATHS = ("/api/docs", "/api/docs/oauth2-redirect", "/api/redoc", "/openapi.json")
+EXEMPT_PREFIXES = ("/uploads/",)
+
+
+def _digest(key: str) -> bytes:
+    return hashlib.sha256(key.encode("utf-8")).digest()
+
+
+def load_keys() -> List[Tuple[str, bytes]]:
+    """(client name, sha256 digest) pairs from API_KEYS and API_KEY"""
+    keys: List[Tuple[str, bytes]] = []
+    for item in os.getenv("API_KEYS", "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, key = item.partition(":")
+        if not sep or not name.strip() or not key.strip():
+            logger.error("Invalid API_KEYS entry, expected name:key")
+            continue
+        keys.append((name.strip(), _digest(key.strip())))
+    legacy = os.getenv("API_KEY", "default-api-key-change-in-production")
+    if legacy:
+        keys.append(("default", _digest(legacy)))
+    return keys
+
+
+class ApiKeyStats:
+    def __init__(self):
+        self.started_at = time.time()
+        self.requests: Dict[str, int] = {}
+        self.missing = 0
+        self.invalid = 0
+        self.exempt = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "requests": dict(self.requests),
+            "rejected_missing": self.missing,
+            "rejected_invalid": self.invalid,
+            "exempt": self.exempt,
+        }
+
+
+stats = ApiKeyStats()
+
+
+def _reject(detail: str) -> Tuple[dict, dict]:
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    start = {
+        "type": "http.response.start",
+        "status": 401,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ],
+    }
+    return start, {"type": "http.response.body", "body": body}
+
+
+# Built once: rejections are answered without allocating a Response
+_MISSING = _reject("API key is missing")
+_INVALID = _reject("Invalid API key")
+
+
+class ApiKeyMiddleware:
+    def __init__(self, app):
+        self.app = app
+        # Read when the app is built rather than at import
+        self.keys = load_keys()
+        for name, _ in self.keys:
+            stats.requests.setdefault(name, 0)
+
+    def _match(self, presented: bytes):
+        digest = hashlib.sha256(presented).digest()
+        client = None
+        # No early exit: every configured key is compared
+        for name, expected in self.keys:
+            if hmac.compare_digest(digest, expected):
+                client = name
+        return client
+
+    async def __call__(self, scope, receive, send):
+        # Lifespan passes through; the API has no websocket routes
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if scope["method"] == "OPTIONS" or path in EXEMPT_PATHS or path.startswith(EXEMPT_PREFIXES):
+            stats.exempt += 1
+            await self.app(scope, receive, send)
+            return
+
+        presented = None
+        for name, value in scope["headers"]:
+            if name == _HEADER:
+                presented = value
+                break
+
+        if not presented:
+            stats.missing += 1
+            rejection = _MISSING
+        else:
+            client = self._match(presented)
+            if client is not None:
+                stats.requests[client] += 1
+                # Available to endpoints as request.state.api_client
+                scope.setdefault("state", {})["api_client"] = client
+                await self.app(scope, receive, send)
+                return
+            stats.invalid += 1
+            rejection = _INVALID
+
+        start, body = rejection
+        await send(start)
+        await send(body)
@@ -0,0 +1,150 @@
+"""
+Avatar pipeline: streamed upload → resized variants under content-hash names.
+
+The upload is streamed to a temporary file (hashing as it goes) instead of
+being read into memory; decoding and resizing run in a small thread pool
+(Pillow releases the GIL while resizing and encoding). Each variant is a
+square WebP named after the content hash of the upload:
+
+    /uploads/avatars/{user_id}/{sha256[:32]}-{size}.webp
+
+A new picture gets new URLs, so the files never change and are served with
+``Cache-Control: immutable`` — clients fetch a 64 px thumbnail once instead
+of the original on every list render.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+import aiofiles
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+AVATAR_DIR = Path("/app/uploads/avatars")
+AVATAR_URL_PREFIX = "/uploads/avatars"
+# Square sizes in pixels: list thumbnails, profile header, full view
+VARIANT_SIZES = (64, 256, 512)
+DEFAULT_SIZE = 512
+MAX_SIZE_BYTES = 5 * 1024 * 1024  # 5 MB
+# Decompression-bomb guard: refuse images larger than this many pixels
+MAX_PIXELS = 40_000_000
+CHUNK_SIZE = 64 * 1024
+WEBP_QUALITY = 82
+WORKERS = int(os.getenv("AVATAR_WORKERS", "2"))
+
+# Variant files written by this pipeline — immutable by construction
+HASHED_NAME = re.compile(r"^[0-9a-f]{32}-\d+\.webp$")
+ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP"}
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+class AvatarError(ValueError):
+    """The upload is not an acceptable image"""
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="avatar")
+    return _executor
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def stream_to_temp(upload, max_bytes: int = MAX_SIZE_BYTES):
+    """Copies an UploadFile to a temp file in chunks. Returns (path, sha256 hex)."""
+    # Outside the served directory: a half-written upload is never public
+    fd, name = tempfile.mkstemp(prefix="avatar-upload-")
+    os.close(fd)
+    tmp = Path(name)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp, "wb") as out:
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise AvatarError("File size must not exceed 5 MB")
+                digest.update(chunk)
+                await out.write(chunk)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    if size == 0:
+        tmp.unlink(missing_ok=True)
+        raise AvatarError("File is empty")
+    return tmp, digest.hexdigest()
+
+
+def build_variants(source: Path, user_id: str, content_hash: str) -> Dict[str, str]:
+    """Decodes the image and writes every variant. Returns {size: url}."""
+    try:
+        with Image.open(source) as image:
+            if image.format not in ALLOWED_FORMATS:
+                raise AvatarError("Only JPEG, PNG and WebP images are allowed")
+            if image.width * image.height > MAX_PIXELS:
+                raise AvatarError("Image dimensions are too large")
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise AvatarError("File is not a valid image") from e
+
+    target_dir = AVATAR_DIR / user_id
+    target_dir.mkdir(parents=True, exist_ok=True)
+    name = content_hash[:32]
+    variants = {}
+    for size in VARIANT_SIZES:
+        edge = min(size, image.width, image.height)
+        variant = ImageOps.fit(image, (edge, edge), method=Image.Resampling.LANCZOS)
+        path = target_dir / f"{name}-{size}.webp"
+        if not path.exists():
+            tmp = path.with_name(path.name + ".tmp")
+            variant.save(tmp, "WEBP", quality=WEBP_QUALITY, method=4)
+            os.replace(tmp, path)
+        variants[str(size)] = f"{AVATAR_URL_PREFIX}/{user_id}/{path.name}"
+    return variants
+
+
+def remove_stale(user_id: str, keep_hash: str, legacy_url: Optional[str] = None) -> None:
+    """Deletes the user's previous variants (and the pre-pipeline single file)"""
+    keep = keep_hash[:32]
+    target_dir = AVATAR_DIR / user_id
+    if target_dir.is_dir():
+        for path in target_dir.iterdir():
+            if HASHED_NAME.match(path.name) and not path.name.startswith(keep):
+                path.unlink(missing_ok=True)
+    if legacy_url and legacy_url.startswith(AVATAR_URL_PREFIX + "/"):
+        legacy = AVATAR_DIR / legacy_url[len(AVATAR_URL_PREFIX) + 1:]
+        # Only the old fixed name {user_id}.{ext}
+        if legacy.parent == AVATAR_DIR and legacy.stem == user_id and legacy.is_file():
+            legacy.unlink(missing_ok=True)
+
+
+async def process_upload(upload, user_id: str, previous_url: Optional[str] = None) -> Dict[str, str]:
+    """Full pipeline for one upload. Returns {size: url}; raises AvatarError."""
+    tmp, content_hash = await stream_to_temp(upload)
+    loop = asyncio.get_running_loop()
+    try:
+        variants = await loop.run_in_executor(_get_executor(), build_variants, tmp, user_id, content_hash)
+    finally:
+        tmp.unlink(missing_ok=True)
+    await loop.run_in_executor(_get_executor(), remove_stale, user_id, content_hash, previous_url)
+    return variants
+
+
+def is_immutable(path: str) -> bool:
+    """True for variant files (safe to cache forever)"""
+    return bool(HASHED_NAME.match(os.path.basename(path)))
@@ -0,0 +1,385 @@
+"""
+MongoDB index management driven by the model declarations.
+
+Every model in ``models/mongo_models.py`` lists its indexes in
+``Config.indexes``; collections without a model (IMU storage, waitlist) are
+declared in EXTRA_INDEXES below. From these declarations this module
+
+- builds the indexes that are missing (at startup, and from
+  ``scripts/manage_indexes.py apply``);
+- reports indexes that differ from their declaration, exist without being
+  declared, are a key prefix of another index (redundant) or have not been
+  used since the server started (``$indexStats``);
+- checks statically that every query shape in the routers and services —
+  collection, filter fields and sort — can use a declared index
+  (``scripts/manage_indexes.py check``, exits non-zero for CI).
+
+Existing indexes are never dropped or rebuilt automatically: a conflicting
+declaration is reported and left for a manual migration.
+"""
+import ast
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from pydantic import BaseModel
+from pymongo import IndexModel
+
+try:
+    from backend.models import mongo_models
+except ImportError:
+    try:
+        from models import mongo_models
+    except ImportError:
+        from ..models import mongo_models
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+# Options that make two indexes on the same key different indexes
+OPTION_KEYS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+# Collections without a model
+EXTRA_INDEXES: Dict[str, List[Dict[str, Any]]] = {
+    "imu_logs": [
+        # One log per user and content: concurrent re-sends of a log dedup here.
+        # Logs from before content hashing have no sha256 and are exempt
+        {"key": [("owner_id", 1), ("sha256", 1)], "unique": True,
+         "partialFilterExpression": {"sha256": {"$type": "string"}}},
+        {"key": [("owner_id", 1), ("set_links.set_id", 1)]},
+        # Logs sharing content (processing, archive, rehydrate)
+        {"key": [("sha256", 1)]},
+        # Retention: oldest uploads first
+        {"key": [("uploaded_at", 1)]},
+    ],
+    "imu_previews": [
+        {"key": [("recording_id", 1), ("mode", 1), ("points", 1)]},
+    ],
+    "imu_jobs": [
+        {"key": [("status", 1), ("run_after", 1)]},
+    ],
+    "imu_uploads": [
+        # Expired upload sessions are removed by MongoDB; their partial files
+        # by imu_retention.sweep_incoming
+        {"key": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+    "session_set_metrics": [
+        {"key": [("owner_id", 1), ("exercise_id", 1), ("recorded_at", -1)]},
+    ],
+    "waitlist": [
+        {"key": [("email", 1)]},
+        {"key": [("created_at", -1)]},
+    ],
+}
+
+
+Key = Tuple[Tuple[str, Any], ...]
+
+
+def _normalize_key(key: Iterable) -> Key:
+    # The server may report directions as floats (1.0)
+    return tuple((field, int(d) if isinstance(d, (int, float)) else d) for field, d in key)
+
+
+def index_name(key: Key) -> str:
+    """MongoDB's default name: field_1_other_-1"""
+    return "_".join(f"{field}_{direction}" for field, direction in key)
+
+
+def _options(spec: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: spec[k] for k in OPTION_KEYS if k in spec}
+
+
+def declared_indexes() -> Dict[str, List[Dict[str, Any]]]:
+    """collection → index specs, from model Config.indexes and EXTRA_INDEXES"""
+    declared: Dict[str, List[Dict[str, Any]]] = {}
+    sources = []
+    for model in vars(mongo_models).values():
+        # Only the model's own Config, not one inherited from a base class
+        config = model.__dict__.get("Config") if isinstance(model, type) and issubclass(model, BaseModel) else None
+        if config is not None and getattr(config, "collection_name", None):
+            sources.append((config.collection_name, getattr(config, "indexes", [])))
+    sources.extend(EXTRA_INDEXES.items())
+
+    for collection, specs in sources:
+        seen = {_normalize_key(spec["key"]) for spec in declared.get(collection, [])}
+        for spec in specs:
+            key = _normalize_key(spec["key"])
+            if key not in seen:
+                seen.add(key)
+                declared.setdefault(collection, []).append({**spec, "key": key})
+    return declared
+
+
+# ─── Diff against the database ────────────────────────────────────────────────
+
+async def _existing(db, collection: str) -> Dict[str, Dict[str, Any]]:
+    info = await db[collection].index_information()
+    return {
+        name: {**_options(spec), "key": _normalize_key(spec["key"])}
+        for name, spec in info.items()
+    }
+
+
+async def _usage(db, collection: str) -> Optional[Dict[str, int]]:
+    """index name → operations since the server started; None if unavailable"""
+    try:
+        stats = await db[collection].aggregate([{"$indexStats": {}}]).to_list(length=None)
+    except Exception:
+        return None
+    return {s["name"]: int(s.get("accesses", {}).get("ops", 0)) for s in stats}
+
+
+def _redundant(indexes: Dict[str, Dict[str, Any]]) -> List[Tuple[str, str]]:
+    """(index, covering index): plain indexes whose key is a prefix of another's"""
+    found = []
+    for name, spec in indexes.items():
+        if name == "_id_" or _options(spec):
+            continue
+        for other, other_spec in indexes.items():
+            key, other_key = spec["key"], other_spec["key"]
+            if other != name and len(other_key) > len(key) and other_key[:len(key)] == key:
+                found.append((name, other))
+                break
+    return found
+
+
+async def plan(db, usage: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+    """Compares the declarations with the database. Changes nothing."""
+    declared = declared_indexes()
+    report: Dict[str, List[Dict[str, Any]]] = {
+        "missing": [], "conflicting": [], "undeclared": [], "redundant": [], "unused": [],
+    }
+    existing_collections = set(await db.list_collection_names())
+
+    for collection in sorted(existing_collections | set(declared)):
+        existing = await _existing(db, collection) if collection in existing_collections else {}
+        by_key = {spec["key"]: name for name, spec in existing.items()}
+        declared_keys = set()
+
+        for spec in declared.get(collection, []):
+            key = spec["key"]
+            declared_keys.add(key)
+            name = by_key.get(key)
+            if name is None:
+                report["missing"].append({"collection": collection, "name": index_name(key), "spec": spec})
+            elif _options(existing[name]) != _options(spec):
+                report["conflicting"].append({
+                    "collection": collection, "name": name,
+                    "declared": _options(spec), "existing": _options(existing[name]),
+                })
+
+        for name, spec in existing.items():
+            if name != "_id_" and spec["key"] not in declared_keys:
+                report["undeclared"].append({"collection": collection, "name": name, "key": spec["key"]})
+        for name, covered_by in _redundant(existing):
+            report["redundant"].append({"collection": collection, "name": name, "covered_by": covered_by})
+
+        if usage and existing:
+            ops = await _usage(db, collection)
+            for name, count in (ops or {}).items():
+                if name != "_id_" and count == 0:
+                    report["unused"].append({"collection": collection, "name": name})
+    return report
+
+
+async def ensure_indexes(db) -> Dict[str, List[Dict[str, Any]]]:
+    """Builds the missing declared indexes. Returns the plan it acted on."""
+    report = await plan(db, usage=False)
+    by_collection: Dict[str, List[IndexModel]] = {}
+    for item in report["missing"]:
+        spec = item["spec"]
+        by_collection.setdefault(item["collection"], []).append(
+            IndexModel(list(spec["key"]), name=item["name"], **_options(spec))
+        )
+    for collection, models in by_collection.items():
+        try:
+            await db[collection].create_indexes(models)
+            logger.info(f"Created indexes on {collection}: {', '.join(m.document['name'] for m in models)}")
+        except Exception as e:
+            logger.error(f"Failed to create indexes on {collection}: {str(e)}")
+    for item in report["conflicting"]:
+        logger.warning(
+            f"Index {item['collection']}.{item['name']} differs from its declaration "
+            f"({item['existing']} != {item['declared']}); rebuild it manually"
+        )
+    return report
+
+
+# ─── Static query-shape check ─────────────────────────────────────────────────
+
+QUERY_METHODS = {
+    "find", "find_one", "count_documents", "distinct", "update_one", "update_many",
+    "delete_one", "delete_many", "replace_one", "find_one_and_update",
+    "find_one_and_delete", "find_one_and_replace",
+}
+
+
+class QueryShape(NamedTuple):
+    path: str
+    line: int
+    collection: str
+    # Each alternative is a set of filter fields; $or and conditional filters
+    # give several, and every one of them has to be served by an index
+    alternatives: Optional[List[frozenset]]
+    sort: Optional[List[str]]
+
+
+def _is_call(node, name: str) -> bool:
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == name
+
+
+class _ShapeCollector(ast.NodeVisitor):
+    def __init__(self, path: str, tree: ast.Module):
+        self.path = path
+        self.shapes: List[QueryShape] = []
+        self.constants = {
+            target.id: node.value.value
+            for node in tree.body if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant)
+            for target in node.targets if isinstance(target, ast.Name)
+        }
+        self.parents: Dict[ast.AST, ast.AST] = {}
+        for parent in ast.walk(tree):
+            for child in ast.iter_child_nodes(parent):
+                self.parents[child] = parent
+        self.function: Optional[ast.AST] = None
+
+    def visit_FunctionDef(self, node):
+        outer, self.function = self.function, node
+        self.generic_visit(node)
+        self.function = outer
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def _collection(self, node) -> Optional[str]:
+        """db.users / db["users"] / db[COLLECTION] / self.db[COLLECTION]"""
+        def is_db(n):
+            return (isinstance(n, ast.Name) and n.id == "db") or (isinstance(n, ast.Attribute) and n.attr == "db")
+        if isinstance(node, ast.Attribute) and is_db(node.value):
+            return node.attr
+        if isinstance(node, ast.Subscript) and is_db(node.value):
+            if isinstance(node.slice, ast.Constant):
+                return node.slice.value
+            if isinstance(node.slice, ast.Name):
+                return self.constants.get(node.slice.id)
+        return None
+
+    def _assignment(self, name: str, before: int) -> Optional[ast.AST]:
+        """Last `name = ...` before a line, in the enclosing function"""
+        value = None
+        for node in ast.walk(self.function) if self.function is not None else []:
+            if isinstance(node, ast.Assign) and node.lineno < before:
+                if any(isinstance(t, ast.Name) and t.id == name for t in node.targets):
+                    if value is None or node.lineno > value[0]:
+                        value = (node.lineno, node.value)
+        return value[1] if value else None
+
+    def _alternatives(self, node, line: int, depth: int = 0) -> Optional[List[frozenset]]:
+        if depth > 5:
+            return None
+        if isinstance(node, ast.Name):
+            value = self._assignment(node.id, line)
+            return self._alternatives(value, line, depth + 1) if value is not None else None
+        if isinstance(node, ast.IfExp):
+            body = self._alternatives(node.body, line, depth + 1)
+            orelse = self._alternatives(node.orelse, line, depth + 1)
+            return body + orelse if body is not None and orelse is not None else None
+        if _is_call(node, "keyset_filter") and node.args:
+            # Keyset pagination only narrows the base filter by the sort field
+            return self._alternatives(node.args[0], line, depth + 1)
+        if not isinstance(node, ast.Dict):
+            return None
+
+        result = [frozenset()]
+        for key, value in zip(node.keys, node.values):
+            if key is None:
+                # {**other, ...}
+                parts = self._alternatives(value, line, depth + 1)
+            elif isinstance(key, ast.Constant) and key.value == "$or" and isinstance(value, ast.List):
+                parts = []
+                for branch in value.elts:
+                    branch_alts = self._alternatives(branch, line, depth + 1)
+                    if branch_alts is None:
+                        parts = None
+                        break
+                    parts.extend(branch_alts)
+            elif isinstance(key, ast.Constant) and isinstance(key.value, str):
+                parts = [] if key.value.startswith("$") else [frozenset([key.value])]
+            else:
+                parts = None
+            if parts is None:
+                return None
+            if parts:
+                result = [a | b for a in result for b in parts]
+        return result
+
+    def _sort(self, call: ast.Call) -> Optional[List[str]]:
+        spec = next((k.value for k in call.keywords if k.arg == "sort"), None)
+        parent = self.parents.get(call)
+        if spec is None and isinstance(parent, ast.Attribute) and parent.attr == "sort":
+            outer = self.parents.get(parent)
+            if isinstance(outer, ast.Call) and outer.args:
+                spec = outer.args[0]
+        if isinstance(spec, ast.Constant) and isinstance(spec.value, str):
+            return [spec.value]
+        if _is_call(spec, "keyset_sort") and spec.args and isinstance(spec.args[0], ast.Constant):
+            return [spec.args[0].value, "_id"]
+        if isinstance(spec, ast.List):
+            fields = [
+                e.elts[0].value for e in spec.elts
+                if isinstance(e, ast.Tuple) and isinstance(e.elts[0], ast.Constant)
+            ]
+            return fields or None
+        return None
+
+    def visit_Call(self, node: ast.Call):
+        if isinstance(node.func, ast.Attribute) and node.func.attr in QUERY_METHODS:
+            collection = self._collection(node.func.value)
+            if collection is not None:
+                if node.args:
+                    alternatives = self._alternatives(node.args[0], node.lineno)
+                else:
+                    alternatives = [frozenset()]
+                self.shapes.append(QueryShape(self.path, node.lineno, collection, alternatives, self._sort(node)))
+        self.generic_visit(node)
+
+
+def default_sources() -> List[Path]:
+    return sorted(
+        [BACKEND_DIR / "server.py"]
+        + list((BACKEND_DIR / "routers").glob("*.py"))
+        + list((BACKEND_DIR / "services").glob("*.py"))
+    )
+
+
+def query_shapes(paths: Optional[Iterable[Path]] = None) -> List[QueryShape]:
+    shapes: List[QueryShape] = []
+    for path in paths or default_sources():
+        tree = ast.parse(Path(path).read_text(encoding="utf-8"))
+        collector = _ShapeCollector(str(Path(path).relative_to(BACKEND_DIR)), tree)
+        collector.visit(tree)
+        shapes.extend(collector.shapes)
+    return shapes
+
+
+def _supported(fields: frozenset, sort: Optional[List[str]], keys: List[Key]) -> bool:
+    if "_id" in fields:
+        return True
+    for key in keys:
+        leading = key[0][0]
+        if leading in fields or (not fields and sort and leading == sort[0]):
+            return True
+    # No filter and no sort reads the whole collection anyway
+    return not fields and not sort
+
+
+def check_query_shapes(paths: Optional[Iterable[Path]] = None) -> Tuple[List[QueryShape], List[QueryShape]]:
+    """Returns (shapes without a usable index, shapes whose filter could not be resolved)"""
+    keys = {c: [spec["key"] for spec in specs] for c, specs in declared_indexes().items()}
+    unsupported, unresolved = [], []
+    for shape in query_shapes(paths):
+        if shape.alternatives is None:
+            unresolved.append(shape)
+        elif not all(_supported(fields, shape.sort, keys.get(shape.collection, [])) for fields in shape.alternatives):
+            unsupported.append(shape)
+    return unsupported, unresolved
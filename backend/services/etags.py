@@ -0,0 +1,56 @@
+"""
+Weak ETags and conditional GET (``If-None-Match`` → 304).
+
+Mobile clients re-fetch the exercise catalog and their workouts on every
+screen open. Read endpoints compute a weak ETag from what determines the
+response — a catalog version stamp, ``updated_at``/``revision`` of the
+documents, the query string — and answer ``304 Not Modified`` with an empty
+body when the client already has it, before building Pydantic models or
+serializing anything.
+
+ETags are weak (``W/"..."``): they identify the same data, not the same
+bytes. Responses carry ``Cache-Control: no-cache`` so clients revalidate
+every time instead of trusting a stale copy.
+
+    etag = etags.weak_etag(...)
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+    response.headers.update(etags.headers(etag))
+"""
+import hashlib
+import json
+from typing import Any, Dict
+
+from fastapi import Request, Response, status
+
+PRIVATE = "private, no-cache"
+PUBLIC = "public, no-cache"
+
+
+def weak_etag(*parts: Any) -> str:
+    raw = json.dumps(parts, default=str, separators=(",", ":"))
+    return f'W/"{hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()}"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def matches(request: Request, etag: str) -> bool:
+    """If-None-Match uses weak comparison: W/"x" and "x" are the same"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    expected = _opaque(etag)
+    return any(_opaque(candidate) == expected for candidate in header.split(","))
+
+
+def headers(etag: str, cache_control: str = PRIVATE) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+
+def not_modified(etag: str, cache_control: str = PRIVATE) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers(etag, cache_control))
@@ -0,0 +1,148 @@
+"""
+Process-wide cache of the global exercise catalog (``exercises_global``).
+
+The catalog is small and only changes when it is re-seeded, yet exercise
+browsing, workout listings (exercise names and tracking types) and IMU set
+metrics used to query it on every call. Here it is loaded once at startup
+and kept in memory, with lookups by id and by name.
+
+Freshness: MongoDB runs standalone (no replica set), so change streams are
+not available. Instead a background task compares a version stamp — the
+number of documents and the newest ``updated_at`` (an indexed read) — every
+EXERCISE_CATALOG_REFRESH_S seconds and reloads the catalog when it changed.
+Writers therefore have to set ``updated_at``, as the seed scripts do; after
+a write in this process ``catalog.refresh(db)`` applies it right away.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from backend.models.mongo_models import ExerciseGlobal
+    from backend.services.exercise_search import SearchIndex
+except ImportError:
+    try:
+        from models.mongo_models import ExerciseGlobal
+        from services.exercise_search import SearchIndex
+    except ImportError:
+        from ..models.mongo_models import ExerciseGlobal
+        from ..services.exercise_search import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "exercises_global"
+REFRESH_INTERVAL_S = float(os.getenv("EXERCISE_CATALOG_REFRESH_S", "30"))
+
+
+def tracking_type(exercise: Dict[str, Any]) -> str:
+    """default_tracking.type, lower-cased; exercises without one are IMU-tracked"""
+    return (exercise.get("default_tracking") or {}).get("type", "imu").lower()
+
+
+def sort_key(exercise: ExerciseGlobal) -> Tuple[str, str]:
+    """Catalog order: by name, ties by id (stable for keyset pagination)"""
+    return exercise.name.lower(), exercise.id
+
+
+class ExerciseCatalog:
+    def __init__(self, refresh_interval_s: float = REFRESH_INTERVAL_S):
+        self.refresh_interval_s = refresh_interval_s
+        self.db = None
+        self.version = 0
+        self.stamp: Optional[Tuple[int, Any]] = None
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._models: List[ExerciseGlobal] = []
+        self._models_by_id: Dict[str, ExerciseGlobal] = {}
+        self._by_name: Dict[str, Dict[str, Any]] = {}
+        self._search = SearchIndex(())
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.version > 0
+
+    async def _stamp(self, db) -> Tuple[int, Any]:
+        newest = await db[COLLECTION].find_one({}, {"updated_at": 1}, sort=[("updated_at", -1)])
+        count = await db[COLLECTION].estimated_document_count()
+        return count, (newest or {}).get("updated_at")
+
+    async def refresh(self, db) -> None:
+        """Reloads the whole catalog"""
+        async with self._lock:
+            stamp = await self._stamp(db)
+            docs = await db[COLLECTION].find({}).to_list(length=None)
+            models = sorted((ExerciseGlobal.from_mongo(dict(doc)) for doc in docs), key=sort_key)
+            search = SearchIndex((m.id, m.name, m.muscle_groups, m.equipment) for m in models)
+            # Swapped in one go: readers never see a half-built catalog
+            self._docs = {doc["_id"]: doc for doc in docs}
+            self._models = models
+            self._models_by_id = {m.id: m for m in models}
+            self._by_name = {doc["name"].lower(): doc for doc in docs if doc.get("name")}
+            self._search = search
+            self.stamp = stamp
+            self.version += 1
+        logger.info(f"Exercise catalog loaded: {len(docs)} exercises (version {self.version})")
+
+    async def refresh_if_changed(self, db) -> bool:
+        if self.loaded and await self._stamp(db) == self.stamp:
+            return False
+        await self.refresh(db)
+        return True
+
+    async def ensure_loaded(self, db) -> None:
+        """For callers that may run before startup finished loading"""
+        if not self.loaded:
+            await self.refresh(db)
+
+    # ─── Lookups (no database access) ──────────────────────────────────────
+
+    def get(self, exercise_id: str) -> Optional[Dict[str, Any]]:
+        return self._docs.get(exercise_id)
+
+    def get_model(self, exercise_id: str) -> Optional[ExerciseGlobal]:
+        return self._models_by_id.get(exercise_id)
+
+    def find_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        return self._by_name.get(name.lower())
+
+    def all(self) -> List[ExerciseGlobal]:
+        """Every exercise, in sort_key order"""
+        return self._models
+
+    def search(self, query: str) -> List[ExerciseGlobal]:
+        """Exercises matching the query, best first (see services/exercise_search)"""
+        return [self._models_by_id[exercise_id] for exercise_id in self._search.search(query)]
+
+    # ─── Background refresh ────────────────────────────────────────────────
+
+    async def start(self, db) -> None:
+        self.db = db
+        try:
+            await self.refresh(db)
+        except Exception as e:
+            # Requests load it lazily (ensure_loaded) once MongoDB is reachable
+            logger.error(f"Failed to load exercise catalog: {str(e)}")
+        if self._task is None and self.refresh_interval_s > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval_s)
+            try:
+                await self.refresh_if_changed(self.db)
+            except Exception as e:
+                logger.error(f"Exercise catalog refresh failed: {str(e)}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+catalog = ExerciseCatalog()
@@ -0,0 +1,184 @@
+"""
+In-memory search over the global exercise catalog.
+
+Exercise search used an unanchored, case-insensitive ``$regex`` on the name:
+it could not use the ``name`` index, scanned the collection on every
+keystroke of the exercise picker and fed user input to the regex engine.
+The catalog is small and already held in memory (services/exercise_catalog),
+so it is indexed here instead:
+
+- every word of the name, muscle groups and equipment goes into a prefix
+  trie — "ben" finds "Bench Press" while the user is still typing;
+- the same words are indexed by trigram, which finds candidates for words
+  with a typo ("bemch"); candidates are confirmed with a bounded edit
+  distance (1 for short words, 2 for longer ones).
+
+Every query word must match (exactly, as a prefix or within the typo
+budget). Results are ranked by match quality and by the field that matched
+(name > muscle group > equipment), with a bonus when the name itself starts
+with the query. A search touches a few trie nodes and posting dicts, never
+the whole catalog.
+"""
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+# Weight of the field a word came from
+NAME, MUSCLE_GROUP, EQUIPMENT = 1.0, 0.6, 0.5
+
+# Score of one query word by how it matched
+EXACT, PREFIX, FUZZY = 1.0, 0.8, 0.5
+
+MAX_QUERY_WORDS = 8
+MIN_FUZZY_LENGTH = 3
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Lower-case, accents stripped"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def words(text: Optional[str]) -> List[str]:
+    return _WORD.findall(normalize(text)) if text else []
+
+
+def trigrams(word: str) -> Set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_typos(word: str) -> int:
+    return 1 if len(word) <= 5 else 2
+
+
+def within_distance(a: str, b: str, limit: int) -> bool:
+    """Levenshtein distance a↔b <= limit, stopping as soon as it is exceeded"""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+class _Node:
+    __slots__ = ("children", "words")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # Every indexed word in this subtree: a prefix lookup is one walk
+        self.words: Set[str] = set()
+
+
+class SearchIndex:
+    def __init__(self, entries: Iterable[Tuple[str, str, Sequence[str], Optional[str]]]):
+        """entries: (id, name, muscle_groups, equipment)"""
+        self._root = _Node()
+        # word → {exercise id: best field weight}
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._trigrams: Dict[str, Set[str]] = {}
+        self._names: Dict[str, str] = {}
+
+        for exercise_id, name, muscle_groups, equipment in entries:
+            self._names[exercise_id] = " ".join(words(name))
+            fields = [(name, NAME), (equipment, EQUIPMENT)]
+            fields += [(group, MUSCLE_GROUP) for group in muscle_groups or ()]
+            for text, weight in fields:
+                for word in words(text):
+                    self._add(word, exercise_id, weight)
+
+    def _add(self, word: str, exercise_id: str, weight: float) -> None:
+        postings = self._postings.get(word)
+        if postings is None:
+            postings = self._postings[word] = {}
+            node = self._root
+            node.words.add(word)
+            for ch in word:
+                node = node.children.setdefault(ch, _Node())
+                node.words.add(word)
+            for gram in trigrams(word):
+                self._trigrams.setdefault(gram, set()).add(word)
+        if weight > postings.get(exercise_id, 0.0):
+            postings[exercise_id] = weight
+
+    def _prefixed(self, prefix: str) -> Set[str]:
+        node = self._root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return set()
+        return node.words
+
+    def _similar(self, word: str) -> Dict[str, float]:
+        """Indexed words within the typo budget of word → similarity 0..1"""
+        grams = trigrams(word)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        limit = max_typos(word)
+        similar = {}
+        for candidate, count in shared.items():
+            # One typo changes at most three trigrams
+            if count < len(grams) - 3 * limit:
+                continue
+            if within_distance(word, candidate, limit):
+                similar[candidate] = count / len(grams | trigrams(candidate))
+        return similar
+
+    def _match_word(self, word: str) -> Dict[str, float]:
+        """exercise id → best score of one query word"""
+        scores: Dict[str, float] = {}
+
+        def add(indexed: str, quality: float) -> None:
+            for exercise_id, weight in self._postings[indexed].items():
+                score = quality * weight
+                if score > scores.get(exercise_id, 0.0):
+                    scores[exercise_id] = score
+
+        for indexed in self._prefixed(word):
+            if indexed == word:
+                add(indexed, EXACT)
+            else:
+                # "bench" for "be" is a weaker match than for "benc"
+                add(indexed, PREFIX * (0.5 + 0.5 * len(word) / len(indexed)))
+        if len(word) >= MIN_FUZZY_LENGTH:
+            for indexed, similarity in self._similar(word).items():
+                add(indexed, FUZZY * similarity)
+        return scores
+
+    def search(self, query: str) -> List[str]:
+        """Exercise ids matching every word of the query, best first"""
+        query_words = words(query)[:MAX_QUERY_WORDS]
+        if not query_words:
+            return []
+
+        totals: Optional[Dict[str, float]] = None
+        for word in query_words:
+            scores = self._match_word(word)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {eid: total + scores[eid] for eid, total in totals.items() if eid in scores}
+            if not totals:
+                return []
+
+        phrase = " ".join(query_words)
+        ranked = []
+        for exercise_id, score in totals.items():
+            name = self._names[exercise_id]
+            if name == phrase:
+                score += 2.0
+            elif name.startswith(phrase):
+                score += 1.0
+            ranked.append((-score, len(name), name, exercise_id))
+        ranked.sort()
+        return [exercise_id for *_, exercise_id in ranked]
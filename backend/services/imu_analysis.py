@@ -0,0 +1,405 @@
+"""
+Rep detection, set segmentation and per-rep metrics for IMU recordings.
+
+Everything operates on whole arrays — there is no per-sample Python loop, so a
+recording is processed in a handful of NumPy passes:
+
+1. Gravity is estimated with a moving average and removed; the linear
+   acceleration is projected onto its principal axis (the movement direction).
+2. The projected acceleration is integrated into a drift-corrected,
+   velocity-like signal. A Schmitt trigger (hysteresis thresholds,
+   forward-filled state, reset during rest) turns it into a clean square
+   wave; every low→high transition is one rep.
+3. Reps are grouped into sets by the tracker's ex_start / set_done events when
+   the log has them, otherwise by rest gaps between reps.
+4. Per-rep metrics (duration, tempo split, range of motion, peak acceleration)
+   are computed with segment reductions (``ufunc.reduceat``); concentric
+   velocity and per-set velocity loss come from ``imu_velocity``.
+"""
+import sys
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+current_dir = Path(__file__).parent
+parent_dir = current_dir.parent.parent
+if str(parent_dir) not in sys.path:
+    sys.path.insert(0, str(parent_dir))
+
+try:
+    from backend.services import imu_velocity
+    from backend.services.imu_format import ingest_text_log, load_recording, recording_info
+    from backend.services.imu_signal import moving_average, segment_ids, segment_reduce
+except ImportError:
+    try:
+        from services import imu_velocity
+        from services.imu_format import ingest_text_log, load_recording, recording_info
+        from services.imu_signal import moving_average, segment_ids, segment_reduce
+    except ImportError:
+        from . import imu_velocity
+        from .imu_format import ingest_text_log, load_recording, recording_info
+        from .imu_signal import moving_average, segment_ids, segment_reduce
+
+ANALYSIS_VERSION = 2
+
+# Tunables (seconds unless stated otherwise)
+SMOOTH_WINDOW_S = 0.2
+GRAVITY_WINDOW_S = 4.0
+DRIFT_WINDOW_S = 4.0
+ACTIVITY_WINDOW_S = 1.0
+MIN_REP_S = 0.6
+MAX_REP_S = 8.0
+MIN_REST_GAP_S = 8.0
+# Hysteresis band as a fraction of the typical velocity-signal amplitude
+HYSTERESIS = 0.35
+# Rolling acceleration std below this fraction of the loudest second is rest
+ACTIVITY_THRESHOLD = 0.2
+
+
+class IMUSignalError(ValueError):
+    """Запись разобрана, но сигнал непригоден для анализа"""
+
+
+def _principal_axis(m: np.ndarray) -> np.ndarray:
+    """Unit vector of the direction with the largest variance (3x3 eigh)."""
+    centered = m - m.mean(axis=0)
+    cov = centered.T @ centered
+    try:
+        _, vecs = np.linalg.eigh(cov)
+    except np.linalg.LinAlgError as e:
+        raise IMUSignalError(f"no movement axis: {e}") from e
+    axis = vecs[:, -1]
+    # Deterministic sign: the largest component is positive
+    return axis if axis[np.argmax(np.abs(axis))] >= 0 else -axis
+
+
+def _schmitt(x: np.ndarray, low: float, high: float, reset: np.ndarray) -> np.ndarray:
+    """
+    Hysteresis state, loop-free: +1 above high, -1 below low, otherwise the
+    last state. Samples flagged in reset force state 0, so a rep can't start
+    from a threshold crossing that happened before a rest.
+    """
+    raw = np.where(x > high, 1, np.where(x < low, -1, 0)).astype(np.int8)
+    raw[reset] = 2
+    idx = np.where(raw != 0, np.arange(raw.size), 0)
+    np.maximum.accumulate(idx, out=idx)
+    state = raw[idx]
+    state[state == 2] = 0
+    return state
+
+
+def _first_index_of(values: np.ndarray, targets: np.ndarray, ids: np.ndarray, count: int) -> np.ndarray:
+    """For each segment, the first sample index where values == segment target."""
+    n = values.size
+    hit = (ids >= 0) & (values == targets[np.clip(ids, 0, None)])
+    first = np.full(count, n, dtype=np.intp)
+    np.minimum.at(first, ids[hit], np.flatnonzero(hit))
+    return first
+
+
+def detect_reps(columns: Dict[str, np.ndarray], fs: float) -> Dict[str, Any]:
+    """
+    Находит повторения. Returns rep start/end/bottom sample indices plus the
+    movement signal and gyro matrix the metric stage needs.
+    """
+    acc = np.column_stack([columns["ax"], columns["ay"], columns["az"]]).astype(np.float64)
+    gyro = np.column_stack([columns["gx"], columns["gy"], columns["gz"]]).astype(np.float64)
+    n = acc.shape[0]
+
+    gravity = moving_average(acc, GRAVITY_WINDOW_S * fs)
+    linear = acc - gravity
+    axis = _principal_axis(linear)
+    movement = moving_average(linear @ axis, SMOOTH_WINDOW_S * fs)
+
+    # Activity: rolling std of the acceleration relative to the loudest part
+    # of the log — acceleration drops to sensor noise as soon as the user rests
+    mean = moving_average(movement, ACTIVITY_WINDOW_S * fs)
+    sq = moving_average(movement ** 2, ACTIVITY_WINDOW_S * fs)
+    rolling_std = np.sqrt(np.clip(sq - mean ** 2, 0.0, None))
+    loud = float(np.percentile(rolling_std, 99)) if n else 0.0
+    active = rolling_std > ACTIVITY_THRESHOLD * loud if loud > 0 else np.zeros(n, dtype=bool)
+
+    # Velocity-like signal along the movement axis: one zero crossing per rep
+    # (acceleration has several); the slow drift of the running integral is
+    # removed with a long moving average
+    velocity = np.cumsum(movement) / fs
+    signal = velocity - moving_average(velocity, DRIFT_WINDOW_S * fs)
+
+    band = HYSTERESIS * float(np.percentile(np.abs(signal[active]), 95)) if active.any() else 0.0
+    state = _schmitt(signal, -band, band, reset=~active)
+    rising = np.flatnonzero((state[1:] == 1) & (state[:-1] == -1)) + 1
+
+    # Drop crossings closer than the shortest plausible rep
+    if rising.size > 1:
+        keep = np.concatenate(([True], np.diff(rising) >= MIN_REP_S * fs))
+        rising = rising[keep]
+
+    # Rep boundaries: halfway between neighbouring crossings; the outer
+    # boundaries extend by half the neighbouring period
+    if rising.size == 0:
+        starts = ends = np.empty(0, dtype=np.intp)
+    else:
+        gaps = np.diff(rising)
+        half = np.empty(rising.size, dtype=np.intp)
+        half[:-1] = gaps // 2
+        half[-1] = half[-2] if rising.size > 1 else int(fs)
+        # Around rests the neighbouring crossing is far away — cap at a
+        # typical half period instead
+        typical = int(np.median(gaps)) if gaps.size else int(2 * fs)
+        half = np.minimum(half, min(int(0.5 * typical), int(MAX_REP_S * fs / 2)))
+        left_half = np.concatenate(([half[0]], half[:-1]))
+        starts = np.clip(rising - left_half, 0, n - 1)
+        ends = np.clip(rising + half, 1, n)
+        # Boundaries go where the bar is at rest (velocity ≈ 0 at the top of
+        # the movement) — velocity integration relies on that
+        radius = int(0.25 * typical)
+        speed = np.abs(signal)
+        starts = _snap_to_rest(speed, starts, radius)
+        ends = np.minimum(_snap_to_rest(speed, ends - 1, radius) + 1, n)
+        # A rest gap is not part of the neighbouring rep
+        starts = np.maximum(starts, np.concatenate(([0], ends[:-1])))
+        valid = ends > starts
+        starts, ends, rising = starts[valid], ends[valid], rising[valid]
+
+    return {
+        "starts": starts.astype(np.intp),
+        "ends": ends.astype(np.intp),
+        "bottoms": rising.astype(np.intp),
+        "movement": movement,
+        "gyro": gyro,
+    }
+
+
+def _snap_to_rest(speed: np.ndarray, idx: np.ndarray, radius: int) -> np.ndarray:
+    """Moves every index to the quietest sample (min |speed|) within ±radius."""
+    if idx.size == 0 or radius < 1:
+        return idx
+    offsets = np.arange(-radius, radius + 1)
+    window = np.clip(idx[:, None] + offsets, 0, speed.size - 1)
+    return window[np.arange(idx.size), np.argmin(speed[window], axis=1)]
+
+
+def segment_sets(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    bottoms: np.ndarray,
+    fs: float,
+    events: Optional[list] = None,
+) -> np.ndarray:
+    """Set number (0-based) of every rep."""
+    if starts.size == 0:
+        return np.empty(0, dtype=np.intp)
+
+    markers = sorted(
+        e["i"] for e in (events or [])
+        if e.get("e") in ("ex_start", "set_done") and isinstance(e.get("i"), int)
+    )
+    set_done = sorted(e["i"] for e in (events or []) if e.get("e") == "set_done" and isinstance(e.get("i"), int))
+    if set_done:
+        # Tracker told us where sets end: a rep belongs to the first set that
+        # finishes after the rep's bottom
+        return np.searchsorted(np.asarray(set_done), bottoms, side="left")
+    if markers:
+        return np.searchsorted(np.asarray(markers), bottoms, side="right")
+
+    centers = (starts + ends) / 2.0
+    gaps = np.diff(centers)
+    typical = float(np.median(gaps)) if gaps.size else 0.0
+    threshold = max(MIN_REST_GAP_S * fs, 3.0 * typical)
+    return np.concatenate(([0], np.cumsum(gaps > threshold))).astype(np.intp)
+
+
+def rep_metrics(detection: Dict[str, Any], fs: float) -> Dict[str, np.ndarray]:
+    """Duration, tempo split, range of motion and peak acceleration per rep."""
+    starts, ends = detection["starts"], detection["ends"]
+    count = starts.size
+    n = detection["movement"].size
+    if count == 0:
+        empty = np.empty(0)
+        return {k: empty for k in ("duration_s", "first_phase_s", "second_phase_s", "rom_deg", "peak_accel")}
+
+    gyro = detection["gyro"]
+    omega = gyro @ _principal_axis(gyro)  # deg/s around the dominant rotation axis
+    angle = np.cumsum(omega) / fs
+    ids = segment_ids(n, starts, ends)
+
+    # Angle relative to the start of each rep
+    rel_angle = angle - angle[starts][np.clip(ids, 0, None)]
+    rel_angle = np.where(ids >= 0, rel_angle, 0.0)
+    amax = segment_reduce(np.maximum, rel_angle, starts, ends)
+    amin = segment_reduce(np.minimum, rel_angle, starts, ends)
+    rom = amax - amin
+
+    # Turnaround = furthest point from the starting position
+    excursion = np.abs(rel_angle)
+    turn_value = segment_reduce(np.maximum, excursion, starts, ends)
+    turn_idx = _first_index_of(excursion, turn_value, ids, count)
+
+    duration = (ends - starts) / fs
+    first_phase = (turn_idx - starts) / fs
+    peak_accel = segment_reduce(np.maximum, np.abs(detection["movement"]), starts, ends)
+
+    return {
+        "duration_s": duration,
+        "first_phase_s": first_phase,
+        "second_phase_s": duration - first_phase,
+        "rom_deg": rom,
+        "peak_accel": peak_accel,
+    }
+
+
+def _round(values: np.ndarray, digits: int = 3) -> list:
+    return np.round(values.astype(np.float64), digits).tolist()
+
+
+def _set_means(values: np.ndarray, set_idx: np.ndarray, count: int) -> np.ndarray:
+    sums = np.bincount(set_idx, weights=values, minlength=count)
+    reps = np.bincount(set_idx, minlength=count)
+    return np.divide(sums, reps, out=np.zeros(count), where=reps > 0)
+
+
+def analyze(columns: Dict[str, np.ndarray], meta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Полный анализ записи → metrics_summary (JSON/BSON-совместимый словарь).
+    """
+    fs = float(meta.get("sample_rate_hz") or 0)
+    t_ms = np.asarray(columns["t_ms"])
+    if fs <= 0 or t_ms.size < 2:
+        return {"analysis_version": ANALYSIS_VERSION, "total_reps": 0, "sets": [], "reps": []}
+    for name in ("ax", "ay", "az", "gx", "gy", "gz"):
+        if not np.isfinite(columns[name]).all():
+            raise IMUSignalError(f"non-finite samples in {name}")
+
+    detection = detect_reps(columns, fs)
+    starts, ends = detection["starts"], detection["ends"]
+    set_idx = segment_sets(starts, ends, detection["bottoms"], fs, meta.get("events"))
+    metrics = rep_metrics(detection, fs)
+
+    # Re-number sets densely (event-based numbering may skip empty sets)
+    set_numbers, set_idx = np.unique(set_idx, return_inverse=True) if set_idx.size else (np.empty(0), set_idx)
+    set_count = set_numbers.size
+
+    set_first = np.full(set_count, starts.size, dtype=np.intp)
+    np.minimum.at(set_first, set_idx, np.arange(starts.size))
+    set_last = np.full(set_count, -1, dtype=np.intp)
+    np.maximum.at(set_last, set_idx, np.arange(starts.size))
+    set_start = starts[set_first] if set_count else starts[:0]
+    set_end = ends[set_last] if set_count else ends[:0]
+    rest_after = np.append((set_start[1:] - set_end[:-1]) / fs, np.nan) if set_count else np.empty(0)
+
+    acc = np.column_stack([columns["ax"], columns["ay"], columns["az"]]).astype(np.float64)
+    a_up = imu_velocity.vertical_acceleration(acc, starts, ends)
+    velocity = imu_velocity.rep_velocities(a_up, fs, starts, ends)
+    metrics["mean_velocity"] = velocity["mean_velocity"]
+    velocity_loss = imu_velocity.velocity_loss(velocity["mean_velocity"], set_idx, set_count)
+    peak_velocity = np.zeros(set_count)
+    np.maximum.at(peak_velocity, set_idx, velocity["peak_velocity"])
+
+    reps_per_set = np.bincount(set_idx, minlength=set_count)
+    means = {k: _set_means(v, set_idx, set_count) for k, v in metrics.items()}
+
+    reps = [
+        {
+            "set_index": int(s),
+            "start_ms": int(a),
+            "end_ms": int(b),
+            "duration_s": d,
+            "first_phase_s": p1,
+            "second_phase_s": p2,
+            "rom_deg": rom,
+            "peak_accel": pk,
+            "mean_velocity_mps": mv,
+            "peak_velocity_mps": pv,
+        }
+        for s, a, b, d, p1, p2, rom, pk, mv, pv in zip(
+            set_idx.tolist(),
+            t_ms[starts].tolist(),
+            t_ms[np.maximum(ends - 1, 0)].tolist(),
+            _round(metrics["duration_s"]),
+            _round(metrics["first_phase_s"]),
+            _round(metrics["second_phase_s"]),
+            _round(metrics["rom_deg"], 1),
+            _round(metrics["peak_accel"]),
+            _round(velocity["mean_velocity"], 2),
+            _round(velocity["peak_velocity"], 2),
+        )
+    ]
+    sets = [
+        {
+            "set_index": i,
+            "reps": int(reps_per_set[i]),
+            "start_ms": int(t_ms[set_start[i]]),
+            "end_ms": int(t_ms[set_end[i] - 1]),
+            "start_row": int(set_start[i]),
+            "end_row": int(set_end[i]),
+            "mean_rep_s": round(float(means["duration_s"][i]), 3),
+            "tempo": {
+                "first_phase_s": round(float(means["first_phase_s"][i]), 3),
+                "second_phase_s": round(float(means["second_phase_s"][i]), 3),
+            },
+            "mean_rom_deg": round(float(means["rom_deg"][i]), 1),
+            "mean_velocity_mps": round(float(means["mean_velocity"][i]), 2),
+            "peak_velocity_mps": round(float(peak_velocity[i]), 2),
+            "velocity_loss_pct": round(float(velocity_loss[i]), 1),
+            "rest_after_s": None if np.isnan(rest_after[i]) else round(float(rest_after[i]), 1),
+        }
+        for i in range(set_count)
+    ]
+
+    return {
+        "analysis_version": ANALYSIS_VERSION,
+        "sample_rate_hz": int(fs),
+        "duration_ms": int(t_ms[-1]),
+        "total_reps": int(starts.size),
+        "total_sets": int(set_count),
+        "time_under_tension_s": round(float(metrics["duration_s"].sum()), 2),
+        "sets": sets,
+        "reps": reps,
+    }
+
+
+def analyze_recording(path) -> Dict[str, Any]:
+    """Анализ записи, сохранённой в колоночном формате."""
+    columns, meta = load_recording(path, mmap=True)
+    return analyze(columns, meta)
+
+
+def process_log(raw_path, target) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    Full post-processing of an uploaded text log in one call (meant to run in a
+    worker process): ingest into the columnar format, then analyse.
+    Returns (ingest info, metrics_summary or None).
+    """
+    if Path(raw_path).exists():
+        info = ingest_text_log(raw_path, target)
+    else:
+        # Text log already pruned (IMU_RAW_LOG_DAYS): the archive holds the same samples
+        info = recording_info(target)
+    try:
+        summary = analyze_recording(target)
+    except IMUSignalError:
+        # A log that parsed but can't be analysed is still a valid recording
+        summary = None
+    return info, summary
+
+
+def set_velocity_metrics(summary: Optional[Dict[str, Any]], set_index: int) -> Optional[Dict[str, Any]]:
+    """
+    VBT numbers of one set of a metrics_summary, as stored per SessionSet.
+    None if the summary has no such set.
+    """
+    sets = (summary or {}).get("sets") or []
+    if not 0 <= set_index < len(sets):
+        return None
+    log_set = sets[set_index]
+    reps = [r for r in summary.get("reps") or [] if r["set_index"] == set_index]
+    return {
+        "reps": log_set["reps"],
+        "mean_velocity_mps": log_set.get("mean_velocity_mps"),
+        "peak_velocity_mps": log_set.get("peak_velocity_mps"),
+        "velocity_loss_pct": log_set.get("velocity_loss_pct"),
+        "rep_mean_velocity_mps": [r.get("mean_velocity_mps") for r in reps],
+        "rep_peak_velocity_mps": [r.get("peak_velocity_mps") for r in reps],
+        "analysis_version": summary.get("analysis_version"),
+    }
@@ -0,0 +1,541 @@
+"""
+Columnar storage format for IMU recordings.
+
+The tracker log is plain text: one sample per line
+(``t_ms ax ay az gx gy gz`` separated by commas, semicolons or whitespace)
+interleaved with JSON event lines such as ``{"e":"set_done","set":1}``.
+
+At ingest the text is parsed into fixed-width typed columns and written as a
+single compressed ``.npz`` archive. Sensor columns are stored at rest as
+fixed-point integers at the precision the tracker logged them with,
+delta-coded and byte-shuffled before deflate, which is lossless with respect
+to the text log and compresses far better than raw floats. Readers either decompress the archive
+(``load_recording``) or ask for memory-mapped columns (``mmap=True``), in which
+case the columns are unpacked once into a ``.cols`` directory of raw ``.npy``
+files under ``COLUMN_CACHE_DIR`` and mapped from there on later reads. That
+directory is only a cache: entries unused for ``COLUMN_CACHE_TTL_S`` and the
+least recently used ones beyond ``COLUMN_CACHE_MAX_BYTES`` are removed
+whenever a new entry is unpacked (and by ``prune_column_cache``).
+
+The text log is not needed once its archive exists (the archive keeps every
+sample at logged precision and the tracker events); services/imu_retention
+deletes it after ``IMU_RAW_LOG_DAYS``.
+
+Every archive also carries a sparse time index: the row of the first sample at
+or after every ``INDEX_STEP_MS`` milliseconds. ``window_rows`` uses it to find
+the rows of a time range by touching one index entry and a few pages of
+``t_ms``, then slices the memory-mapped columns — the cost of reading a window
+does not depend on how long the recording is.
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+FORMAT = "npz"
+FORMAT_VERSION = 1
+
+# Column name → dtype. Timestamps are stored relative to t0_ms (kept in meta).
+COLUMNS: Dict[str, np.dtype] = {
+    "t_ms": np.dtype("<u4"),
+    "ax": np.dtype("<f4"),
+    "ay": np.dtype("<f4"),
+    "az": np.dtype("<f4"),
+    "gx": np.dtype("<f4"),
+    "gy": np.dtype("<f4"),
+    "gz": np.dtype("<f4"),
+}
+SENSOR_COLUMNS = ("ax", "ay", "az", "gx", "gy", "gz")
+
+# Sparse time index granularity
+INDEX_STEP_MS = 1000
+INDEX_ARRAY = "index_rows"
+
+# Widest decimal precision looked for when choosing a fixed-point scale
+MAX_SCALE_EXP = 6
+# float32 represents integers exactly up to 2**24
+_FIXED_POINT_LIMIT = float(2 ** 24)
+
+# Unpacked columns for memory-mapped reads; rebuilt from the archive on demand
+COLUMN_CACHE_DIR = Path(os.getenv("IMU_COLUMN_CACHE_DIR", "/app/cache/imu_columns"))
+COLUMN_CACHE_MAX_BYTES = int(float(os.getenv("IMU_COLUMN_CACHE_MB", "512")) * 1024 * 1024)
+COLUMN_CACHE_TTL_S = float(os.getenv("IMU_COLUMN_CACHE_TTL_S", "3600"))
+
+# Text logs are parsed this many bytes at a time, so peak memory follows the
+# chunk and the parsed columns, not the size of the text
+PARSE_CHUNK_BYTES = 1024 * 1024
+
+_DELIMITERS = re.compile(rb"[,;\t]")
+# Sample lines start with a number; everything else is a header, comment or event
+_NON_SAMPLE_LINE = re.compile(rb"^(?![ \t]*[-+.\d]).*(?:\r?\n|$)", re.MULTILINE)
+
+
+class IMUFormatError(ValueError):
+    """Лог не удалось разобрать"""
+
+
+def _line_kinds(buf: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized line classification: (line starts, is_sample, is_event).
+    Same rule as _NON_SAMPLE_LINE: leading spaces and tabs are skipped.
+    """
+    starts = np.concatenate(([0], np.flatnonzero(buf == ord("\n")) + 1))
+    starts = starts[starts < buf.size]
+    # First byte of every line that is not indentation ("\n" counts, so a
+    # blank line stops at its own end)
+    solid = np.flatnonzero((buf != ord(" ")) & (buf != ord("\t")))
+    pos = np.searchsorted(solid, starts)
+    first = np.zeros(starts.size, dtype=np.uint8)
+    found = pos < solid.size
+    first[found] = buf[solid[pos[found]]]
+    is_event = first == ord("{")
+    is_sample = (
+        ((first >= ord("0")) & (first <= ord("9")))
+        | (first == ord("-"))
+        | (first == ord("+"))
+        | (first == ord("."))
+    )
+    return starts, is_sample, is_event
+
+
+def _parse_events(data: bytes, buf: np.ndarray, first_sample: int = 0) -> List[Dict[str, Any]]:
+    starts, is_sample, is_event = _line_kinds(buf)
+    if not is_event.any():
+        return []
+
+    # Sample index of an event = number of sample lines before it
+    sample_index = np.cumsum(is_sample) - is_sample + first_sample
+    events = []
+    ends = np.append(starts[1:], buf.size)
+    for line_no in np.flatnonzero(is_event):
+        raw = data[starts[line_no]:ends[line_no]].strip()
+        try:
+            event = json.loads(raw)
+        except ValueError:
+            continue
+        if isinstance(event, dict):
+            event["i"] = int(sample_index[line_no])
+            events.append(event)
+    return events
+
+
+def _line_chunks(blocks: Iterable[bytes]) -> Iterator[bytes]:
+    """Regroups blocks of bytes into chunks that end on a line boundary"""
+    rest = b""
+    for block in blocks:
+        block = rest + block if rest else block
+        cut = block.rfind(b"\n") + 1
+        # A line longer than a block is carried over whole
+        rest = block[cut:]
+        if cut:
+            yield block[:cut]
+    if rest:
+        yield rest
+
+
+def _read_blocks(path: Path, size: int = PARSE_CHUNK_BYTES) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        yield from iter(lambda: f.read(size), b"")
+
+
+def _parse_table(chunk: bytes) -> Optional[np.ndarray]:
+    """Sample lines of a chunk as a float64 table (None without samples)"""
+    body = _NON_SAMPLE_LINE.sub(b"", chunk)
+    body = _DELIMITERS.sub(b" ", body)
+    if not body.strip():
+        return None
+
+    try:
+        table = np.loadtxt(io.BytesIO(body), dtype=np.float64, ndmin=2)
+    except ValueError as e:
+        raise IMUFormatError(f"Malformed sample line: {e}") from e
+
+    if table.shape[1] < len(COLUMNS):
+        raise IMUFormatError(
+            f"Expected {len(COLUMNS)} columns (t, ax, ay, az, gx, gy, gz), got {table.shape[1]}"
+        )
+    return table
+
+
+def parse_imu_text(data: bytes) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Разбирает текстовый лог трекера в колонки.
+
+    Returns (columns, meta): columns maps every name in COLUMNS to a 1-D array;
+    meta holds t0_ms, sample_rate_hz, duration_ms and tracker events.
+    """
+    blocks = (data[i:i + PARSE_CHUNK_BYTES] for i in range(0, len(data), PARSE_CHUNK_BYTES))
+    return _parse_chunks(_line_chunks(blocks))
+
+
+def _parse_chunks(chunks: Iterable[bytes]) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    events: List[Dict[str, Any]] = []
+    t_parts: List[np.ndarray] = []
+    sensor_parts: Dict[str, List[np.ndarray]] = {name: [] for name in SENSOR_COLUMNS}
+    chunk_scales: Dict[str, List[Optional[int]]] = {name: [] for name in SENSOR_COLUMNS}
+    peaks = dict.fromkeys(SENSOR_COLUMNS, 0.0)
+    samples = 0
+
+    for chunk in chunks:
+        events.extend(_parse_events(chunk, np.frombuffer(chunk, dtype=np.uint8), samples))
+        table = _parse_table(chunk)
+        if table is None:
+            continue
+        # Timestamps stay float64 until the unit is known
+        t_parts.append(table[:, 0].copy())
+        for i, name in enumerate(SENSOR_COLUMNS, start=1):
+            values = table[:, i]
+            sensor_parts[name].append(values.astype(COLUMNS[name]))
+            chunk_scales[name].append(_decimal_places(values))
+            peaks[name] = max(peaks[name], float(np.max(np.abs(values))))
+        samples += table.shape[0]
+
+    if not samples:
+        raise IMUFormatError("Log contains no samples")
+
+    t = np.concatenate(t_parts)
+    del t_parts
+    dt = np.diff(t)
+    # Some firmware builds log seconds instead of milliseconds
+    if dt.size and np.median(dt) < 0.5 and np.any(t != np.round(t)):
+        t = t * 1000.0
+        dt = dt * 1000.0
+
+    t0 = float(t[0])
+    rel = np.round(t - t0)
+    # Time index and window reads binary-search t_ms: it must never go back
+    if np.any(np.diff(rel) < 0) or rel[-1] > np.iinfo(np.uint32).max:
+        raise IMUFormatError("Timestamps are not monotonic")
+
+    columns = {"t_ms": rel.astype(COLUMNS["t_ms"])}
+    scale_exp = {}
+    for name in SENSOR_COLUMNS:
+        columns[name] = np.concatenate(sensor_parts.pop(name))
+        scale_exp[name] = _merge_scales(chunk_scales[name], peaks[name])
+
+    median_dt = float(np.median(dt)) if dt.size else 0.0
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "t0_ms": int(round(t0)),
+        "samples": samples,
+        "sample_rate_hz": int(round(1000.0 / median_dt)) if median_dt > 0 else 0,
+        "duration_ms": int(rel[-1]),
+        "scale_exp": scale_exp,
+        "events": events,
+    }
+    return columns, meta
+
+
+def _decimal_places(values: np.ndarray) -> Optional[int]:
+    """Smallest number of decimals that represents every value exactly, if any."""
+    peak = float(np.max(np.abs(values))) if values.size else 0.0
+    for k in range(MAX_SCALE_EXP + 1):
+        scaled = values * 10.0 ** k
+        if peak * 10.0 ** k >= _FIXED_POINT_LIMIT:
+            return None
+        if np.all(np.abs(scaled - np.round(scaled)) < 1e-6):
+            return k
+    return None
+
+
+def _merge_scales(scales: List[Optional[int]], peak: float) -> Optional[int]:
+    """_decimal_places of a whole column from those of its chunks"""
+    if not scales or any(k is None for k in scales):
+        return None
+    k = max(scales)
+    return k if peak * 10.0 ** k < _FIXED_POINT_LIMIT else None
+
+
+def _shuffle(arr: np.ndarray) -> np.ndarray:
+    """Byte-plane transpose: groups the slowly changing high bytes together."""
+    return np.ascontiguousarray(arr.view(np.uint8).reshape(-1, arr.itemsize).T).reshape(-1)
+
+
+def _unshuffle(planes: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    return np.ascontiguousarray(planes.reshape(dtype.itemsize, -1).T).reshape(-1).view(dtype)
+
+
+def _encode_column(values: np.ndarray, scale_exp: Optional[int]) -> np.ndarray:
+    if scale_exp is None:
+        return _shuffle(np.ascontiguousarray(values, dtype="<f4"))
+    fixed = np.round(values.astype(np.float64) * 10.0 ** scale_exp).astype("<i4")
+    return _shuffle(np.diff(fixed, prepend=np.int32(0)).astype("<i4"))
+
+
+def _decode_column(planes: np.ndarray, scale_exp: Optional[int], dtype: np.dtype) -> np.ndarray:
+    if scale_exp is None:
+        return _unshuffle(planes, np.dtype("<f4")).astype(dtype, copy=False)
+    fixed = np.cumsum(_unshuffle(planes, np.dtype("<i4")), dtype=np.int64)
+    return (fixed / 10.0 ** scale_exp).astype(dtype)
+
+
+def build_time_index(t_ms: np.ndarray, step_ms: int = INDEX_STEP_MS) -> np.ndarray:
+    """Row of the first sample at or after every step_ms (t_ms is sorted)."""
+    last = int(t_ms[-1]) if t_ms.size else 0
+    marks = np.arange(0, last + step_ms + 1, step_ms, dtype=np.int64)
+    return np.searchsorted(t_ms, marks, side="left").astype("<u4")
+
+
+def write_recording(path: Path, columns: Dict[str, np.ndarray], meta: Dict[str, Any]) -> str:
+    """
+    Атомарно записывает колонки в сжатый .npz архив.
+    Возвращает sha256 записанного файла.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    scale_exp = meta.setdefault("scale_exp", {})
+    arrays = {
+        # Timestamps are integral milliseconds: always delta + fixed-point
+        "t_ms": _encode_column(columns["t_ms"], 0),
+    }
+    for name in SENSOR_COLUMNS:
+        arrays[name] = _encode_column(columns[name], scale_exp.get(name))
+    meta["index_step_ms"] = INDEX_STEP_MS
+    arrays[INDEX_ARRAY] = build_time_index(columns["t_ms"], INDEX_STEP_MS)
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)
+
+    # The job worker and scripts/reprocess_imu_logs.py may write the same recording
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cols_dir(path: Path) -> Path:
+    # Archives of different directories may share a file name
+    key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:12]
+    return COLUMN_CACHE_DIR / f"{Path(path).name}.{key}.cols"
+
+
+def _legacy_cols_dir(path: Path) -> Path:
+    """Where columns were unpacked before the cache directory existed"""
+    return path.with_name(path.name + ".cols")
+
+
+def _unpack_columns(path: Path) -> Path:
+    """Unpacks the archive into raw .npy files that np.load can memory-map."""
+    cols_dir = _cols_dir(path)
+    marker = cols_dir / "meta.json"
+    try:
+        # mtime of meta.json = last use, for the LRU eviction
+        os.utime(marker)
+        return cols_dir
+    except FileNotFoundError:
+        pass
+
+    # Unique per call: request threads of one process unpack concurrently too
+    tmp_dir = cols_dir.with_name(f"{cols_dir.name}.{uuid.uuid4().hex}.tmp")
+    tmp_dir.mkdir(parents=True)
+    try:
+        columns, meta = _read_archive(path)
+        for name, values in columns.items():
+            np.save(tmp_dir / f"{name}.npy", values)
+        index_rows = _read_index(path)
+        if index_rows is not None:
+            np.save(tmp_dir / f"{INDEX_ARRAY}.npy", index_rows)
+        (tmp_dir / "meta.json").write_bytes(json.dumps(meta).encode("utf-8"))
+        os.replace(tmp_dir, cols_dir)
+    except OSError:
+        # Another thread or process unpacked it first (cols_dir is not empty)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not marker.exists():
+            raise
+    prune_column_cache(keep=cols_dir)
+    return cols_dir
+
+
+def _with_columns(path: Path, reader):
+    """reader(cols_dir), unpacking again if the entry was evicted in between"""
+    for attempt in range(2):
+        cols_dir = _unpack_columns(path)
+        try:
+            return reader(cols_dir)
+        except FileNotFoundError:
+            if attempt:
+                raise
+
+
+def prune_column_cache(
+    max_bytes: Optional[int] = None,
+    ttl_s: Optional[float] = None,
+    keep: Optional[Path] = None,
+) -> int:
+    """
+    Removes cache entries unused for ttl_s, then the least recently used ones
+    until the cache fits in max_bytes. Returns bytes freed.
+    """
+    max_bytes = COLUMN_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    ttl_s = COLUMN_CACHE_TTL_S if ttl_s is None else ttl_s
+    if not COLUMN_CACHE_DIR.exists():
+        return 0
+
+    now = time.time()
+    entries = []
+    for entry in COLUMN_CACHE_DIR.iterdir():
+        try:
+            if entry.name.endswith(".cols"):
+                used = (entry / "meta.json").stat().st_mtime
+            else:
+                # Half-written entry of a process that died
+                used = entry.stat().st_mtime
+                if now - used < ttl_s:
+                    continue
+            size = sum(child.stat().st_size for child in entry.iterdir())
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        entries.append((used, size, entry))
+
+    entries.sort(key=lambda item: item[0])
+    total = sum(size for _, size, _ in entries)
+    freed = 0
+    for used, size, entry in entries:
+        if entry == keep:
+            continue
+        if now - used <= ttl_s and total <= max_bytes:
+            break
+        # Readers that already mapped the files keep them until they are done
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        freed += size
+    return freed
+
+
+def load_recording(path: Path, mmap: bool = False) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Читает запись. С mmap=True колонки отображаются в память без копирования:
+    срезы читают с диска только нужные страницы.
+    """
+    path = Path(path)
+    if mmap:
+        def read(cols_dir: Path):
+            columns = {name: np.load(cols_dir / f"{name}.npy", mmap_mode="r") for name in COLUMNS}
+            meta = json.loads((cols_dir / "meta.json").read_bytes())
+            return columns, meta
+        return _with_columns(path, read)
+
+    return _read_archive(path)
+
+
+def _read_archive(path: Path) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    with np.load(path) as archive:
+        meta = json.loads(archive["meta"].tobytes())
+        scale_exp = meta.get("scale_exp", {})
+        columns = {"t_ms": _decode_column(archive["t_ms"], 0, COLUMNS["t_ms"])}
+        for name in SENSOR_COLUMNS:
+            columns[name] = _decode_column(archive[name], scale_exp.get(name), COLUMNS[name])
+    return columns, meta
+
+
+def _read_index(path: Path) -> Optional[np.ndarray]:
+    with np.load(path) as archive:
+        # Archives written before the index existed don't have it
+        return archive[INDEX_ARRAY] if INDEX_ARRAY in archive.files else None
+
+
+def row_range(
+    t_ms: np.ndarray,
+    start_ms: int,
+    end_ms: int,
+    index_rows: Optional[np.ndarray] = None,
+    step_ms: int = INDEX_STEP_MS,
+) -> Tuple[int, int]:
+    """
+    Rows [start, end) of the samples with start_ms <= t < end_ms.
+    With the sparse index only the rows between two index marks are searched.
+    """
+    def locate(ms: int) -> int:
+        if index_rows is None or index_rows.size == 0:
+            return int(np.searchsorted(t_ms, ms, side="left"))
+        k = min(max(ms // step_ms, 0), index_rows.size - 1)
+        lo = int(index_rows[k])
+        hi = int(index_rows[k + 1]) if k + 1 < index_rows.size else t_ms.shape[0]
+        return lo + int(np.searchsorted(t_ms[lo:hi], ms, side="left"))
+
+    start_ms, end_ms = max(int(start_ms), 0), max(int(end_ms), 0)
+    start = locate(start_ms)
+    return start, max(locate(end_ms), start)
+
+
+def read_rows(path: Path, start_row: int, end_row: int) -> Dict[str, np.ndarray]:
+    """Копия строк [start_row, end_row) из отображённых в память колонок."""
+    columns, _ = load_recording(path, mmap=True)
+    return {name: np.array(values[start_row:end_row]) for name, values in columns.items()}
+
+
+def window_rows(path: Path, start_ms: int, end_ms: int) -> Tuple[int, int]:
+    """Rows [start, end) of the samples with start_ms <= t_ms < end_ms (relative to t0)."""
+    def read(cols_dir: Path):
+        t_ms = np.load(cols_dir / "t_ms.npy", mmap_mode="r")
+        index_file = cols_dir / f"{INDEX_ARRAY}.npy"
+        index_rows = np.load(index_file, mmap_mode="r") if index_file.exists() else None
+        meta = json.loads((cols_dir / "meta.json").read_bytes())
+        return row_range(t_ms, start_ms, end_ms, index_rows, meta.get("index_step_ms", INDEX_STEP_MS))
+    return _with_columns(Path(path), read)
+
+
+def drop_column_cache(path: Path) -> None:
+    """Удаляет распакованные колонки (их всегда можно восстановить из архива)"""
+    for cols_dir in (_cols_dir(Path(path)), _legacy_cols_dir(Path(path))):
+        if cols_dir.exists():
+            shutil.rmtree(cols_dir, ignore_errors=True)
+
+
+def ingest_text_log(source: Path, target: Path) -> Dict[str, Any]:
+    """
+    Ingest stage: text log → columnar archive.
+    Returns the fields needed to build an IMURecord.
+    """
+    columns, meta = _parse_chunks(_line_chunks(_read_blocks(Path(source))))
+    checksum = write_recording(target, columns, meta)
+    # Re-ingest (retry, reprocessing): columns unpacked from the old archive are stale
+    drop_column_cache(target)
+    return _record_info(target, meta, checksum)
+
+
+def recording_info(path: Path) -> Dict[str, Any]:
+    """Same fields as ingest_text_log, for an archive whose text log is gone"""
+    with np.load(path) as archive:
+        meta = json.loads(archive["meta"].tobytes())
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return _record_info(Path(path), meta, digest.hexdigest())
+
+
+def _record_info(target: Path, meta: Dict[str, Any], checksum: str) -> Dict[str, Any]:
+    return {
+        "format": FORMAT,
+        "sample_rate_hz": meta["sample_rate_hz"],
+        "duration_ms": meta["duration_ms"],
+        "samples": meta["samples"],
+        "checksum": f"sha256:{checksum}",
+        "local_path": str(target),
+        "size_bytes": Path(target).stat().st_size,
+    }
+
+
+def recording_path_for(raw_path: Path) -> Path:
+    """Columnar archive path for a raw text log (stored next to it)."""
+    raw_path = Path(raw_path)
+    return raw_path.with_name(raw_path.stem + ".imu.npz")
+
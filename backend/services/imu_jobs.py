@@ -0,0 +1,268 @@
+"""
+In-process background job queue for IMU post-processing.
+
+Jobs live in the ``imu_jobs`` collection, so they survive restarts and every
+API worker process can pick them up. A job is claimed atomically with
+``find_one_and_update`` and leased for ``JOB_LEASE``, renewed every
+``HEARTBEAT_S`` while the handler runs; if the process dies the lease expires
+and another worker takes the job over. Every claim gets its own ``lease_id``,
+and a worker only records the outcome of a job whose lease it still holds. Failed jobs are retried
+with exponential backoff up to ``MAX_ATTEMPTS`` times; a kind may register an
+``on_failure`` hook to undo state it set up for a job that finally failed.
+
+Handlers run on the event loop and are expected to push CPU-heavy work to the
+shared, bounded process pool via ``run_cpu`` so parsing and analytics never
+block request handling.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = "imu_jobs"
+
+# Processes for CPU-bound work; in-flight jobs per API worker are capped to the same number
+PROCESS_WORKERS = int(os.getenv("IMU_JOB_PROCESSES", max(1, (os.cpu_count() or 2) - 1)))
+MAX_ATTEMPTS = int(os.getenv("IMU_JOB_MAX_ATTEMPTS", "5"))
+JOB_LEASE = timedelta(minutes=5)
+HEARTBEAT_S = JOB_LEASE.total_seconds() / 3
+POLL_INTERVAL_S = 2.0
+RETRY_BASE_S = 5.0
+RETRY_MAX_S = 600.0
+
+JobHandler = Callable[[dict], Awaitable[Any]]
+FailureHandler = Callable[[dict, str], Awaitable[None]]
+_handlers: Dict[str, JobHandler] = {}
+_failure_handlers: Dict[str, FailureHandler] = {}
+
+
+class PermanentJobError(Exception):
+    """Ошибка, которую бессмысленно повторять (например, битый лог)"""
+
+
+def register(kind: str, on_failure: Optional[FailureHandler] = None) -> Callable[[JobHandler], JobHandler]:
+    """
+    Registers the async handler for a job kind: handler(payload) → result.
+    on_failure(payload, error) runs once the job is marked failed for good.
+    """
+    def decorator(handler: JobHandler) -> JobHandler:
+        _handlers[kind] = handler
+        if on_failure is not None:
+            _failure_handlers[kind] = on_failure
+        return handler
+    return decorator
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(RETRY_BASE_S * 2 ** (attempts - 1), RETRY_MAX_S))
+
+
+async def enqueue(db, kind: str, payload: Dict[str, Any]) -> dict:
+    """Ставит задачу в очередь и сразу возвращает её документ"""
+    now = datetime.now(timezone.utc)
+    job = {
+        "_id": str(uuid.uuid4()),
+        "kind": kind,
+        "payload": payload,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": MAX_ATTEMPTS,
+        "run_after": now,
+        "locked_until": None,
+        "lease_id": None,
+        "last_error": None,
+        "result": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    await db[JOBS_COLLECTION].insert_one(job)
+    worker.notify()
+    return job
+
+
+async def run_cpu(fn: Callable, *args) -> Any:
+    """Runs fn(*args) in the shared process pool (fn must be picklable)."""
+    loop = asyncio.get_running_loop()
+    for attempt in (1, 2):
+        pool = worker.pool()
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # A child died (e.g. OOM-killed) and took the pool with it; a
+            # second breakage is most likely this job itself
+            worker.discard_pool(pool)
+            if attempt == 2:
+                raise
+            logger.warning("IMU process pool is broken; retrying in a new one")
+
+
+class JobWorker:
+    """Polls the job collection and runs up to PROCESS_WORKERS jobs at a time."""
+
+    def __init__(self, concurrency: int = PROCESS_WORKERS):
+        self.concurrency = concurrency
+        self.db = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running: set = set()
+
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.concurrency)
+        return self._pool
+
+    def discard_pool(self, pool: ProcessPoolExecutor) -> None:
+        """Drops a broken pool; the next pool() call starts a fresh one"""
+        # Concurrent jobs all see the same breakage: only the first replaces it
+        if self._pool is pool:
+            self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def notify(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self, db) -> None:
+        if self._task is not None:
+            return
+        self.db = db
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+        logger.info("IMU job worker started (%d processes)", self.concurrency)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Unfinished jobs keep their lease and are picked up again after restart
+        for task in list(self._running):
+            task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                while len(self._running) < self.concurrency:
+                    job = await self._claim()
+                    if job is None:
+                        break
+                    task = asyncio.create_task(self._run(job))
+                    self._running.add(task)
+                    task.add_done_callback(self._on_done)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"IMU job worker error: {str(e)}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL_S)
+            except asyncio.TimeoutError:
+                pass
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._running.discard(task)
+        self.notify()
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await self.db[JOBS_COLLECTION].find_one_and_update(
+            {
+                "kind": {"$in": list(_handlers)},
+                "$or": [
+                    {"status": "queued", "run_after": {"$lte": now}},
+                    # Lease expired: the worker that held it is gone
+                    {"status": "running", "locked_until": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "locked_until": now + JOB_LEASE,
+                    "lease_id": str(uuid.uuid4()),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_after", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _heartbeat(self, job: dict) -> None:
+        """Extends the lease of a running job until cancelled"""
+        jobs = self.db[JOBS_COLLECTION]
+        while True:
+            await asyncio.sleep(HEARTBEAT_S)
+            now = datetime.now(timezone.utc)
+            renewed = await jobs.update_one(
+                {"_id": job["_id"], "lease_id": job["lease_id"]},
+                {"$set": {"locked_until": now + JOB_LEASE, "updated_at": now}},
+            )
+            if not renewed.matched_count:
+                logger.warning(f"IMU job {job['_id']} ({job['kind']}) lost its lease")
+                return
+
+    async def _run(self, job: dict) -> None:
+        jobs = self.db[JOBS_COLLECTION]
+        # Outcomes are only recorded while this claim still holds the job
+        held = {"_id": job["_id"], "lease_id": job["lease_id"]}
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            result = await _handlers[job["kind"]](job["payload"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            now = datetime.now(timezone.utc)
+            permanent = isinstance(e, PermanentJobError) or job["attempts"] >= job["max_attempts"]
+            update = {"status": "failed"} if permanent else {
+                "status": "queued", "run_after": now + _retry_delay(job["attempts"]),
+            }
+            update.update({"locked_until": None, "lease_id": None, "last_error": str(e), "updated_at": now})
+            recorded = await jobs.update_one(held, {"$set": update})
+            if not recorded.matched_count:
+                logger.warning(f"IMU job {job['_id']} ({job['kind']}) failed after its lease was taken over: {str(e)}")
+                return
+            if not permanent:
+                logger.warning(f"IMU job {job['_id']} ({job['kind']}) will be retried: {str(e)}")
+                return
+            logger.error(f"IMU job {job['_id']} ({job['kind']}) failed: {str(e)}")
+            if job["kind"] in _failure_handlers:
+                try:
+                    await _failure_handlers[job["kind"]](job["payload"], str(e))
+                except Exception as hook_error:
+                    logger.error(f"IMU job {job['_id']} ({job['kind']}) failure hook failed: {str(hook_error)}")
+            return
+        finally:
+            heartbeat.cancel()
+
+        recorded = await jobs.update_one(
+            held,
+            {"$set": {
+                "status": "done",
+                "locked_until": None,
+                "lease_id": None,
+                "last_error": None,
+                "result": result,
+                "updated_at": datetime.now(timezone.utc),
+            }},
+        )
+        if not recorded.matched_count:
+            logger.warning(f"IMU job {job['_id']} ({job['kind']}) finished after its lease was taken over")
+
+
+worker = JobWorker()
@@ -0,0 +1,173 @@
+"""
+Downsampled previews of IMU recordings for charts.
+
+Two decimation modes share one output shape (indices into the recording, so
+every channel is sampled at the same timestamps):
+
+* ``lttb``   — Largest-Triangle-Three-Buckets: keeps the visually significant
+  points; best for line charts.
+* ``minmax`` — the min and max of every bucket; preserves peaks exactly, good
+  for envelope / zoomed-out views.
+
+Points are selected on an "activity" signal — the norm of the z-scored sensor
+channels — so a spike in any channel survives decimation.
+
+Previews are precomputed at ``PREVIEW_LEVELS`` when a log is processed;
+requests for other sizes are decimated from the nearest larger level, which
+is only a few thousand points.
+"""
+import sys
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+current_dir = Path(__file__).parent
+parent_dir = current_dir.parent.parent
+if str(parent_dir) not in sys.path:
+    sys.path.insert(0, str(parent_dir))
+
+try:
+    from backend.services.imu_format import SENSOR_COLUMNS, load_recording
+except ImportError:
+    try:
+        from services.imu_format import SENSOR_COLUMNS, load_recording
+    except ImportError:
+        from .imu_format import SENSOR_COLUMNS, load_recording
+
+MODES = ("lttb", "minmax")
+# Precomputed preview sizes (points)
+PREVIEW_LEVELS = (256, 1024, 4096)
+MIN_POINTS = 16
+MAX_POINTS = PREVIEW_LEVELS[-1]
+# Decimals kept in preview values — charts don't need float32 noise
+VALUE_DECIMALS = 4
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """
+    Indices of the n points chosen by Largest-Triangle-Three-Buckets.
+    The loop runs over buckets (≤ n), each bucket is handled with array ops.
+    """
+    size = y.shape[0]
+    if n >= size or n < 3:
+        return np.arange(size)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # n - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, size - 1, n - 1).astype(np.intp)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[:edges[-1]], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[:edges[-1]], edges[:-1]) / counts
+    # The bucket after the last one is the final point itself
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    out = np.empty(n, dtype=np.intp)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - next_x[i]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (next_y[i] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(y: np.ndarray, n: int) -> np.ndarray:
+    """Indices of the min and max of each of n // 2 equal buckets, in time order."""
+    size = y.shape[0]
+    buckets = max(n // 2, 1)
+    if n >= size:
+        return np.arange(size)
+
+    width = -(-size // buckets)
+    padded = np.pad(np.asarray(y, dtype=np.float64), (0, width * buckets - size), mode="edge")
+    grid = padded.reshape(buckets, width)
+    offsets = np.arange(buckets) * width
+    picked = np.concatenate((offsets + grid.argmin(axis=1), offsets + grid.argmax(axis=1)))
+    return np.unique(np.minimum(picked, size - 1))
+
+
+def activity_signal(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """Norm of the z-scored sensor channels."""
+    total = np.zeros(columns["t_ms"].shape[0], dtype=np.float64)
+    for name in SENSOR_COLUMNS:
+        values = np.asarray(columns[name], dtype=np.float64)
+        std = values.std()
+        if std > 0:
+            total += ((values - values.mean()) / std) ** 2
+    return np.sqrt(total)
+
+
+def decimate(columns: Dict[str, np.ndarray], points: int, mode: str = "lttb") -> Dict[str, list]:
+    """Выбирает points точек и возвращает колонки в виде списков (для JSON)."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown preview mode: {mode}")
+    signal = activity_signal(columns)
+    if mode == "lttb":
+        idx = lttb_indices(columns["t_ms"], signal, points)
+    else:
+        idx = minmax_indices(signal, points)
+
+    series = {"t_ms": np.asarray(columns["t_ms"])[idx].astype(np.int64).tolist()}
+    for name in SENSOR_COLUMNS:
+        series[name] = np.round(np.asarray(columns[name])[idx].astype(np.float64), VALUE_DECIMALS).tolist()
+    return series
+
+
+def build_previews(path) -> Dict[str, Dict[int, Dict[str, list]]]:
+    """All precomputed levels for a recording: {mode: {points: series}}."""
+    columns, _ = load_recording(path, mmap=True)
+    return {
+        mode: {points: decimate(columns, points, mode) for points in PREVIEW_LEVELS}
+        for mode in MODES
+    }
+
+
+def level_for(points: int) -> int:
+    """Smallest precomputed level that has at least the requested points."""
+    for level in PREVIEW_LEVELS:
+        if level >= points:
+            return level
+    return PREVIEW_LEVELS[-1]
+
+
+def redecimate(series: Dict[str, list], points: int, mode: str) -> Dict[str, list]:
+    """Decimates an already precomputed (small) level further."""
+    if len(series["t_ms"]) <= points:
+        return series
+    columns = {name: np.asarray(values) for name, values in series.items()}
+    return decimate(columns, points, mode)
+
+
+class PreviewCache:
+    """Tiny in-process LRU for decimated series (keyed by log, mode and points)."""
+
+    def __init__(self, max_items: int = 256):
+        self.max_items = max_items
+        self._items: Dict[Any, Dict[str, list]] = {}
+
+    def get(self, key) -> Optional[Dict[str, list]]:
+        value = self._items.pop(key, None)
+        if value is not None:
+            # Re-insert to mark as most recently used (dicts keep insertion order)
+            self._items[key] = value
+        return value
+
+    def put(self, key, value: Dict[str, list]) -> None:
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.max_items:
+            self._items.pop(next(iter(self._items)))
+
+    def invalidate(self, log_id: str) -> None:
+        for key in [k for k in self._items if k[0] == log_id]:
+            del self._items[key]
+
+
+cache = PreviewCache()
@@ -0,0 +1,327 @@
+"""
+Tiered retention for IMU log storage.
+
+Hot tier: raw text logs and columnar recordings under /app/uploads/imu_logs.
+Cold tier: one zip archive per user per month under ``ARCHIVE_DIR`` (a separate
+volume / mounted bucket), e.g. ``{ARCHIVE_DIR}/{owner_id}/2026-03.zip``.
+
+``compact`` moves recordings whose logs are older than ``RETENTION_DAYS`` to the
+cold tier. Derived data (metrics_summary, previews) stays in MongoDB, so
+history and charts keep working; only raw sample access needs the recording
+back, which ``restore_recording`` does on demand. The archive location is
+stored in ``IMURecord.cloud_path`` as ``zip://<archive>#<recording id>``.
+
+``prune_raw_logs`` deletes the text logs of recordings that were ingested
+more than ``RAW_LOG_DAYS`` ago: the columnar archive holds every sample at
+logged precision plus the tracker events, so analysis can be rerun from it.
+Logs that failed to parse keep their text. Unpacked column caches are pruned
+by ``imu_format.prune_column_cache``.
+
+``sweep_incoming`` deletes partial uploads (``_incoming/<upload id>.part``)
+whose upload session expired or was completed; the sessions themselves are
+removed by a TTL index on ``imu_uploads.expires_at``.
+
+Order of operations is crash-safe: the archive is written and verified first,
+then the database is updated, and only then are the local files removed. A
+rerun skips members that are already in the archive.
+"""
+import logging
+import os
+import shutil
+import time
+import zipfile
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from backend.services.imu_format import drop_column_cache, prune_column_cache, recording_path_for
+except ImportError:
+    try:
+        from services.imu_format import drop_column_cache, prune_column_cache, recording_path_for
+    except ImportError:
+        from .imu_format import drop_column_cache, prune_column_cache, recording_path_for
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = Path(os.getenv("IMU_ARCHIVE_DIR", "/app/archive/imu_logs"))
+# Partial uploads, as in routers/imu.py
+INCOMING_DIR = Path("/app/uploads/imu_logs/_incoming")
+RETENTION_DAYS = int(os.getenv("IMU_RETENTION_DAYS", "90"))
+# Text logs are kept this long after upload, then only the archive remains
+RAW_LOG_DAYS = int(os.getenv("IMU_RAW_LOG_DAYS", "7"))
+# A rehydrated recording is not archived again right away
+REHYDRATED_GRACE = timedelta(days=7)
+# A partial upload touched this recently is left alone (the session may be
+# about to be inserted, or a complete request may still be hashing it)
+INCOMING_GRACE = timedelta(hours=1)
+SWEEP_BATCH = 500
+CLOUD_PATH_SCHEME = "zip://"
+
+
+def recording_id(log: dict) -> str:
+    """Recordings are shared by every log with the same content"""
+    return log.get("sha256") or log["_id"]
+
+
+def archive_path_for(owner_id: str, uploaded_at: datetime) -> Path:
+    return ARCHIVE_DIR / owner_id / f"{uploaded_at:%Y-%m}.zip"
+
+
+def cloud_path_for(archive: Path, rec_id: str) -> str:
+    return f"{CLOUD_PATH_SCHEME}{archive}#{rec_id}"
+
+
+def parse_cloud_path(cloud_path: str) -> Tuple[Path, str]:
+    if not cloud_path.startswith(CLOUD_PATH_SCHEME) or "#" not in cloud_path:
+        raise ValueError(f"Unsupported cloud_path: {cloud_path}")
+    archive, rec_id = cloud_path[len(CLOUD_PATH_SCHEME):].rsplit("#", 1)
+    return Path(archive), rec_id
+
+
+def _members(rec_id: str, raw_path: Path) -> List[Tuple[Path, str, int]]:
+    """(local file, member name, compression) of one recording"""
+    return [
+        # Text compresses well; the .npz is already deflated
+        (raw_path, f"{rec_id}.txt", zipfile.ZIP_LZMA),
+        (recording_path_for(raw_path), f"{rec_id}.imu.npz", zipfile.ZIP_STORED),
+    ]
+
+
+def archive_recordings(archive: Path, recordings: Dict[str, str]) -> List[str]:
+    """
+    Appends recordings {rec_id: raw_path} to a zip archive.
+    Returns the ids that are now safely in the archive.
+    """
+    archive.parent.mkdir(parents=True, exist_ok=True)
+    # Members that exist locally (the text log may already be pruned)
+    expected: Dict[str, List[str]] = {}
+    with zipfile.ZipFile(archive, "a") as zf:
+        present = set(zf.namelist())
+        for rec_id, raw_path in recordings.items():
+            expected[rec_id] = []
+            for local, member, compression in _members(rec_id, Path(raw_path)):
+                if local.exists():
+                    expected[rec_id].append(member)
+                    if member not in present:
+                        zf.write(local, member, compress_type=compression)
+
+    with open(archive, "rb") as f:
+        os.fsync(f.fileno())
+    with zipfile.ZipFile(archive) as zf:
+        bad = zf.testzip()
+        if bad is not None:
+            raise OSError(f"Archive {archive} is corrupt (member {bad})")
+        present = set(zf.namelist())
+    # Every local file of the recording must be in the archive before it is removed
+    return [
+        rec_id for rec_id, members in expected.items()
+        if members and all(member in present for member in members)
+    ]
+
+
+def remove_local(raw_path: str) -> int:
+    """Deletes the hot copies of a recording. Returns bytes freed."""
+    raw = Path(raw_path)
+    freed = 0
+    drop_column_cache(recording_path_for(raw))
+    for path in (raw, recording_path_for(raw)):
+        if path.exists():
+            freed += path.stat().st_size
+            path.unlink()
+    return freed
+
+
+def restore_recording(cloud_path: str, raw_path: str) -> None:
+    """Extracts a recording from its archive back to its hot location"""
+    archive, rec_id = parse_cloud_path(cloud_path)
+    raw = Path(raw_path)
+    raw.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(archive) as zf:
+        present = set(zf.namelist())
+        for local, member, _ in _members(rec_id, raw):
+            if member not in present:
+                continue
+            tmp = local.with_name(local.name + ".restore")
+            with zf.open(member) as src, open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(tmp, local)
+
+
+def _remove_raw(raw_path: str) -> int:
+    """Deletes a text log whose columnar archive exists. Returns bytes freed."""
+    raw = Path(raw_path)
+    if not raw.exists() or not recording_path_for(raw).exists():
+        return 0
+    size = raw.stat().st_size
+    raw.unlink()
+    return size
+
+
+async def prune_raw_logs(
+    db,
+    older_than_days: int = RAW_LOG_DAYS,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """Удаляет текстовые логи, загруженные раньше older_than_days и уже сохранённые в колоночном формате"""
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=older_than_days)
+    stats = {"logs": 0, "bytes_freed": 0}
+    seen = set()
+    cursor = db.imu_logs.find(
+        {
+            "uploaded_at": {"$lt": cutoff},
+            "status": "ready",
+            "storage_tier": {"$nin": ["archived", "rehydrating"]},
+            "raw_pruned_at": None,
+        },
+        {"sha256": 1, "path": 1},
+    )
+    async for log in cursor:
+        rec_id = recording_id(log)
+        if rec_id in seen:
+            continue
+        seen.add(rec_id)
+        stats["logs"] += 1
+        if dry_run:
+            continue
+        stats["bytes_freed"] += await run_in_threadpool(_remove_raw, log["path"])
+        same_content = {"sha256": log["sha256"]} if log.get("sha256") else {"_id": log["_id"]}
+        await db.imu_logs.update_many(same_content, {"$set": {"raw_pruned_at": now}})
+
+    if not dry_run:
+        stats["bytes_freed"] += await run_in_threadpool(prune_column_cache)
+    return stats
+
+
+def _stale_parts(incoming_dir: Path, cutoff: float) -> Dict[str, Tuple[Path, int]]:
+    """upload id → (partial file, size) for files not modified since cutoff"""
+    parts = {}
+    for path in incoming_dir.glob("*.part"):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        if st.st_mtime < cutoff:
+            parts[path.stem] = (path, st.st_size)
+    return parts
+
+
+def _unlink_quiet(path: Path) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+async def sweep_incoming(
+    db,
+    incoming_dir: Path = INCOMING_DIR,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """Удаляет недогруженные файлы, чья сессия загрузки истекла, завершена или удалена"""
+    stats = {"parts": 0, "bytes_freed": 0}
+    if not incoming_dir.is_dir():
+        return stats
+    now = datetime.now(timezone.utc)
+    parts = await run_in_threadpool(_stale_parts, incoming_dir, time.time() - INCOMING_GRACE.total_seconds())
+
+    upload_ids = list(parts)
+    for start in range(0, len(upload_ids), SWEEP_BATCH):
+        batch = upload_ids[start:start + SWEEP_BATCH]
+        live = {
+            doc["_id"]
+            async for doc in db.imu_uploads.find(
+                {
+                    "_id": {"$in": batch},
+                    "$or": [
+                        {"status": "open", "expires_at": {"$gt": now}},
+                        {"updated_at": {"$gt": now - INCOMING_GRACE}},
+                    ],
+                },
+                {"_id": 1},
+            )
+        }
+        for upload_id in batch:
+            if upload_id in live:
+                continue
+            path, size = parts[upload_id]
+            stats["parts"] += 1
+            if dry_run:
+                continue
+            await run_in_threadpool(_unlink_quiet, path)
+            stats["bytes_freed"] += size
+    return stats
+
+
+async def compact(
+    db,
+    older_than_days: int = RETENTION_DAYS,
+    dry_run: bool = False,
+    limit: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Переносит записи старше older_than_days в архивы (пользователь × месяц)"""
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=older_than_days)
+    recently_used = {"$or": [
+        {"uploaded_at": {"$gte": cutoff}},
+        {"rehydrated_at": {"$gte": now - REHYDRATED_GRACE}},
+    ]}
+
+    # archive → {rec_id: raw_path}
+    plan: Dict[Path, Dict[str, str]] = defaultdict(dict)
+    seen = set()
+    cursor = db.imu_logs.find(
+        {
+            "uploaded_at": {"$lt": cutoff},
+            "storage_tier": {"$nin": ["archived", "rehydrating"]},
+            "status": {"$in": ["ready", "failed"]},
+            "$or": [{"rehydrated_at": None}, {"rehydrated_at": {"$lt": now - REHYDRATED_GRACE}}],
+        },
+        {"owner_id": 1, "sha256": 1, "path": 1, "uploaded_at": 1},
+    ).sort("uploaded_at", 1)
+    async for log in cursor:
+        rec_id = recording_id(log)
+        if rec_id in seen:
+            continue
+        seen.add(rec_id)
+        # Content shared with a recent upload stays hot
+        if log.get("sha256") and await db.imu_logs.count_documents({"sha256": rec_id, **recently_used}, limit=1):
+            continue
+        plan[archive_path_for(log["owner_id"], log["uploaded_at"])][rec_id] = log["path"]
+        if limit and len(seen) >= limit:
+            break
+
+    stats = {"archives": len(plan), "recordings": sum(len(r) for r in plan.values()), "bytes_freed": 0}
+    if dry_run:
+        return stats
+
+    archived_count = 0
+    for archive, recordings in plan.items():
+        try:
+            archived = await run_in_threadpool(archive_recordings, archive, recordings)
+        except OSError as e:
+            logger.error(f"Failed to write IMU archive {archive}: {str(e)}")
+            continue
+
+        for rec_id in archived:
+            same_content = {"$or": [{"sha256": rec_id}, {"_id": rec_id}]}
+            cloud_path = cloud_path_for(archive, rec_id)
+            await db.imu_logs.update_many(
+                same_content,
+                {"$set": {
+                    "storage_tier": "archived",
+                    "archive_path": str(archive),
+                    "record.cloud_path": cloud_path,
+                    "archived_at": now,
+                }},
+            )
+            await db.imu_blobs.update_one({"_id": rec_id}, {"$set": {"cloud_path": cloud_path}})
+            stats["bytes_freed"] += await run_in_threadpool(remove_local, recordings[rec_id])
+            archived_count += 1
+
+    stats["recordings"] = archived_count
+    return stats
@@ -0,0 +1,46 @@
+"""
+Array primitives shared by the IMU analysis stages: centered moving averages
+and reductions over many [start, end) segments of one array at once.
+"""
+import numpy as np
+
+
+def moving_average(x: np.ndarray, window: int) -> np.ndarray:
+    """Centered moving average along axis 0 using a cumulative sum."""
+    window = max(int(window), 1)
+    if window == 1 or x.shape[0] < window:
+        return x.copy()
+    pad_left = window // 2
+    pad_right = window - 1 - pad_left
+    padded = np.concatenate(
+        [np.repeat(x[:1], pad_left, axis=0), x, np.repeat(x[-1:], pad_right, axis=0)]
+    )
+    csum = np.cumsum(padded, axis=0, dtype=np.float64)
+    csum = np.concatenate([np.zeros((1,) + x.shape[1:]), csum])
+    return (csum[window:] - csum[:-window]) / window
+
+
+def segment_reduce(ufunc: np.ufunc, x: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    ufunc reduced over x[starts[i]:ends[i]] for every i.
+    Segments must be non-empty, sorted and non-overlapping.
+    """
+    if starts.size == 0:
+        return np.empty(0, dtype=x.dtype)
+    bounds = np.empty(starts.size * 2, dtype=np.intp)
+    bounds[0::2] = starts
+    bounds[1::2] = ends
+    # reduceat can't take len(x) as an index — pad with one sentinel element
+    padded = np.append(x, x[-1:])
+    return ufunc.reduceat(padded, bounds)[0::2]
+
+
+def segment_ids(n: int, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Per-sample segment index (-1 outside every segment)."""
+    marks = np.zeros(n + 1, dtype=np.intp)
+    np.add.at(marks, starts, 1)
+    np.add.at(marks, ends, -1)
+    inside = np.cumsum(marks[:-1]) > 0
+    first = np.zeros(n, dtype=np.intp)
+    first[starts] = 1
+    return np.where(inside, np.cumsum(first) - 1, -1)
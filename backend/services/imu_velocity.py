@@ -0,0 +1,130 @@
+"""
+Velocity-based training (VBT) metrics from IMU recordings.
+
+For every rep the vertical acceleration is integrated into velocity, all reps
+at once:
+
+1. Over a whole rep the bar starts and ends at rest, so the mean measured
+   acceleration of the rep is gravity: its direction is "up" and the linear
+   acceleration is projected onto it (m/s², positive = upwards). Per-rep
+   means are segment reductions, so there is no moving-average leakage of
+   the movement itself into the gravity estimate.
+2. Each rep is integrated independently with one cumulative sum over the whole
+   recording: the running sum at the rep start is subtracted per sample
+   (broadcast through the per-sample rep id).
+3. Drift correction (zero-velocity update): the bar is at rest at both rep
+   boundaries, so whatever velocity is left at the end of a rep is integration
+   drift; it is removed as a linear ramp over the rep.
+4. The concentric phase is where the corrected velocity is upwards; mean and
+   peak concentric velocity are segment reductions over it.
+
+Velocity loss of a set is the drop from the fastest rep to the last one, in
+percent of the fastest — the usual VBT fatigue measure.
+"""
+import sys
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+current_dir = Path(__file__).parent
+parent_dir = current_dir.parent.parent
+if str(parent_dir) not in sys.path:
+    sys.path.insert(0, str(parent_dir))
+
+try:
+    from backend.services.imu_signal import segment_ids, segment_reduce
+except ImportError:
+    try:
+        from services.imu_signal import segment_ids, segment_reduce
+    except ImportError:
+        from .imu_signal import segment_ids, segment_reduce
+
+STANDARD_GRAVITY = 9.80665
+
+
+def acceleration_scale(acc: np.ndarray) -> float:
+    """Factor to m/s²: trackers log either in g (|a| ≈ 1 at rest) or in m/s²."""
+    if acc.shape[0] == 0:
+        return 1.0
+    resting = float(np.median(np.linalg.norm(acc, axis=1)))
+    return STANDARD_GRAVITY if resting < 3.0 else 1.0
+
+
+def vertical_acceleration(acc: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Linear acceleration along gravity within every rep, m/s² (0 outside reps)."""
+    n = acc.shape[0]
+    if starts.size == 0:
+        return np.zeros(n)
+    acc = acc * acceleration_scale(acc)
+    length = (ends - starts).astype(np.float64)[:, None]
+    gravity = np.column_stack([segment_reduce(np.add, acc[:, k], starts, ends) for k in range(3)]) / length
+    norm = np.linalg.norm(gravity, axis=1, keepdims=True)
+    up = np.divide(gravity, norm, out=np.zeros_like(gravity), where=norm > 0)
+
+    ids = segment_ids(n, starts, ends)
+    rep = np.clip(ids, 0, None)
+    a_up = np.einsum("ij,ij->i", acc - gravity[rep], up[rep])
+    return np.where(ids >= 0, a_up, 0.0)
+
+
+def rep_velocities(
+    a_up: np.ndarray,
+    fs: float,
+    starts: np.ndarray,
+    ends: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """
+    Mean / peak concentric velocity (m/s) and concentric duration (s) per rep.
+    Rep segments must be sorted and non-overlapping.
+    """
+    count = starts.size
+    if count == 0:
+        empty = np.empty(0)
+        return {"mean_velocity": empty, "peak_velocity": empty, "concentric_s": empty}
+
+    n = a_up.shape[0]
+    ids = segment_ids(n, starts, ends)
+    inside = ids >= 0
+    rep = np.clip(ids, 0, None)
+
+    # One cumulative sum for all reps; subtract each rep's running sum at its start
+    running = np.cumsum(np.where(inside, a_up, 0.0)) / fs
+    before_start = running[starts] - a_up[starts] / fs
+    velocity = running - before_start[rep]
+
+    # Zero-velocity update at both boundaries → remove residual as a linear ramp
+    length = (ends - starts).astype(np.float64)
+    residual = velocity[ends - 1]
+    progress = (np.arange(n) - starts[rep]) / np.maximum(length[rep] - 1, 1)
+    velocity = np.where(inside, velocity - residual[rep] * progress, 0.0)
+
+    concentric = inside & (velocity > 0)
+    concentric_samples = segment_reduce(np.add, concentric.astype(np.float64), starts, ends)
+    concentric_sum = segment_reduce(np.add, np.where(concentric, velocity, 0.0), starts, ends)
+    mean_velocity = np.divide(
+        concentric_sum, concentric_samples,
+        out=np.zeros(count), where=concentric_samples > 0,
+    )
+    peak_velocity = np.maximum(segment_reduce(np.maximum, velocity, starts, ends), 0.0)
+
+    return {
+        "mean_velocity": mean_velocity,
+        "peak_velocity": peak_velocity,
+        "concentric_s": concentric_samples / fs,
+    }
+
+
+def velocity_loss(mean_velocity: np.ndarray, set_idx: np.ndarray, set_count: int) -> np.ndarray:
+    """Per set: (fastest rep − last rep) / fastest rep × 100."""
+    if set_count == 0:
+        return np.empty(0)
+    best = np.full(set_count, -np.inf)
+    np.maximum.at(best, set_idx, mean_velocity)
+    last_rep = np.full(set_count, -1, dtype=np.intp)
+    np.maximum.at(last_rep, set_idx, np.arange(set_idx.size))
+    last = mean_velocity[last_rep]
+    return np.divide(
+        (best - last) * 100.0, best,
+        out=np.zeros(set_count), where=best > 0,
+    )
@@ -0,0 +1,115 @@
+"""
+Keyset (cursor) pagination.
+
+``.skip(n)`` makes MongoDB walk and discard n index entries, so a page costs
+more the deeper it is. Here a page is continued from where the previous one
+ended instead: the response carries an opaque cursor holding the sort value
+and ``_id`` of its last document, and the next query asks for documents
+strictly after that pair. With an index on the sort field every page costs
+the same as the first.
+
+The order is always ``(sort_field, _id)`` in one direction, so documents
+with equal sort values (e.g. the same ``updated_at``) are neither repeated
+nor skipped. The cursor is base64url-encoded JSON; it records the sort field
+and direction and is rejected (400) when used with a different order.
+
+Only fields that are never null can be paged on: ``{field: {"$gt": None}}``
+matches nothing, so a null on the last document of a page would silently end
+the listing. Endpoints pass client-chosen ``sort_by`` through ``allowed_sort_field``
+with their own whitelist of such fields (each backed by an index).
+
+    sort = keyset_sort("updated_at", -1)
+    query = keyset_filter(filters, "updated_at", -1, cursor)
+    docs = await coll.find(query).sort(sort).limit(page_size + 1).to_list(length=page_size + 1)
+    docs, next_cursor = keyset_page(docs, page_size, "updated_at", -1)
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException, status
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if "$date" in value:
+            return datetime.fromisoformat(value["$date"])
+        if "$oid" in value:
+            return ObjectId(value["$oid"])
+        raise ValueError("unknown cursor value")
+    return value
+
+
+def encode_cursor(sort_field: str, direction: int, sort_value: Any, last_id: Any) -> str:
+    payload = {"f": sort_field, "d": direction, "v": _encode_value(sort_value), "i": _encode_value(last_id)}
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_field: str, direction: int) -> Tuple[Any, Any]:
+    """(sort value, _id) of the last document of the previous page"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if payload["f"] != sort_field or payload["d"] != direction:
+            raise ValueError("cursor was issued for another order")
+        return _decode_value(payload["v"]), _decode_value(payload["i"])
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def allowed_sort_field(requested: Optional[str], allowed: Sequence[str], default: str) -> str:
+    """requested sort field, if the endpoint can page on it (400 otherwise)"""
+    if requested is None:
+        return default
+    if requested not in allowed:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"sort_by must be one of: {', '.join(allowed)}"
+        )
+    return requested
+
+
+def keyset_sort(sort_field: str, direction: int) -> List[Tuple[str, int]]:
+    return [(sort_field, direction), ("_id", direction)]
+
+
+def keyset_filter(filters: Dict[str, Any], sort_field: str, direction: int, cursor: Optional[str]) -> Dict[str, Any]:
+    """filters, narrowed to the documents after the cursor (unchanged without one)"""
+    if not cursor:
+        return filters
+    sort_value, last_id = decode_cursor(cursor, sort_field, direction)
+    op = "$lt" if direction < 0 else "$gt"
+    after = {"$or": [
+        {sort_field: {op: sort_value}},
+        {sort_field: sort_value, "_id": {op: last_id}},
+    ]}
+    # filters may have an $or of its own (text search)
+    return {"$and": [filters, after]} if filters else after
+
+
+def keyset_page(docs: List[Dict[str, Any]], page_size: int, sort_field: str, direction: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    docs must have been fetched with limit(page_size + 1): the extra document
+    only tells whether there is a next page. Returns the page and the cursor
+    for the next one (None on the last page).
+    """
+    if len(docs) <= page_size:
+        return docs, None
+    docs = docs[:page_size]
+    last = docs[-1]
+    return docs, encode_cursor(sort_field, direction, last.get(sort_field), last["_id"])
@@ -0,0 +1,96 @@
+"""
+Bounded pool for password hashing and verification.
+
+bcrypt costs ~100-300 ms of CPU per call; run inline it blocks the event loop
+and every other in-flight request with it. Calls here run in a small thread
+pool (bcrypt releases the GIL), and at most PASSWORD_HASH_WORKERS +
+PASSWORD_HASH_MAX_QUEUE calls may be in flight. Beyond that PasswordPoolBusy
+is raised right away — the server answers 503 with Retry-After instead of
+queueing a login storm without bound.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from passlib.context import CryptContext
+
+WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+RETRY_AFTER_S = 1
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class PasswordPoolBusy(Exception):
+    """Too many password operations are already queued"""
+
+
+class PasswordPool:
+    def __init__(self, workers: int = WORKERS, max_queue: int = MAX_QUEUE):
+        self.workers = max(workers, 1)
+        self.max_queue = max(max_queue, 0)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self._wait_s = 0.0
+        self._run_s = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise PasswordPoolBusy()
+
+        submitted = time.monotonic()
+
+        def timed():
+            started = time.monotonic()
+            return fn(*args), started
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            loop = asyncio.get_running_loop()
+            result, started = await loop.run_in_executor(self._get_executor(), timed)
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        self._wait_s += started - submitted
+        self._run_s += time.monotonic() - started
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(pwd_context.verify, plain_password, hashed_password)
+
+    def stats(self) -> Dict[str, Any]:
+        done = max(self.completed, 1)
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": max(self.in_flight - self.workers, 0),
+            "peak_in_flight": self.peak_in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self._wait_s / done * 1000, 1),
+            "avg_run_ms": round(self._run_s / done * 1000, 1),
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+pool = PasswordPool()
@@ -0,0 +1,102 @@
+"""
+Points ledger: every IP / EP award is an event in ``points_ledger`` and the
+running totals live on the user document.
+
+Awards are exactly-once per idempotency key (by default the workout log the
+points are for), so a phone retrying after a timeout does not award twice:
+
+1. The event is inserted with ``_id = "{user_id}:{key}"`` and
+   ``applied: False``; a duplicate key means the award was seen before, and
+   an event already applied is answered with the current totals.
+2. The totals are incremented with one find_one_and_update that returns the
+   new document. Its filter skips users whose ``points_keys`` (the last
+   POINTS_KEYS_KEPT keys) already contain the key, so concurrent retries of
+   an event that is not applied yet increment once.
+3. The event is marked applied. A crash before this step is recovered by the
+   next retry: step 2 is guarded, step 3 is re-run.
+
+MongoDB here runs without a replica set, so there is no multi-document
+transaction; the guard on the user document is what makes step 2 atomic.
+"""
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+COLLECTION = "points_ledger"
+# Recent award keys kept on the user document for the atomic guard
+POINTS_KEYS_KEPT = 100
+
+
+class UserNotFound(Exception):
+    pass
+
+
+def _totals(user: Dict[str, Any]) -> Dict[str, int]:
+    return {
+        "iron_points": user.get("iron_points", 0),
+        "endurance_points": user.get("endurance_points", 0),
+    }
+
+
+async def award(
+    db,
+    user_id: str,
+    iron_points: int,
+    endurance_points: int,
+    workout_log_id: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Records an award and returns the new totals plus ``duplicate``"""
+    key = idempotency_key or (f"workout_log:{workout_log_id}" if workout_log_id else str(uuid.uuid4()))
+    event_id = f"{user_id}:{key}"
+
+    duplicate = False
+    try:
+        await db[COLLECTION].insert_one({
+            "_id": event_id,
+            "user_id": user_id,
+            "idempotency_key": key,
+            "workout_log_id": workout_log_id,
+            "iron_points": iron_points,
+            "endurance_points": endurance_points,
+            "applied": False,
+            "created_at": datetime.now(timezone.utc),
+        })
+    except DuplicateKeyError:
+        duplicate = True
+        # The first request's amounts are the ones that count
+        event = await db[COLLECTION].find_one({"_id": event_id})
+        # Events written before the flag existed were applied right away
+        if event.get("applied", True):
+            return await _current(db, user_id)
+        iron_points, endurance_points = event["iron_points"], event["endurance_points"]
+
+    update: Dict[str, Any] = {"$push": {"points_keys": {"$each": [key], "$slice": -POINTS_KEYS_KEPT}}}
+    inc = {name: value for name, value in (("iron_points", iron_points), ("endurance_points", endurance_points)) if value}
+    if inc:
+        update["$inc"] = inc
+
+    user = await db.users.find_one_and_update(
+        {"_id": user_id, "points_keys": {"$ne": key}},
+        update,
+        projection={"iron_points": 1, "endurance_points": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if user is not None:
+        await db[COLLECTION].update_one({"_id": event_id}, {"$set": {"applied": True}})
+        return {**_totals(user), "duplicate": duplicate}
+
+    # Already applied by a concurrent retry, or the user is gone
+    result = await _current(db, user_id)
+    await db[COLLECTION].update_one({"_id": event_id}, {"$set": {"applied": True}})
+    return result
+
+
+async def _current(db, user_id: str) -> Dict[str, Any]:
+    user = await db.users.find_one({"_id": user_id}, {"iron_points": 1, "endurance_points": 1})
+    if user is None:
+        raise UserNotFound(user_id)
+    return {**_totals(user), "duplicate": True}
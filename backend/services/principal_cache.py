@@ -0,0 +1,127 @@
+"""
+Cache of authenticated principals (the dict returned by get_current_user),
+keyed by user id, so the hot path of a request needs no users lookup.
+
+Backends (PRINCIPAL_CACHE_BACKEND):
+  memory — bounded in-process LRU with TTL (default)
+  redis  — shared between workers; falls back to memory without Redis
+  off    — always read from MongoDB
+
+Entries are invalidated on profile update, avatar change and account
+deletion. With several workers and the memory backend, another worker may
+serve a stale entry for up to PRINCIPAL_CACHE_TTL_S seconds.
+
+With session claims in the access token (SESSION_CLAIMS_IN_TOKEN), a profile
+change instead stores the fresh principal for the lifetime of an access
+token, so it wins over the now stale claims of tokens issued before it. That
+only holds when every worker sees the entry, so claims need the redis
+backend (``is_shared``).
+"""
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+try:
+    from backend.services.redis_client import get_redis
+except ImportError:
+    try:
+        from services.redis_client import get_redis
+    except ImportError:
+        from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+BACKEND = os.getenv("PRINCIPAL_CACHE_BACKEND", "memory").strip().lower()
+TTL_S = float(os.getenv("PRINCIPAL_CACHE_TTL_S", "60"))
+MAX_ITEMS = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+REDIS_PREFIX = "principal:"
+
+
+class MemoryPrincipalCache:
+    """In-process LRU; entries expire TTL seconds after they were stored."""
+
+    def __init__(self, max_items: int = MAX_ITEMS, ttl_s: float = TTL_S):
+        self.max_items = max_items
+        self.ttl_s = ttl_s
+        # user_id → (expires_at, principal)
+        self._items: Dict[str, tuple] = {}
+
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._items.pop(user_id, None)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            return None
+        # Re-insert to mark as most recently used (dicts keep insertion order)
+        self._items[user_id] = entry
+        return entry[1]
+
+    async def set(self, user_id: str, principal: Dict[str, Any], ttl_s: Optional[float] = None) -> None:
+        self._items.pop(user_id, None)
+        self._items[user_id] = (time.monotonic() + (ttl_s or self.ttl_s), principal)
+        while len(self._items) > self.max_items:
+            self._items.pop(next(iter(self._items)))
+
+    async def invalidate(self, user_id: str) -> None:
+        self._items.pop(user_id, None)
+
+
+class RedisPrincipalCache:
+    """Shared cache in Redis. Redis errors count as a miss, never as a failure."""
+
+    def __init__(self, client, ttl_s: float = TTL_S):
+        self.client = client
+        self.ttl_s = ttl_s
+
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            value = await self.client.get(REDIS_PREFIX + user_id)
+        except Exception as e:
+            logger.warning(f"Principal cache read failed: {str(e)}")
+            return None
+        return json.loads(value) if value else None
+
+    async def set(self, user_id: str, principal: Dict[str, Any], ttl_s: Optional[float] = None) -> None:
+        try:
+            await self.client.set(REDIS_PREFIX + user_id, json.dumps(principal), ex=max(int(ttl_s or self.ttl_s), 1))
+        except Exception as e:
+            logger.warning(f"Principal cache write failed: {str(e)}")
+
+    async def invalidate(self, user_id: str) -> None:
+        try:
+            await self.client.delete(REDIS_PREFIX + user_id)
+        except Exception as e:
+            # A stale entry would outlive the change — make it visible
+            logger.error(f"Principal cache invalidation failed for {user_id}: {str(e)}")
+
+
+class NullPrincipalCache:
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    async def set(self, user_id: str, principal: Dict[str, Any], ttl_s: Optional[float] = None) -> None:
+        pass
+
+    async def invalidate(self, user_id: str) -> None:
+        pass
+
+
+def _build():
+    if BACKEND == "off":
+        return NullPrincipalCache()
+    if BACKEND == "redis":
+        client = get_redis()
+        if client is not None:
+            return RedisPrincipalCache(client)
+        logger.warning("PRINCIPAL_CACHE_BACKEND=redis but Redis is not configured; using the memory cache")
+    return MemoryPrincipalCache()
+
+
+cache = _build()
+
+
+def is_shared() -> bool:
+    """True when an entry written by one worker is seen by all of them"""
+    return isinstance(cache, RedisPrincipalCache)
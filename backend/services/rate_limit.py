@@ -0,0 +1,187 @@
+"""
+Rate limiting for expensive unauthenticated endpoints (login, registration,
+waitlist).
+
+Sliding-window counters: the count of the current fixed window plus the
+previous window's count weighted by how much of it still overlaps the
+sliding window. Two integers per key, so the same algorithm works in process
+memory and in Redis (INCR + EXPIRE).
+
+Limits are named rules, "count/seconds", overridable per rule with
+RATE_LIMIT_<RULE> (e.g. RATE_LIMIT_AUTH_LOGIN_IP=50/60). Each rule is keyed by
+a key function: client IP, or a field of the JSON body such as the email, so
+one account is protected even from a spread of addresses.
+
+Usage as a route dependency (runs before the endpoint touches the database
+or the password pool):
+
+    @router.post("/login", dependencies=[Depends(rate_limit("auth_login_ip", by_ip))])
+
+RATE_LIMIT_BACKEND: memory (default) | redis | off.
+"""
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+try:
+    from backend.services.redis_client import get_redis
+except ImportError:
+    try:
+        from services.redis_client import get_redis
+    except ImportError:
+        from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").strip().lower()
+# The backend port is only reachable through nginx, which sets X-Real-IP
+TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "true").strip().lower() in ("1", "true", "yes")
+REDIS_PREFIX = "ratelimit:"
+# Bound for the in-process table; expired keys are swept when it is exceeded
+MAX_MEMORY_KEYS = 100_000
+
+# rule → (requests, window seconds)
+DEFAULT_LIMITS: Dict[str, Tuple[int, int]] = {
+    "auth_login_ip": (20, 60),
+    "auth_login_account": (10, 300),
+    "auth_register_ip": (5, 60),
+    "admin_login_ip": (10, 60),
+    "admin_login_account": (5, 300),
+    "waitlist_ip": (5, 60),
+}
+
+
+def _parse_limit(value: str) -> Tuple[int, int]:
+    count, seconds = value.split("/", 1)
+    return int(count), int(seconds)
+
+
+def limit_for(rule: str) -> Tuple[int, int]:
+    override = os.getenv(f"RATE_LIMIT_{rule.upper()}", "").strip()
+    if override:
+        try:
+            return _parse_limit(override)
+        except ValueError:
+            logger.error(f"Invalid RATE_LIMIT_{rule.upper()}={override!r}, expected count/seconds")
+    return DEFAULT_LIMITS[rule]
+
+
+class MemoryRateLimiter:
+    """Per-process counters: (rule, key) → (window index, current count, previous count)."""
+
+    def __init__(self, max_keys: int = MAX_MEMORY_KEYS):
+        self.max_keys = max_keys
+        self._windows: Dict[Tuple[str, str], Tuple[int, int, int]] = {}
+
+    async def hit(self, rule: str, key: str, window_s: int, now: float) -> Tuple[int, int]:
+        """Counts a request. Returns (current window count, previous window count)."""
+        index = int(now // window_s)
+        entry = self._windows.get((rule, key))
+        if entry is None or entry[0] < index - 1:
+            current, previous = 0, 0
+        elif entry[0] == index - 1:
+            current, previous = 0, entry[1]
+        else:
+            current, previous = entry[1], entry[2]
+        current += 1
+        self._windows[(rule, key)] = (index, current, previous)
+        if len(self._windows) > self.max_keys:
+            self._sweep(now)
+        return current, previous
+
+    def _sweep(self, now: float) -> None:
+        for (rule, key), (index, _, _) in list(self._windows.items()):
+            window_s = limit_for(rule)[1]
+            if index < int(now // window_s) - 1:
+                del self._windows[(rule, key)]
+        # Still too many live keys (a flood of distinct keys): drop the oldest
+        while len(self._windows) > self.max_keys:
+            self._windows.pop(next(iter(self._windows)))
+
+
+class RedisRateLimiter:
+    """Counters shared by all workers; Redis errors let the request through."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def hit(self, rule: str, key: str, window_s: int, now: float) -> Tuple[int, int]:
+        index = int(now // window_s)
+        base = f"{REDIS_PREFIX}{rule}:{key}:"
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.incr(base + str(index))
+                pipe.expire(base + str(index), 2 * window_s)
+                pipe.get(base + str(index - 1))
+                current, _, previous = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Rate limiter unavailable: {str(e)}")
+            return 0, 0
+        return int(current), int(previous or 0)
+
+
+class NullRateLimiter:
+    async def hit(self, rule: str, key: str, window_s: int, now: float) -> Tuple[int, int]:
+        return 0, 0
+
+
+def _build():
+    if BACKEND == "off":
+        return NullRateLimiter()
+    if BACKEND == "redis":
+        client = get_redis()
+        if client is not None:
+            return RedisRateLimiter(client)
+        logger.warning("RATE_LIMIT_BACKEND=redis but Redis is not configured; using in-process counters")
+    return MemoryRateLimiter()
+
+
+limiter = _build()
+
+
+# ─── Key functions ────────────────────────────────────────────────────────────
+
+KeyFunc = Callable[[Request], Awaitable[Optional[str]]]
+
+
+async def by_ip(request: Request) -> Optional[str]:
+    if TRUST_PROXY:
+        real_ip = request.headers.get("x-real-ip")
+        if real_ip:
+            return real_ip.strip()
+    return request.client.host if request.client else None
+
+
+def by_body_field(field: str) -> KeyFunc:
+    """Key from a JSON body field (e.g. email / username), case-insensitive"""
+    async def key(request: Request) -> Optional[str]:
+        try:
+            body = await request.json()
+        except ValueError:
+            return None
+        value = body.get(field) if isinstance(body, dict) else None
+        return value.strip().lower() if isinstance(value, str) and value.strip() else None
+    return key
+
+
+def rate_limit(rule: str, key_func: KeyFunc):
+    """FastAPI dependency: 429 with Retry-After once the rule's limit is exceeded"""
+    async def check(request: Request) -> None:
+        key = await key_func(request)
+        if key is None:
+            return
+        count, window_s = limit_for(rule)
+        now = time.time()
+        current, previous = await limiter.hit(rule, key, window_s, now)
+        overlap = 1.0 - (now % window_s) / window_s
+        if current + previous * overlap > count:
+            logger.info(f"Rate limit {rule} exceeded")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please try again later",
+                headers={"Retry-After": str(int(window_s - now % window_s) + 1)},
+            )
+    return check
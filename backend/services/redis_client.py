@@ -0,0 +1,59 @@
+"""
+Shared Redis connection for caches and counters.
+
+Redis is optional: it is used when REDIS_URL (or REDIS_HOST, as set in
+docker-compose.yml) is configured and the ``redis`` package is installed.
+Otherwise ``get_redis()`` returns None and callers fall back to their
+in-process backends.
+"""
+import logging
+import os
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_unavailable = False
+
+
+def redis_url() -> Optional[str]:
+    url = os.getenv("REDIS_URL", "").strip()
+    if url:
+        return url
+    host = os.getenv("REDIS_HOST", "").strip()
+    if host:
+        return f"redis://{host}:{os.getenv('REDIS_PORT', '6379')}/0"
+    return None
+
+
+def get_redis():
+    """Lazily created redis.asyncio client, or None if Redis is not available"""
+    global _client, _unavailable
+    if _client is not None or _unavailable:
+        return _client
+
+    url = redis_url()
+    if not url:
+        _unavailable = True
+        return None
+    try:
+        import redis.asyncio as redis_asyncio
+    except ImportError:
+        logger.warning("REDIS_URL is set but the redis package is not installed; using in-process backends")
+        _unavailable = True
+        return None
+
+    _client = redis_asyncio.from_url(
+        url,
+        decode_responses=True,
+        socket_connect_timeout=1.0,
+        socket_timeout=1.0,
+    )
+    return _client
+
+
+async def close_redis() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,177 @@
+"""
+Refresh-token families with rotation and reuse detection.
+
+Every login starts a family (one document in ``refresh_token_families``) and
+every refresh token carries its family id (``fam``) and its own id (``jti``).
+A refresh swaps the family's ``current_jti`` atomically and issues a new
+token; the old one stops working. Presenting an already rotated token means
+it was copied — the whole family is revoked, and the legitimate client has
+to log in again as well.
+
+Revoked families are also kept in a revocation set (in-process or Redis,
+TOKEN_REVOCATION_BACKEND) so a revoked token is rejected without a database
+read. The set is only a fast path: the rotation query itself refuses revoked
+families, so revocation is immediate even across workers without Redis.
+
+Family documents expire through a TTL index on ``expires_at`` (declared on
+RefreshTokenFamily), which moves forward with every rotation.
+"""
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+try:
+    from backend.services.redis_client import get_redis
+except ImportError:
+    try:
+        from services.redis_client import get_redis
+    except ImportError:
+        from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "refresh_token_families"
+BACKEND = os.getenv("TOKEN_REVOCATION_BACKEND", "memory").strip().lower()
+REDIS_PREFIX = "revoked_family:"
+MAX_MEMORY_ENTRIES = 100_000
+
+
+class RefreshTokenReused(Exception):
+    """A rotated refresh token was presented again; its family is now revoked"""
+
+
+class MemoryRevocationSet:
+    def __init__(self, max_entries: int = MAX_MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        # family id → monotonic time after which the entry can be forgotten
+        self._entries: Dict[str, float] = {}
+
+    async def contains(self, family_id: str) -> bool:
+        until = self._entries.get(family_id)
+        if until is None:
+            return False
+        if until <= time.monotonic():
+            del self._entries[family_id]
+            return False
+        return True
+
+    async def add(self, family_id: str, ttl_s: float) -> None:
+        self._entries[family_id] = time.monotonic() + ttl_s
+        if len(self._entries) > self.max_entries:
+            now = time.monotonic()
+            for key in [k for k, until in self._entries.items() if until <= now]:
+                del self._entries[key]
+            # The database check still rejects anything dropped here
+            while len(self._entries) > self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+
+
+class RedisRevocationSet:
+    def __init__(self, client):
+        self.client = client
+
+    async def contains(self, family_id: str) -> bool:
+        try:
+            return bool(await self.client.exists(REDIS_PREFIX + family_id))
+        except Exception as e:
+            logger.warning(f"Revocation set read failed: {str(e)}")
+            return False
+
+    async def add(self, family_id: str, ttl_s: float) -> None:
+        try:
+            await self.client.set(REDIS_PREFIX + family_id, "1", ex=max(int(ttl_s), 1))
+        except Exception as e:
+            logger.warning(f"Revocation set write failed: {str(e)}")
+
+
+def _build():
+    if BACKEND == "redis":
+        client = get_redis()
+        if client is not None:
+            return RedisRevocationSet(client)
+        logger.warning("TOKEN_REVOCATION_BACKEND=redis but Redis is not configured; using the in-process set")
+    return MemoryRevocationSet()
+
+
+revoked = _build()
+
+
+def _ttl_s(expires_at: Optional[datetime]) -> float:
+    if expires_at is None:
+        return 0.0
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return max((expires_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+async def start_family(db, user_id: str, lifetime: timedelta) -> Tuple[str, str]:
+    """New family on login. Returns (family id, jti of its first token)."""
+    now = datetime.now(timezone.utc)
+    family_id, jti = str(uuid.uuid4()), str(uuid.uuid4())
+    await db[COLLECTION].insert_one({
+        "_id": family_id,
+        "user_id": user_id,
+        "current_jti": jti,
+        "created_at": now,
+        "rotated_at": None,
+        "expires_at": now + lifetime,
+        "revoked_at": None,
+        "revoked_reason": None,
+    })
+    return family_id, jti
+
+
+async def rotate(db, family_id: str, jti: str, lifetime: timedelta) -> Optional[Tuple[str, str]]:
+    """
+    Swaps the family's current token. Returns (user id, new jti), None if the
+    family is unknown or revoked. Raises RefreshTokenReused for a stale jti.
+    """
+    if await revoked.contains(family_id):
+        return None
+
+    now = datetime.now(timezone.utc)
+    new_jti = str(uuid.uuid4())
+    family = await db[COLLECTION].find_one_and_update(
+        {"_id": family_id, "current_jti": jti, "revoked_at": None},
+        {"$set": {"current_jti": new_jti, "rotated_at": now, "expires_at": now + lifetime}},
+        projection={"user_id": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if family is not None:
+        return family["user_id"], new_jti
+
+    # Slow path: tell an unknown / revoked family from a replayed token
+    family = await db[COLLECTION].find_one({"_id": family_id}, {"revoked_at": 1, "expires_at": 1})
+    if family is None:
+        return None
+    if family.get("revoked_at") is None:
+        await revoke_family(db, family_id, "reuse")
+        logger.warning(f"Refresh token reuse detected, family {family_id} revoked")
+        raise RefreshTokenReused()
+    await revoked.add(family_id, _ttl_s(family.get("expires_at")))
+    return None
+
+
+async def revoke_family(db, family_id: str, reason: str) -> None:
+    family = await db[COLLECTION].find_one_and_update(
+        {"_id": family_id, "revoked_at": None},
+        {"$set": {"revoked_at": datetime.now(timezone.utc), "revoked_reason": reason}},
+        projection={"expires_at": 1},
+    )
+    if family is not None:
+        await revoked.add(family_id, _ttl_s(family.get("expires_at")))
+
+
+async def revoke_user(db, user_id: str, reason: str) -> int:
+    """Revokes every live family of a user (account deletion, password change)"""
+    count = 0
+    cursor = db[COLLECTION].find({"user_id": user_id, "revoked_at": None}, {"_id": 1})
+    async for family in cursor:
+        await revoke_family(db, family["_id"], reason)
+        count += 1
+    return count
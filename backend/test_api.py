@@ -6,9 +6,33 @@
 import asyncio
 import httpx
 import json
+import os
+import zlib
 from datetime import datetime, timezone
 
 BASE_URL = "http://localhost:8000/api"
+API_HEADERS = {"X-API-Key": os.getenv("API_KEY", "default-api-key-change-in-production")}
+
+
+async def _login_new_user(client: httpx.AsyncClient) -> dict:
+    """Регистрирует пользователя и возвращает ответ /auth/login"""
+    credentials = {
+        "email": f"testuser_{datetime.now().timestamp()}@example.com",
+        "password": "testpassword123",
+    }
+    response = await client.post(
+        f"{BASE_URL}/auth/register",
+        json={**credentials, "display_name": "Test User"},
+        headers=API_HEADERS,
+    )
+    assert response.status_code == 200, response.text
+    response = await client.post(f"{BASE_URL}/auth/login", json=credentials, headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _auth_headers(token_data: dict) -> dict:
+    return {**API_HEADERS, "Authorization": f"Bearer {token_data['access_token']}"}
 
 
 async def test_health_check():
@@ -127,6 +151,130 @@ async def test_templates():
         return response.status_code == 200
 
 
+async def test_refresh_rotation():
+    """Тест ротации refresh токена и обнаружения повторного использования"""
+    async with httpx.AsyncClient() as client:
+        first = (await _login_new_user(client))["refresh_token"]
+
+        # Каждый refresh выдаёт новый refresh токен
+        response = await client.post(f"{BASE_URL}/auth/refresh", json={"refresh_token": first}, headers=API_HEADERS)
+        print(f"Refresh: {response.status_code}")
+        if response.status_code != 200:
+            return False
+        second = response.json()["refresh_token"]
+        if second == first:
+            return False
+
+        # Старый токен уже использован: отказ и отзыв всей цепочки
+        response = await client.post(f"{BASE_URL}/auth/refresh", json={"refresh_token": first}, headers=API_HEADERS)
+        print(f"Reuse of rotated token: {response.status_code}")
+        if response.status_code != 401:
+            return False
+        response = await client.post(f"{BASE_URL}/auth/refresh", json={"refresh_token": second}, headers=API_HEADERS)
+        print(f"Refresh after reuse: {response.status_code}")
+        return response.status_code == 401
+
+
+async def test_chunked_upload():
+    """Тест загрузки IMU-лога по частям: докачка после обрыва и проверка CRC32"""
+    async with httpx.AsyncClient() as client:
+        headers = _auth_headers(await _login_new_user(client))
+        # Уникальное содержимое, чтобы не попасть в дедупликацию
+        content = "".join(
+            f"{i * 10},0.01,0.02,0.98,0.1,0.2,0.3\n" for i in range(2000)
+        ).encode() + f"# {datetime.now().timestamp()}\n".encode()
+        crc32 = f"{zlib.crc32(content) & 0xFFFFFFFF:08x}"
+        half = len(content) // 2
+
+        response = await client.post(
+            f"{BASE_URL}/imu/uploads",
+            json={"filename": "test_chunked.txt", "size_bytes": len(content), "crc32": crc32},
+            headers=headers,
+        )
+        print(f"Init Upload: {response.status_code}")
+        if response.status_code != 201:
+            return False
+        upload_id = response.json()["upload_id"]
+        url = f"{BASE_URL}/imu/uploads/{upload_id}"
+
+        response = await client.put(url, params={"offset": 0}, content=content[:half], headers=headers)
+        print(f"First Chunk: {response.status_code}")
+        if response.status_code != 200 or response.json()["offset"] != half:
+            return False
+
+        # Часть с неверным смещением отклоняется, сервер сообщает, откуда продолжать
+        response = await client.put(url, params={"offset": half + 1}, content=content[half:], headers=headers)
+        print(f"Wrong Offset: {response.status_code}")
+        if response.status_code != 409:
+            return False
+
+        # Докачка после обрыва: смещение берётся у сервера
+        response = await client.get(url, headers=headers)
+        offset = response.json()["offset"]
+        response = await client.put(url, params={"offset": offset}, content=content[offset:], headers=headers)
+        print(f"Resumed Chunk: {response.status_code}")
+        if response.status_code != 200 or response.json()["offset"] != len(content):
+            return False
+
+        response = await client.post(f"{url}/complete", json={"crc32": "00000000"}, headers=headers)
+        print(f"Complete with wrong CRC32: {response.status_code}")
+        if response.status_code != 422:
+            return False
+        response = await client.post(f"{url}/complete", json={"crc32": crc32}, headers=headers)
+        print(f"Complete: {response.status_code}")
+        if response.status_code != 201:
+            return False
+        data = response.json()
+        print(json.dumps(data, indent=2))
+        return data["size_bytes"] == len(content) and data["crc32"] == crc32
+
+
+async def test_cursor_pagination():
+    """Тест постраничного списка тренировок по курсору"""
+    async with httpx.AsyncClient() as client:
+        headers = _auth_headers(await _login_new_user(client))
+        created = set()
+        for i in range(5):
+            response = await client.post(
+                f"{BASE_URL}/workouts",
+                json={"title": f"Workout {i}", "items": []},
+                headers=headers,
+            )
+            if response.status_code not in [200, 201]:
+                print(f"Create Workout: {response.status_code}")
+                return False
+            created.add(response.json()["_id"])
+
+        # Проход по всем страницам: без пропусков и повторов
+        seen, cursor, pages = [], None, 0
+        while True:
+            params = {"page_size": 2, "sort_by": "title", "sort_order": "asc"}
+            if cursor:
+                params["cursor"] = cursor
+            response = await client.get(f"{BASE_URL}/workouts", params=params, headers=headers)
+            if response.status_code != 200:
+                print(f"Get Workouts Page: {response.status_code}")
+                return False
+            data = response.json()
+            seen.extend(item["_id"] for item in data["items"])
+            pages += 1
+            cursor = data.get("next_cursor")
+            if not cursor:
+                break
+        print(f"Pages: {pages}, workouts: {len(seen)}")
+        if len(seen) != len(set(seen)) or set(seen) != created:
+            return False
+
+        # Поле сортировки вне белого списка и испорченный курсор отклоняются
+        response = await client.get(f"{BASE_URL}/workouts", params={"sort_by": "description"}, headers=headers)
+        print(f"Unknown sort_by: {response.status_code}")
+        if response.status_code != 400:
+            return False
+        response = await client.get(f"{BASE_URL}/workouts", params={"cursor": "not-a-cursor"}, headers=headers)
+        print(f"Broken cursor: {response.status_code}")
+        return response.status_code == 400
+
+
 async def run_all_tests():
     """Запуск всех тестов"""
     print("=" * 60)
@@ -139,7 +287,10 @@ async def run_all_tests():
         ("Waitlist", test_waitlist),
         ("Exercises", test_exercises),
         ("Authentication", test_auth),
-        ("Templates", test_templates)
+        ("Templates", test_templates),
+        ("Refresh Rotation", test_refresh_rotation),
+        ("Chunked Upload", test_chunked_upload),
+        ("Cursor Pagination", test_cursor_pagination)
     ]
     
     results = []
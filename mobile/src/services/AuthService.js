@@ -78,8 +78,12 @@ const handleTokenRefresh = async () => {
       isRefreshToken: true,
     });
 
-    const { access_token } = response;
+    const { access_token, refresh_token } = response;
     await AsyncStorage.setItem('accessToken', access_token);
+    // Refresh tokens are single-use: the server rotates them on every refresh
+    if (refresh_token) {
+      await AsyncStorage.setItem('refreshToken', refresh_token);
+    }
     return true;
   } catch (error) {
     console.error('Token refresh failed:', error);